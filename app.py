@@ -1,8 +1,39 @@
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import getpass
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
 from chains.basic_qa import ask_question
 from chains.conversational import chat_with_memory
 from chains.parallel_analysis import analyze_from_multiple_perspectives
 from chains.structured_analysis import analyze_topic
-from config.gemini_setup import get_gemini_model, get_topic
+from config.gemini_setup import get_topic
+from config.scheduler import get_scheduler
+from utils.call_metrics import get_call_log
+
+# Batch calls queue behind interactive ones sharing the API key
+BATCH_PRIORITY = "batch"
+
+# Batch row modes, with the app's mode names accepted as aliases
+BATCH_MODES = {
+    "quick": "quick", "quick answer": "quick",
+    "deep": "deep", "deep dive": "deep", "structured": "deep",
+    "parallel": "parallel", "multiple viewpoints": "parallel",
+    "tutor": "tutor", "tutor mode": "tutor", "chat": "tutor",
+}
+
+def get_api_key():
+    """Google API key from the environment, or ask for it."""
+    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+    if not api_key and sys.stdin.isatty():
+        api_key = getpass.getpass("Your Google API Key: ").strip()
+    return api_key
 
 def show_menu():
     print("\nMenu:")
@@ -15,6 +46,10 @@ def show_menu():
 def main():
     """Main Application Loop."""
     topic = get_topic()
+    api_key = get_api_key()
+    if not api_key:
+        print("Set GOOGLE_API_KEY to use the assistant.")
+        return
     print(f"🤖 Welcome to your AI Learning assistant!")
     print(f"Your current topic is: {topic}")
 
@@ -24,17 +59,17 @@ def main():
 
         if choice == '1':
                 question = input("Enter your question: ")
-                response = ask_question(question)
+                response = ask_question(question, api_key)
                 print(f"Response: {response}")
 
         elif choice == '2':
                 question = input("Enter a topic for structured analysis: ")
-                response = analyze_topic(question)
+                response = analyze_topic(question, api_key)
                 print(f"Structured Analysis Response: {response}")
 
         elif choice == '3':
                 question = input("Enter a topic for parallel analysis: ")
-                results = analyze_from_multiple_perspectives(question)
+                results = analyze_from_multiple_perspectives(question, api_key)
                 for perspective, response in results.items():
                     print(f"{perspective.capitalize()} perspective:")
                     print(response.content)
@@ -46,7 +81,7 @@ def main():
                     question = input("You: ")
                     if question.lower() == 'exit':
                         break
-                    response = chat_with_memory(question)
+                    response = chat_with_memory(question, api_key)
                     print(f"Tutor: {response}")
 
         elif choice == '5':
@@ -56,6 +91,210 @@ def main():
         else:
                 print("Invalid choice. Please select a valid option.")
 
+def read_rows(path: str, fmt: Optional[str], default_mode: str) -> Iterator[Dict]:
+    """Questions from a JSONL or CSV file, or stdin for "-".
+
+    Each row has a question and optionally an id, a mode and a session (tutor
+    rows sharing a session are asked in order with one memory). Rows without
+    an id are numbered by position, so keep the input stable when resuming.
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    source = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if fmt == "csv":
+            records = csv.DictReader(source)
+        else:
+            records = (json.loads(line) for line in source if line.strip())
+        for number, record in enumerate(records, 1):
+            question = (record.get("question") or "").strip()
+            mode_name = (record.get("mode") or default_mode).strip().lower()
+            mode = BATCH_MODES.get(mode_name)
+            row = {"id": str(record.get("id") or number), "question": question, "mode": mode,
+                   "session": record.get("session") or None}
+            if not question:
+                row["error"] = "Missing question"
+            elif mode is None:
+                row["error"] = f"Unknown mode: {mode_name}"
+            yield row
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """IDs already answered in an earlier run's output; failed rows are retried."""
+    done = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short when the last run was stopped
+                if result.get("status") == "ok":
+                    done.add(str(result["id"]))
+    except OSError:
+        pass
+    return done
+
+def answer_row(row: Dict, api_key: str):
+    """Run one row through the same chain the app uses for its mode."""
+    question = row["question"]
+    if row["mode"] == "quick":
+        return ask_question(question, api_key, priority=BATCH_PRIORITY)
+    if row["mode"] == "deep":
+        return analyze_topic(question, api_key, priority=BATCH_PRIORITY).model_dump()
+    if row["mode"] == "parallel":
+        results = analyze_from_multiple_perspectives(question, api_key, priority=BATCH_PRIORITY)
+        return {perspective: response.content for perspective, response in results.items()}
+    return chat_with_memory(question, api_key, session_id=f"batch:{row['session'] or row['id']}",
+                            priority=BATCH_PRIORITY)
+
+def run_group(rows: List[Dict], api_key: str, stop: Optional[threading.Event] = None) -> Iterator[Dict]:
+    """Answer a group of rows in order, yielding a result per row; stop ends it before the next row."""
+    for row in rows:
+        if stop is not None and stop.is_set():
+            return
+        result = {"id": row["id"], "mode": row["mode"], "question": row["question"]}
+        start = time.perf_counter()
+        try:
+            result.update(status="ok", answer=answer_row(row, api_key))
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        result["latency"] = round(time.perf_counter() - start, 3)
+        yield result
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_batch(args) -> int:
+    """Answer every input row with a bounded worker pool, appending results as JSONL."""
+    api_key = args.api_key or get_api_key()
+    if not api_key:
+        print("Set GOOGLE_API_KEY or pass --api-key.", file=sys.stderr)
+        return 2
+    if args.topic:
+        os.environ["CURRENT_TOPIC"] = args.topic
+    # Stay within the configured rate limits
+    scheduler = get_scheduler()
+    if args.rpm:
+        scheduler.rpm = args.rpm
+    if args.tpm:
+        scheduler.tpm = args.tpm
+
+    done = load_checkpoint(args.output) if args.resume else set()
+    rows = list(read_rows(args.input, args.format, args.mode))
+    pending = [row for row in rows if row["id"] not in done]
+
+    tokens = {"prompt": 0, "completion": 0, "cost": 0.0}
+    tokens_lock = threading.Lock()
+
+    def count_tokens(call: Dict):
+        with tokens_lock:
+            tokens["prompt"] += call["prompt_tokens"]
+            tokens["completion"] += call["completion_tokens"]
+            tokens["cost"] += call.get("cost", 0.0)
+
+    get_call_log().add_listener(count_tokens)
+
+    invalid = [row for row in pending if "error" in row]
+    pending = [row for row in pending if "error" not in row]
+
+    # Tutor rows of one session run in order in a single task; every other row is its own task
+    groups: Dict[str, List[Dict]] = {}
+    for row in pending:
+        key = f"session:{row['session']}" if row["mode"] == "tutor" and row["session"] else f"row:{row['id']}"
+        groups.setdefault(key, []).append(row)
+
+    latencies = []
+    errors = len(invalid)
+    started = time.perf_counter()
+    output = open(args.output, "a" if args.resume else "w", encoding="utf-8")
+    for row in invalid:
+        output.write(json.dumps({"id": row["id"], "mode": row["mode"], "question": row["question"],
+                                 "status": "error", "error": row["error"], "latency": 0.0}, ensure_ascii=False) + "\n")
+    output.flush()
+    # Workers queue each result as it finishes; only this thread writes the output
+    results: "queue.Queue[Dict]" = queue.Queue()
+    stop = threading.Event()
+
+    def run_into_queue(group: List[Dict]):
+        for result in run_group(group, api_key, stop):
+            results.put(result)
+
+    def write_result(result: Dict):
+        nonlocal errors
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        latencies.append(result["latency"])
+        if result["status"] != "ok":
+            errors += 1
+        if not args.quiet:
+            print(f"[{len(latencies)}/{len(pending)}] {result['id']} {result['status']} "
+                  f"{result['latency']:.2f}s", file=sys.stderr)
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        futures = [executor.submit(run_into_queue, group) for group in groups.values()]
+        while len(latencies) < len(pending):
+            try:
+                write_result(results.get(timeout=0.5))
+            except queue.Empty:
+                if all(future.done() for future in futures) and results.empty():
+                    break
+        for future in futures:
+            future.result()
+    except KeyboardInterrupt:
+        print("Stopping after the rows in progress; finished rows are saved, rerun with --resume to continue.",
+              file=sys.stderr)
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        while not results.empty():
+            write_result(results.get())
+        return 130
+    finally:
+        executor.shutdown(wait=True)
+        output.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "rows": len(rows),
+        "skipped": len(rows) - len(pending) - len(invalid),
+        "answered": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "rows_per_minute": round(len(latencies) / elapsed * 60, 1) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_max": round(max(latencies, default=0.0), 3),
+        "prompt_tokens": tokens["prompt"],
+        "completion_tokens": tokens["completion"],
+        "cost_usd": round(tokens["cost"], 4),
+    }
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    return 1 if errors else 0
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="AI Learning assistant")
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="Answer questions from a JSONL or CSV file without the UI")
+    batch.add_argument("input", help="Input file, or - for stdin")
+    batch.add_argument("-o", "--output", default="batch_results.jsonl", help="Results JSONL file")
+    batch.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from the file extension)")
+    batch.add_argument("--mode", default="quick", help="Mode for rows without one (quick, deep, parallel, tutor)")
+    batch.add_argument("--workers", type=int, default=4, help="Questions answered at once")
+    batch.add_argument("--resume", action="store_true", help="Skip rows already answered in the output file")
+    batch.add_argument("--topic", help="Learning topic (default: CURRENT_TOPIC)")
+    batch.add_argument("--rpm", type=int, help="Requests per minute per API key")
+    batch.add_argument("--tpm", type=int, help="Tokens per minute per API key")
+    batch.add_argument("--api-key", help="Google API key (default: GOOGLE_API_KEY)")
+    batch.add_argument("-q", "--quiet", action="store_true", help="Only print the summary")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "batch":
+        sys.exit(run_batch(args))
     main()
-    
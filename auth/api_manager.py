@@ -1,5 +1,6 @@
 import streamlit as st
 from auth.user_auth import UserAuth
+from config.gemini_setup import warm_up_model
 
 def get_user_api_key():
     """Get user's API key with persistence across sessions"""
@@ -22,6 +23,10 @@ def get_user_api_key():
     
     # Show current status if API key exists
     if st.session_state.user_api_key:
+        # Build the pooled client once per key so the first question is fast
+        if st.session_state.get("warmed_api_key") != st.session_state.user_api_key:
+            warm_up_model(st.session_state.user_api_key)
+            st.session_state.warmed_api_key = st.session_state.user_api_key
         st.sidebar.success("✅ API Key Connected")
         if saved_api_key == st.session_state.user_api_key:
             st.sidebar.info("🔐 Using saved API key")
@@ -63,6 +68,8 @@ def get_user_api_key():
         # Validate API key format
         if api_key.startswith("AIza") and len(api_key) > 30:
             st.session_state.user_api_key = api_key
+            warm_up_model(api_key)
+            st.session_state.warmed_api_key = api_key
             
             # Save to user profile if requested
             if save_key:
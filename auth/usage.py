@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import atexit
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import streamlit as st
+from utils.call_metrics import get_call_log
+
+QUOTA_OK = "ok"
+QUOTA_SOFT = "soft"
+QUOTA_HARD = "hard"
+
+
+def _setting(name: str, default: str) -> str:
+    """Read a setting from Streamlit secrets, then the environment"""
+    try:
+        if name in st.secrets:
+            return str(st.secrets[name])
+    except Exception:
+        pass
+    return os.getenv(name, default)
+
+
+class UsageTracker:
+    """Per-user, per-day token and request counters.
+
+    Counts come from the call log and are kept in memory; they are written
+    to usage_file (next to users.json) in batches, every flush_every calls or
+    flush_interval seconds, rather than once per call. Days older than
+    retention_days are dropped on write.
+    """
+
+    def __init__(self, usage_file: str = "auth/usage.json", flush_interval: float = 10.0,
+                 flush_every: int = 50, retention_days: int = 30):
+        self.usage_file = usage_file
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], List[int]] = {}
+        self._pending_calls = 0
+        self._flushed_at = time.monotonic()
+        self.usage = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        try:
+            with open(self.usage_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, call: Dict):
+        """Count one call record; calls without a user are not counted"""
+        user = call.get("user")
+        if not user:
+            return
+        day = datetime.fromtimestamp(call.get("ts", time.time())).date().isoformat()
+        tokens = call.get("prompt_tokens", 0) + call.get("completion_tokens", 0)
+        with self._lock:
+            day_usage = self.usage.setdefault(user, {}).setdefault(day, {"tokens": 0, "requests": 0})
+            day_usage["tokens"] += tokens
+            day_usage["requests"] += 1
+            pending = self._pending.setdefault((user, day), [0, 0])
+            pending[0] += tokens
+            pending[1] += 1
+            self._pending_calls += 1
+            due = (self._pending_calls >= self.flush_every
+                   or time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Merge pending counts into the usage file"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._pending_calls = 0
+            self._flushed_at = time.monotonic()
+            # Merge into what is on disk in case another process also writes it
+            stored = self._load()
+            for (user, day), (tokens, requests) in pending.items():
+                day_usage = stored.setdefault(user, {}).setdefault(day, {"tokens": 0, "requests": 0})
+                day_usage["tokens"] += tokens
+                day_usage["requests"] += requests
+            oldest = (date.today() - timedelta(days=self.retention_days)).isoformat()
+            for days in stored.values():
+                for day in [d for d in days if d < oldest]:
+                    del days[day]
+            self.usage = stored
+            try:
+                os.makedirs(os.path.dirname(self.usage_file) or ".", exist_ok=True)
+                tmp_file = f"{self.usage_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(stored, f)
+                os.replace(tmp_file, self.usage_file)
+            except OSError:
+                pass
+
+    def get_usage(self, username: str, day: Optional[str] = None) -> Dict[str, int]:
+        """Tokens and requests for a user on a day (default today)"""
+        day = day or date.today().isoformat()
+        with self._lock:
+            return dict(self.usage.get(username, {}).get(day, {"tokens": 0, "requests": 0}))
+
+    def top_users(self, day: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """Users with the highest token use on a day (default today)"""
+        day = day or date.today().isoformat()
+        with self._lock:
+            rows = [{"user": user, **days[day]} for user, days in self.usage.items() if day in days]
+        return sorted(rows, key=lambda row: row["tokens"], reverse=True)[:limit]
+
+
+class QuotaPolicy:
+    """Daily soft and hard limits; 0 means no limit.
+
+    Past a soft limit, expensive modes are downgraded; past a hard limit,
+    requests are refused until the next day.
+    """
+
+    def __init__(self, soft_tokens: int = 0, hard_tokens: int = 0, soft_requests: int = 0, hard_requests: int = 0):
+        self.soft_tokens = soft_tokens
+        self.hard_tokens = hard_tokens
+        self.soft_requests = soft_requests
+        self.hard_requests = hard_requests
+
+    @staticmethod
+    def _over(value: int, limit: int) -> bool:
+        return bool(limit) and value >= limit
+
+    def status(self, usage: Dict[str, int]) -> str:
+        if self._over(usage["tokens"], self.hard_tokens) or self._over(usage["requests"], self.hard_requests):
+            return QUOTA_HARD
+        if self._over(usage["tokens"], self.soft_tokens) or self._over(usage["requests"], self.soft_requests):
+            return QUOTA_SOFT
+        return QUOTA_OK
+
+
+_usage_tracker = None
+_usage_lock = threading.Lock()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Get the process-wide usage tracker, subscribed to the call log"""
+    global _usage_tracker
+    if _usage_tracker is None:
+        with _usage_lock:
+            if _usage_tracker is None:
+                tracker = UsageTracker(
+                    usage_file=os.getenv("USAGE_FILE", "auth/usage.json"),
+                    flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "10")),
+                    flush_every=int(os.getenv("USAGE_FLUSH_EVERY", "50")),
+                    retention_days=int(os.getenv("USAGE_RETENTION_DAYS", "30"))
+                )
+                get_call_log().add_listener(tracker.record)
+                atexit.register(tracker.flush)
+                _usage_tracker = tracker
+    return _usage_tracker
+
+
+def get_quota_policy() -> QuotaPolicy:
+    """Daily quotas from secrets or environment (USER_DAILY_*); unset means unlimited"""
+    return QuotaPolicy(
+        soft_tokens=int(_setting("USER_DAILY_TOKENS_SOFT", "0")),
+        hard_tokens=int(_setting("USER_DAILY_TOKENS_HARD", "0")),
+        soft_requests=int(_setting("USER_DAILY_REQUESTS_SOFT", "0")),
+        hard_requests=int(_setting("USER_DAILY_REQUESTS_HARD", "0"))
+    )
+
+
+def get_quota_status(username: str) -> str:
+    """QUOTA_OK, QUOTA_SOFT or QUOTA_HARD for a user today"""
+    return get_quota_policy().status(get_usage_tracker().get_usage(username))
+
+
+def is_admin(username: Optional[str]) -> bool:
+    """Whether a user is listed in ADMIN_USERS (comma separated)"""
+    admins = {name.strip() for name in _setting("ADMIN_USERS", "").split(",") if name.strip()}
+    return bool(username) and username in admins
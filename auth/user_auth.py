@@ -2,6 +2,7 @@ import streamlit as st
 import hashlib
 import json
 import os
+import threading
 from datetime import datetime
 from typing import Dict, Optional
 
@@ -29,8 +30,11 @@ class UserAuth:
     def save_users(self):
         """Save users to JSON file"""
         try:
-            with open(self.users_file, 'w') as f:
+            # Write to a temp file and swap it in so concurrent readers never see a partial file
+            tmp_file = f"{self.users_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'w') as f:
                 json.dump(self.users, f, indent=2)
+            os.replace(tmp_file, self.users_file)
         except:
             pass
     
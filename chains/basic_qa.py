@@ -1,15 +1,80 @@
-from config.gemini_setup import get_gemini_model, get_topic
+from typing import AsyncIterator, Iterator, Optional
+from config.gemini_setup import get_scheduled_model, get_topic, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from chains.streaming import chunk_text
+from utils.response_cache import ResponseCache, lookup_response, store_response
+from utils.single_flight import flight_key, get_single_flight
+from utils.call_metrics import call_config
 from langchain_core.prompts import ChatPromptTemplate 
 
-def ask_question(question: str, api_key: str) -> str:
-    """Ask a question about the current learning topic."""
+MODE = "quick"
+# Bump when the prompt changes so cached answers from the old prompt are not reused
+PROMPT_VERSION = "1"
+
+def build_qa_chain(api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE):
+    """Build the Quick Answer chain."""
     template = ChatPromptTemplate.from_messages([
         ("system", " You are a helpful and fun tutor who understand the {topic} well. You will always respond in simple terms and explain the foundations of the {topic} clearly"),
         ("human" , "{question}")
     ])
     
-    chain = template | get_gemini_model(api_key=api_key)
+    return template | get_scheduled_model(MODE, model_name=model_name, temperature=temperature, api_key=api_key)
+
+def ask_question(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                 priority: Optional[str] = None) -> str:
+    """Ask a question about the current learning topic."""
+    topic = get_topic()
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        return cached
+    
+    config = call_config(topic, priority=priority)
+    
+    def answer():
+        chain = build_qa_chain(api_key, model_name, temperature)
+        response = chain.invoke({"question": question, "topic": topic}, config=config)
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION, response.content)
+        return response.content
+    
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    return get_single_flight().do(f"{key}:invoke", answer)
+
+def stream_question(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE) -> Iterator[str]:
+    """Ask a question and yield the answer as text chunks while it is generated."""
     topic = get_topic()
-    response = chain.invoke({"question": question, "topic": topic})
-    return response.content
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        yield cached
+        return
+    
+    # Built here: the stream itself runs on a single-flight thread
+    config = call_config(topic)
+    
+    def answer_chunks():
+        chain = build_qa_chain(api_key, model_name, temperature)
+        parts = []
+        for chunk in chain.stream({"question": question, "topic": topic}, config=config):
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                yield text
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION, "".join(parts))
+    
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    yield from get_single_flight().stream(f"{key}:stream", answer_chunks)
 
+async def astream_question(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE) -> AsyncIterator[str]:
+    """Async variant of stream_question."""
+    topic = get_topic()
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        yield cached
+        return
+    
+    chain = build_qa_chain(api_key, model_name, temperature)
+    parts = []
+    async for chunk in chain.astream({"question": question, "topic": topic}, config=call_config(topic)):
+        text = chunk_text(chunk)
+        if text:
+            parts.append(text)
+            yield text
+    store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION, "".join(parts))
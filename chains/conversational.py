@@ -1,23 +1,262 @@
-from config.gemini_setup import get_gemini_model, get_topic
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from config.gemini_setup import get_scheduled_model, get_topic, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from chains.streaming import chunk_text
+from chains.memory import TokenBudgetMemory, build_summarizer
+from utils.call_metrics import call_config
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from models.topic_analysis import TopicExplanation
-from langchain.memory import ConversationBufferMemory
 
-memory = ConversationBufferMemory(return_messages=True)
+MODE = "tutor"
 
-def chat_with_memory(question: str, api_key: str) -> str:
-    """Chat with memory about the current learning topic."""
+# Used by callers without a session of their own, such as the CLI
+DEFAULT_SESSION = "default"
+
+
+class ConversationEngine:
+    """Tutor memories keyed by session ID.
+
+    At most max_sessions memories are kept in RAM. The least recently used
+    session, or any idle for longer than idle_ttl, is written to disk and
+    loaded back transparently on its next turn. Sessions in the middle of a
+    turn or a background summary are never written out, and files on disk
+    are deleted after spill_ttl. Safe to share between Streamlit script
+    threads.
+    """
+
+    def __init__(self, max_sessions: int = 200, idle_ttl: float = 3600.0, spill_dir: str = ".cache/sessions",
+                 spill_ttl: float = 7 * 24 * 3600.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        self._sessions = OrderedDict()
+        # Turns currently running, per session
+        self._in_use: Dict[str, int] = {}
+        self._last_purge = 0.0
+        self._lock = threading.RLock()
+
+    def _spill_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode()).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{name}.json")
+
+    def _spill(self, session_id: str, memory: TokenBudgetMemory):
+        """Write a session's memory to disk; empty memories are just dropped"""
+        path = self._spill_path(session_id)
+        if memory.is_empty():
+            self._remove_spilled(path)
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(memory.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_spilled(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read_spilled(self, session_id: str) -> Optional[TokenBudgetMemory]:
+        """Read a session previously written to disk, unless it has expired"""
+        path = self._spill_path(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.spill_ttl:
+                self._remove_spilled(path)
+                return None
+            with open(path) as f:
+                return TokenBudgetMemory.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load_spilled(self, session_id: str) -> Optional[TokenBudgetMemory]:
+        """Load and remove a session previously written to disk"""
+        memory = self._read_spilled(session_id)
+        if memory is not None:
+            self._remove_spilled(self._spill_path(session_id))
+        return memory
+
+    def _purge_spilled(self):
+        """Delete spill files older than spill_ttl, at most once per idle_ttl"""
+        now = time.time()
+        if now - self._last_purge < min(self.idle_ttl, self.spill_ttl):
+            return
+        self._last_purge = now
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.spill_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _is_busy(self, session_id: str, memory: TokenBudgetMemory) -> bool:
+        return self._in_use.get(session_id, 0) > 0 or memory.is_summarizing()
+
+    def _evict(self, now: float):
+        """Spill idle sessions and anything beyond max_sessions, skipping busy ones"""
+        for session_id, (memory, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_ttl and not self._is_busy(session_id, memory):
+                self._spill(session_id, self._sessions.pop(session_id)[0])
+        # Oldest first; if every session is busy the limit is briefly exceeded
+        for session_id, (memory, _) in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not self._is_busy(session_id, memory):
+                self._spill(session_id, self._sessions.pop(session_id)[0])
+        self._purge_spilled()
+
+    def get_memory(self, session_id: str) -> TokenBudgetMemory:
+        """Get a session's memory, creating or reloading it as needed"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                memory = self._load_spilled(session_id) or TokenBudgetMemory()
+            else:
+                memory = entry[0]
+            self._sessions[session_id] = (memory, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return memory
+
+    def peek(self, session_id: str) -> Optional[TokenBudgetMemory]:
+        """Get a session's memory for display, without creating, reloading or touching it"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                return entry[0]
+        return self._read_spilled(session_id)
+
+    @contextmanager
+    def using(self, session_id: str) -> Iterator[TokenBudgetMemory]:
+        """Get a session's memory and keep it in RAM until the block exits"""
+        with self._lock:
+            self._in_use[session_id] = self._in_use.get(session_id, 0) + 1
+            memory = self.get_memory(session_id)
+        try:
+            yield memory
+        finally:
+            with self._lock:
+                count = self._in_use.pop(session_id) - 1
+                if count:
+                    self._in_use[session_id] = count
+
+    def reset_session(self, session_id: str) -> TokenBudgetMemory:
+        """Start a session over with an empty memory"""
+        with self._lock:
+            self.drop_session(session_id)
+            return self.get_memory(session_id)
+
+    def drop_session(self, session_id: str):
+        """Forget a session, in RAM and on disk"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._remove_spilled(self._spill_path(session_id))
+
+    def save_session(self, session_id: str) -> Dict:
+        """Snapshot a session's memory as plain data"""
+        return self.get_memory(session_id).to_dict()
+
+    def restore_session(self, session_id: str, snapshot: Dict) -> TokenBudgetMemory:
+        """Replace a session's memory with a snapshot from save_session"""
+        memory = TokenBudgetMemory.from_dict(snapshot)
+        with self._lock:
+            self.drop_session(session_id)
+            self._sessions[session_id] = (memory, time.monotonic())
+            self._evict(time.monotonic())
+        return memory
+
+    def restore_from_messages(self, session_id: str, messages: List[Dict]) -> TokenBudgetMemory:
+        """Rebuild a session's memory from saved chat messages.
+
+        Only plain-text exchanges are replayed; Deep Dive and Multiple Viewpoints
+        answers are left out of the tutor's history.
+        """
+        with self._lock:
+            memory = self.reset_session(session_id)
+        question = None
+        for message in messages:
+            if message["role"] == "user":
+                question = message["content"]
+            elif question is not None and "type" not in message:
+                memory.save_context({"input": question}, {"output": message["content"]})
+                question = None
+        return memory
+
+    def session_count(self) -> int:
+        """Number of sessions held in RAM"""
+        with self._lock:
+            return len(self._sessions)
+
+
+conversation_engine = ConversationEngine(
+    max_sessions=int(os.getenv("CONVERSATION_MAX_SESSIONS", "200")),
+    idle_ttl=float(os.getenv("CONVERSATION_IDLE_TTL", "3600")),
+    spill_dir=os.getenv("CONVERSATION_SPILL_DIR", ".cache/sessions"),
+    spill_ttl=float(os.getenv("CONVERSATION_SPILL_TTL", str(7 * 24 * 3600)))
+)
+
+
+def get_conversation_engine() -> ConversationEngine:
+    """Get the process-wide conversation engine."""
+    return conversation_engine
+
+def build_tutor_chain(api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE):
+    """Build the Interactive Tutor chain with a chat history placeholder."""
     template = ChatPromptTemplate.from_messages([
         ("system", " You are a helpful and fun tutor who understands the {topic} well. You will always respond in simple terms and explain the foundations of the {topic} clearly. "),
         ("placeholder","{chat_history}"),
         ("human", "{question}")
     ])
-    chain = template | get_gemini_model(api_key=api_key) 
-    
+    return template | get_scheduled_model(MODE, model_name=model_name, temperature=temperature, api_key=api_key)
+
+def chat_with_memory(question: str, api_key: str, session_id: str = DEFAULT_SESSION, model_name: str = DEFAULT_MODEL,
+                     temperature: float = DEFAULT_TEMPERATURE, priority: Optional[str] = None) -> str:
+    """Chat with memory about the current learning topic."""
+    chain = build_tutor_chain(api_key, model_name, temperature)
     topic = get_topic()
-    chat_history = memory.chat_memory.messages
-    response = chain.invoke({"question": question, "topic": topic, "chat_history": chat_history})
-    memory.save_context({"input": question}, {"output": response.content})
-    
-    return response.content
\ No newline at end of file
+    config = call_config(topic, priority=priority)
+    with conversation_engine.using(session_id) as memory:
+        chat_history = memory.load_messages()
+        response = chain.invoke({"question": question, "topic": topic, "chat_history": chat_history},
+                                config=config)
+        memory.save_context({"input": question}, {"output": response.content},
+                            summarizer=build_summarizer(api_key, model_name, config))
+
+    return response.content
+
+def stream_with_memory(question: str, api_key: str, session_id: str = DEFAULT_SESSION, topic: Optional[str] = None,
+                       model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE) -> Iterator[str]:
+    """Chat with memory and yield the answer as text chunks.
+
+    The full answer is saved to the memory once the stream is complete; older
+    turns are then summarized in the background.
+    """
+    chain = build_tutor_chain(api_key, model_name, temperature)
+    topic = topic or get_topic()
+    config = call_config(topic)
+    with conversation_engine.using(session_id) as memory:
+        chat_history = memory.load_messages()
+        parts = []
+        for chunk in chain.stream({"question": question, "topic": topic, "chat_history": chat_history},
+                                  config=config):
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                yield text
+        memory.save_context({"input": question}, {"output": "".join(parts)},
+                            summarizer=build_summarizer(api_key, model_name, config))
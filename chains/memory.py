@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from config.gemini_setup import get_scheduled_model, DEFAULT_MODEL
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+DEFAULT_KEEP_TURNS = int(os.getenv("MEMORY_KEEP_TURNS", "4"))
+
+# Summaries are small and infrequent; two workers are plenty for the whole process
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+Summarizer = Callable[[str, List[BaseMessage]], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate tokens (about four characters per token for English)"""
+    return len(text) // 4 + 1 if text else 0
+
+
+def build_summarizer(api_key: str, model_name: str = DEFAULT_MODEL, config: Optional[Dict] = None) -> Summarizer:
+    """Build a function that folds messages into a running summary.
+
+    config is the caller's run config, built on the calling thread, so
+    summaries made on the background worker are tagged with its user,
+    session and topic.
+    """
+    template = ChatPromptTemplate.from_messages([
+        ("system", "You maintain a running summary of a tutoring conversation. Extend the existing summary with the new messages. "
+                   "Keep the topics covered, what the learner understood or struggled with, and any open questions. Stay under 200 words."),
+        ("human", "Existing summary:\n{summary}\n\nNew messages:\n{messages}")
+    ])
+    # Low temperature keeps summaries stable from one update to the next
+    chain = template | get_scheduled_model("summary", model_name=model_name, temperature=0.2, api_key=api_key)
+
+    def summarize(summary: str, messages: List[BaseMessage]) -> str:
+        response = chain.invoke({"summary": summary or "(none)", "messages": get_buffer_string(messages)},
+                                config=config)
+        return response.content
+
+    return summarize
+
+
+class TokenBudgetMemory:
+    """Conversation memory that keeps recent turns verbatim within a token budget.
+
+    Turns older than the last keep_turns (or beyond the budget) are folded into a
+    rolling summary by a background worker, so saving a turn never waits on the
+    model. Until a summary update lands, the prompt simply carries the extra
+    turns verbatim.
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_TOKEN_BUDGET, keep_turns: int = DEFAULT_KEEP_TURNS):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.messages: List[BaseMessage] = []
+        # Messages before this index are already folded into the summary
+        self.summarized_upto = 0
+        self.total_tokens = 0
+        # Bumped on clear() so a summary of the old conversation is discarded
+        self.generation = 0
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pending"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict:
+        """Serialize the memory to plain JSON-friendly data"""
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "keep_turns": self.keep_turns,
+                "summary": self.summary,
+                "messages": [{"type": m.type, "content": m.content} for m in self.messages],
+                "summarized_upto": self.summarized_upto,
+                "total_tokens": self.total_tokens
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TokenBudgetMemory":
+        """Rebuild a memory saved with to_dict"""
+        memory = cls(max_tokens=data["max_tokens"], keep_turns=data["keep_turns"])
+        memory.summary = data["summary"]
+        memory.messages = [
+            HumanMessage(content=m["content"]) if m["type"] == "human" else AIMessage(content=m["content"])
+            for m in data["messages"]
+        ]
+        memory.summarized_upto = data["summarized_upto"]
+        memory.total_tokens = data["total_tokens"]
+        return memory
+
+    def load_messages(self) -> List[BaseMessage]:
+        """Get the history to send with the next prompt"""
+        with self._lock:
+            history = list(self.messages[self.summarized_upto:])
+            if self.summary:
+                history.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        return history
+
+    def save_context(self, inputs: Dict[str, str], outputs: Dict[str, str], summarizer: Optional[Summarizer] = None):
+        """Add a turn and, if the history is over budget, schedule a summary update"""
+        human = HumanMessage(content=inputs["input"])
+        ai = AIMessage(content=outputs["output"])
+        with self._lock:
+            self.messages.extend([human, ai])
+            self.total_tokens += estimate_tokens(human.content) + estimate_tokens(ai.content)
+        if summarizer is not None:
+            self._maybe_summarize(summarizer)
+
+    def _fold_count(self) -> int:
+        """Count the oldest unsummarized messages that should go into the summary"""
+        recent = self.messages[self.summarized_upto:]
+        keep = self.keep_turns * 2
+        fold = max(len(recent) - keep, 0)
+        tokens = estimate_tokens(self.summary) + sum(estimate_tokens(m.content) for m in recent[fold:])
+        # Over budget even with only the last N turns: fold more, but always keep the latest turn
+        while tokens > self.max_tokens and fold < len(recent) - 2:
+            tokens -= estimate_tokens(recent[fold].content) + estimate_tokens(recent[fold + 1].content)
+            fold += 2
+        return fold
+
+    def _maybe_summarize(self, summarizer: Summarizer):
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                # A running update will re-check the budget when it finishes
+                return
+            fold = self._fold_count()
+            if not fold:
+                return
+            start = self.summarized_upto
+            to_fold = list(self.messages[start:start + fold])
+            self._pending = _summary_executor.submit(
+                self._summarize, summarizer, self.summary, to_fold, start + fold, self.generation
+            )
+
+    def _summarize(self, summarizer: Summarizer, summary: str, to_fold: List[BaseMessage], new_upto: int,
+                   generation: int):
+        try:
+            new_summary = summarizer(summary, to_fold)
+        except Exception:
+            # Keep the turns verbatim and try again after the next turn
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.summary = new_summary
+            self.summarized_upto = new_upto
+            self._pending = None
+        self._maybe_summarize(summarizer)
+
+    def is_empty(self) -> bool:
+        """True if nothing has been said yet"""
+        with self._lock:
+            return not self.messages and not self.summary
+
+    def is_summarizing(self) -> bool:
+        """True while a background summary update is running"""
+        pending = self._pending
+        return pending is not None and not pending.done()
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until any pending summary update has finished"""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout=timeout)
+
+    def clear(self):
+        """Forget the whole conversation"""
+        with self._lock:
+            self.summary = ""
+            self.messages = []
+            self.summarized_upto = 0
+            self.total_tokens = 0
+            self.generation += 1
+
+    def token_count(self) -> int:
+        """Estimated tokens the history currently adds to each prompt"""
+        with self._lock:
+            return estimate_tokens(self.summary) + sum(
+                estimate_tokens(m.content) for m in self.messages[self.summarized_upto:]
+            )
+
+    def tokens_saved(self) -> int:
+        """Estimated tokens per prompt saved compared with resending the full history"""
+        return max(self.total_tokens - self.token_count(), 0)
@@ -1,46 +1,195 @@
-from config.gemini_setup import get_gemini_model, get_topic
+import re
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
+from config.gemini_setup import get_scheduled_model, get_topic, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from chains.streaming import chunk_text
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from models.topic_analysis import TopicExplanation
 from langchain_core.runnables import RunnableParallel
+from langchain_core.messages import AIMessage
+from utils.response_cache import ResponseCache, lookup_response, store_response
+from utils.single_flight import flight_key, get_single_flight
+from utils.call_metrics import call_config
 
-def analyze_from_multiple_perspectives(question: str, api_key: str) -> dict:
+MODE = "parallel"
+# One request for all perspectives, used when a user is near their daily quota
+SINGLE_CALL_MODE = "parallel_single"
+# Bump when any perspective prompt changes
+PROMPT_VERSION = "1"
+
+PERSPECTIVE_PROMPTS = {
+    "simple": "You are a simple explainer who breaks down {topic} concepts into easy-to-understand parts for beginners. Use analogies and simple language.",
+    "technical": "You are a technical expert in {topic} who provides detailed and in-depth explanations with precise terminology. Use technical terms and provide comprehensive insights.",
+    "code": "You are a coding assistant who provides code examples and explanations related to {topic}. Focus on practical coding aspects and best practices.",
+    "history": "You are a historical analyst who explains the historical context and evolution of {topic}. Provide timelines and significant milestones.",
+}
+
+# Seconds a single perspective may take, from when it starts running, before it
+# is reported as timed out
+PERSPECTIVE_TIMEOUT = 60.0
+
+# Shared by all sessions. Abandoned branches are cancelled if still queued and
+# stop at their next chunk if streaming; a non-streaming call keeps its worker
+# until it returns
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="perspective")
+
+def build_perspective_chains(api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE) -> Dict:
+    """Build one chain per perspective, all sharing one pooled client."""
+    model = get_scheduled_model(MODE, model_name=model_name, temperature=temperature, api_key=api_key)
+    chains = {}
+    for perspective, system_prompt in PERSPECTIVE_PROMPTS.items():
+        template = ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            ("human", "{question}")
+        ])
+        chains[perspective] = template | model
+    return chains
+
+def analyze_from_multiple_perspectives(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                                       priority: Optional[str] = None) -> dict:
     """Analyze a question about the current learning topic from multiple expert perspectives simultaneously."""
+    topic = get_topic()
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        return {perspective: AIMessage(content=content) for perspective, content in cached.items()}
     
-    simple_template = ChatPromptTemplate.from_messages([
-        ("system", "You are a simple explainer who breaks down {topic} concepts into easy-to-understand parts for beginners. Use analogies and simple language."),
-        ("human", "{question}")
-    ])
+    config = call_config(topic, priority=priority)
+    
+    def analyze():
+        parallel_analysis = RunnableParallel(**build_perspective_chains(api_key, model_name, temperature))
+        responses = parallel_analysis.invoke({
+            "question": question,
+            "topic": topic
+        }, config=config)
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION,
+                       {perspective: chunk_text(response) for perspective, response in responses.items()})
+        return responses
+    
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    return get_single_flight().do(f"{key}:invoke", analyze)
 
-    technical_template = ChatPromptTemplate.from_messages([
-        ("system", "You are a technical expert in {topic} who provides detailed and in-depth explanations with precise terminology. Use technical terms and provide comprehensive insights."),
-        ("human", "{question}")
-    ])
-    code_template = ChatPromptTemplate.from_messages([
-        ("system", "You are a coding assistant who provides code examples and explanations related to {topic}. Focus on practical coding aspects and best practices."),
-        ("human", "{question}")
-    ])
+def iter_perspectives(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                      timeout: float = PERSPECTIVE_TIMEOUT, stream: bool = False,
+                      queue_timeout: Optional[float] = None) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield (perspective, content) pairs as each perspective finishes.
+
+    With stream=True, a perspective is yielded repeatedly with its text so far
+    and the last pair for it holds the complete answer. A perspective that has
+    not finished within timeout seconds of starting, or not started within
+    queue_timeout seconds (default timeout) because the shared workers are
+    busy, is yielded once with content None. A failing perspective yields its
+    error message instead of failing the rest.
+    """
+    topic = get_topic()
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        yield from cached.items()
+        return
+    
+    chains = build_perspective_chains(api_key, model_name, temperature)
+    inputs = {"question": question, "topic": topic}
+    events = queue.Queue()
+    # Branches nobody is waiting for any more
+    abandoned = set()
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    single_flight = get_single_flight()
+
+    def run_branch(perspective, chain, config):
+        if perspective in abandoned:
+            return
+        events.put((perspective, "started", None))
+        # Each perspective is its own flight
+        branch_key = f"{key}:{perspective}"
+        try:
+            if stream:
+                text = ""
+                chunks = single_flight.stream(f"{branch_key}:stream",
+                                              lambda: (chunk_text(c) for c in chain.stream(inputs, config=config)))
+                for piece in chunks:
+                    if perspective in abandoned:
+                        return
+                    if piece:
+                        text += piece
+                        events.put((perspective, "partial", text))
+            else:
+                text = single_flight.do(f"{branch_key}:invoke", lambda: chunk_text(chain.invoke(inputs, config=config)))
+            events.put((perspective, "done", text))
+        except Exception as e:
+            events.put((perspective, "failed", f"Error: {str(e)}"))
 
-    history_template = ChatPromptTemplate.from_messages([
-        ("system", "You are a historical analyst who explains the historical context and evolution of {topic}. Provide timelines and significant milestones."),
+    submitted = time.monotonic()
+    futures = {}
+    for perspective, chain in chains.items():
+        # Tagged on this thread, where the Streamlit session is known
+        futures[perspective] = _executor.submit(run_branch, perspective, chain,
+                                                call_config(topic, perspective=perspective))
+
+    # Queued branches wait up to queue_timeout to start; running ones get timeout from their start
+    deadlines = {perspective: submitted + (timeout if queue_timeout is None else queue_timeout)
+                 for perspective in chains}
+    pending = set(chains)
+    completed = {}
+    try:
+        while pending:
+            now = time.monotonic()
+            for perspective in [p for p in pending if deadlines[p] <= now]:
+                pending.discard(perspective)
+                abandoned.add(perspective)
+                futures[perspective].cancel()
+                # Reported now, not after the slowest other branch
+                yield perspective, None
+            if not pending:
+                break
+            try:
+                perspective, kind, content = events.get(timeout=min(deadlines[p] for p in pending) - now)
+            except queue.Empty:
+                continue
+            if perspective not in pending:
+                continue
+            if kind == "started":
+                deadlines[perspective] = time.monotonic() + timeout
+                continue
+            if kind != "partial":
+                pending.discard(perspective)
+                if kind == "done":
+                    completed[perspective] = content
+            yield perspective, content
+    finally:
+        # Also when the caller stops reading early
+        for perspective in pending:
+            abandoned.add(perspective)
+            futures[perspective].cancel()
+
+    # Only complete answers are worth caching
+    if len(completed) == len(chains):
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION,
+                       {perspective: completed[perspective] for perspective in PERSPECTIVE_PROMPTS})
+
+def build_single_call_chain(api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE):
+    """Build a chain that answers from every perspective in one response."""
+    instructions = "\n".join(f"### {perspective.capitalize()}\n{prompt}" for perspective, prompt in PERSPECTIVE_PROMPTS.items())
+    template = ChatPromptTemplate.from_messages([
+        ("system", "Answer the question about {topic} from each of these perspectives in turn. "
+                   "Start each part with its heading exactly as given, and keep each part short.\n\n" + instructions),
         ("human", "{question}")
     ])
+    return template | get_scheduled_model(SINGLE_CALL_MODE, model_name=model_name, temperature=temperature, api_key=api_key)
 
-    simple_chain = simple_template | get_gemini_model(api_key=api_key)
-    technical_chain = technical_template | get_gemini_model(api_key=api_key)
-    code_chain = code_template | get_gemini_model(api_key=api_key)
-    history_chain = history_template | get_gemini_model(api_key=api_key)
-
-    parallel_analysis = RunnableParallel(
-        simple = simple_chain,
-        technical = technical_chain,
-        code = code_chain,
-        history = history_chain
-    )
-    
+def split_perspectives(text: str) -> Dict[str, str]:
+    """Split a single-call answer into perspectives by its headings."""
+    names = "|".join(PERSPECTIVE_PROMPTS)
+    parts = re.split(rf"^#+\s*({names})\b[^\n]*$", text, flags=re.IGNORECASE | re.MULTILINE)
+    sections = {name.lower(): body.strip() for name, body in zip(parts[1::2], parts[2::2]) if body.strip()}
+    # Headings missing entirely: keep the whole answer rather than losing it
+    return sections or {"combined": text.strip()}
+
+def analyze_perspectives_single_call(question: str, api_key: str, model_name: str = DEFAULT_MODEL,
+                                     temperature: float = DEFAULT_TEMPERATURE) -> Dict[str, str]:
+    """Answer from all perspectives with one model call instead of four."""
     topic = get_topic()
-    responses = parallel_analysis.invoke({
-        "question": question,
-        "topic": topic
-    })
-    return responses
\ No newline at end of file
+    chain = build_single_call_chain(api_key, model_name, temperature)
+    response = chain.invoke({"question": question, "topic": topic}, config=call_config(topic))
+    return split_perspectives(chunk_text(response))
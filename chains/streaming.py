@@ -0,0 +1,41 @@
+import time
+from typing import Dict, Iterable, Iterator, Optional
+
+
+class StreamTimer:
+    """Record time-to-first-token and total time of a streamed response"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def wrap(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Pass chunks through while timing them"""
+        self.started_at = time.perf_counter()
+        try:
+            for chunk in chunks:
+                if self.first_token_at is None and chunk:
+                    self.first_token_at = time.perf_counter()
+                yield chunk
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """Get timings in seconds, rounded for display and storage"""
+        ttft = None
+        total = None
+        if self.first_token_at is not None:
+            ttft = round(self.first_token_at - self.started_at, 3)
+        if self.finished_at is not None:
+            total = round(self.finished_at - self.started_at, 3)
+        return {"time_to_first_token": ttft, "total_time": total}
+
+
+def chunk_text(chunk) -> str:
+    """Extract the text of a streamed message chunk"""
+    content = chunk.content if hasattr(chunk, "content") else chunk
+    if isinstance(content, list):
+        # Gemini may return content as a list of parts
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
@@ -1,21 +1,146 @@
-from config.gemini_setup import get_gemini_model, get_topic
+import re
+import json
+from typing import Any, Dict, Iterator, Optional, Union
+from config.gemini_setup import get_scheduled_model, get_topic, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from chains.streaming import chunk_text
 from models.topic_analysis import TopicExplanation
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.utils.json import parse_partial_json
+from pydantic import ValidationError
+from utils.response_cache import ResponseCache, lookup_response, store_response
+from utils.single_flight import flight_key, get_single_flight
+from utils.call_metrics import call_config
 
-def analyze_topic(question: str, api_key: str) -> TopicExplanation:
-    """Analyze a question about the current learning topic."""
-    parser = PydanticOutputParser(pydantic_object=TopicExplanation)
-    format_instructions = parser.get_format_instructions()
-    
+MODE = "deep"
+# Bump when the prompt or TopicExplanation changes
+PROMPT_VERSION = "2"
+
+# The schema goes to Gemini's constrained JSON mode instead of into the prompt
+TOPIC_SCHEMA = TopicExplanation.model_json_schema()
+
+def build_structured_chain(api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE):
+    """Build the Deep Dive chain using the model's schema-constrained JSON output."""
     template = ChatPromptTemplate.from_messages([
         ("system", " You are a helpful and fun tutor who understands the {topic} well. You will always respond in simple terms and explain the foundations of the {topic} clearly. "
-        "When you answer, make sure to follow the format instructions: {format_instructions}"),
+        "Answer with a JSON object that fills in every field of the response schema."),
         ("human" , "{question}")
     ])
-    chain = template | get_gemini_model(api_key=api_key) | parser
-    
+    model = get_scheduled_model(MODE, model_name=model_name, temperature=temperature, api_key=api_key)
+    return template | model.bind(response_mime_type="application/json", response_schema=TOPIC_SCHEMA)
+
+def repair_topic_json(text: str) -> Optional[TopicExplanation]:
+    """Try to turn malformed model output into a TopicExplanation without another request."""
+    # Drop markdown code fences and anything around the outermost object
+    text = re.sub(r"```(?:json)?", "", text).strip()
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = text.rfind("}")
+    candidate = text[start:end + 1] if end > start else text[start:]
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        # Closes unterminated strings, lists and objects
+        data = parse_partial_json(text[start:])
+    if not isinstance(data, dict):
+        return None
+
+    # Coerce fields to the types the model expects
+    for name, field in TopicExplanation.model_fields.items():
+        value = data.get(name)
+        if field.annotation == str:
+            if isinstance(value, list):
+                data[name] = "\n".join(str(item) for item in value)
+            elif value is None:
+                data[name] = ""
+            else:
+                data[name] = str(value)
+        else:
+            if value is None:
+                data[name] = []
+            elif not isinstance(value, list):
+                data[name] = [str(value)]
+            else:
+                data[name] = [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in value]
+    try:
+        return TopicExplanation.model_validate(data)
+    except ValidationError:
+        return None
+
+def parse_topic(text: str) -> Optional[TopicExplanation]:
+    """Parse a complete JSON answer, repairing it locally if needed."""
+    try:
+        return TopicExplanation.model_validate_json(text)
+    except ValidationError:
+        return repair_topic_json(text)
+
+def analyze_topic(question: str, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                  priority: Optional[str] = None) -> TopicExplanation:
+    """Analyze a question about the current learning topic."""
     topic = get_topic()
-    response = chain.invoke({"question": question, "topic": topic, "format_instructions": format_instructions})
-    return response
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        # Stored as validated fields, so no LLM text needs re-parsing
+        return TopicExplanation.model_validate(cached)
+
+    config = call_config(topic, priority=priority)
+
+    def analyze():
+        chain = build_structured_chain(api_key, model_name, temperature)
+        inputs = {"question": question, "topic": topic}
+        response = parse_topic(chunk_text(chain.invoke(inputs, config=config)))
+        if response is None:
+            # Local repair failed; ask once more before giving up
+            text = chunk_text(chain.invoke(inputs, config=config))
+            response = parse_topic(text)
+            if response is None:
+                raise ValueError(f"Could not parse the Deep Dive answer: {text[:200]}")
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION, response.model_dump())
+        return response
+
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    return get_single_flight().do(f"{key}:invoke", analyze)
+
+def stream_topic(question: str, api_key: str, model_name: str = DEFAULT_MODEL,
+                 temperature: float = DEFAULT_TEMPERATURE) -> Iterator[Union[Dict[str, Any], TopicExplanation]]:
+    """Analyze a question and yield partial results while the JSON streams in.
+
+    Yields dicts holding the fields parsed so far, then finishes with the
+    validated TopicExplanation.
+    """
+    topic = get_topic()
+    cached = lookup_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION)
+    if cached is not None:
+        yield TopicExplanation.model_validate(cached)
+        return
+
+    # Built here: the stream itself runs on a single-flight thread
+    config = call_config(topic)
+
+    def analyze_stream():
+        chain = build_structured_chain(api_key, model_name, temperature)
+        inputs = {"question": question, "topic": topic}
+        text = ""
+        last_partial = None
+        for chunk in chain.stream(inputs, config=config):
+            piece = chunk_text(chunk)
+            if not piece:
+                continue
+            text += piece
+            partial = parse_partial_json(text[text.find("{"):]) if "{" in text else None
+            if isinstance(partial, dict) and partial != last_partial:
+                last_partial = partial
+                yield partial
+
+        response = parse_topic(text)
+        if response is None:
+            # Local repair failed; ask once more before giving up
+            text = chunk_text(chain.invoke(inputs, config=config))
+            response = parse_topic(text)
+            if response is None:
+                raise ValueError(f"Could not parse the Deep Dive answer: {text[:200]}")
+        store_response(MODE, question, topic, model_name, temperature, PROMPT_VERSION, response.model_dump())
+        yield response
 
+    key = flight_key(api_key, ResponseCache.make_key(MODE, question, topic, model_name, temperature, PROMPT_VERSION))
+    yield from get_single_flight().stream(f"{key}:stream", analyze_stream)
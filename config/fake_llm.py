@@ -0,0 +1,143 @@
+import os
+import json
+import math
+import time
+import random
+import hashlib
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class FakeLLMError(Exception):
+    """Injected failure carrying an HTTP-style status code"""
+
+    def __init__(self, message: str, code: int):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeGeminiModel(BaseChatModel):
+    """Local stand-in for ChatGoogleGenerativeAI for benchmarks and load tests.
+
+    Answers are canned and derived from a hash of the prompt, so the same
+    prompt always gets the same text. Latency follows a log-normal
+    distribution around latency_ms, streaming runs at tokens_per_second, and
+    a share of calls can fail with 429 or 503 errors, drawn from a seeded
+    RNG. Requests that ask for JSON (Deep Dive) get valid TopicExplanation
+    JSON.
+    """
+
+    model: str = "fake-gemini"
+    temperature: float = 0.7
+    latency_ms: float = 400.0
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 80.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: int = 42
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    _random: Optional[random.Random] = PrivateAttr(default=None)
+
+    def _rng(self) -> random.Random:
+        # Seeded, so a run with the same call order sees the same latencies and failures
+        if self._random is None:
+            self._random = random.Random(self.seed)
+        return self._random
+
+    def _first_token_delay(self, rng: random.Random) -> float:
+        return self.latency_ms / 1000.0 * math.exp(rng.gauss(0, self.latency_sigma))
+
+    def _maybe_fail(self, rng: random.Random):
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            raise FakeLLMError("429 RESOURCE_EXHAUSTED: fake quota exceeded", 429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise FakeLLMError("503 UNAVAILABLE: fake server error", 503)
+
+    @staticmethod
+    def _prompt_text(messages: List[BaseMessage]) -> str:
+        return "\n".join(f"{m.type}: {m.content}" for m in messages)
+
+    def _answer(self, messages: List[BaseMessage], **kwargs: Any) -> str:
+        """Pick the canned answer for a prompt"""
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        digest = int(hashlib.sha256(self._prompt_text(messages).encode()).hexdigest(), 16)
+        if kwargs.get("response_mime_type") == "application/json":
+            return canned_topic_json(question, digest)
+        if "running summary" in system:
+            return f"The learner has asked about {question.splitlines()[-1][:80]} and is building up the basics step by step."
+        variants = [
+            "Think of it like a library: first you find the right books, then you read the relevant pages to answer.",
+            "The key idea is to break the problem into smaller steps and handle each one with the right tool.",
+            "In practice you would start with a small example, measure how well it works, and then iterate.",
+            "Historically this grew out of earlier research and became popular once the tooling matured.",
+        ]
+        body = " ".join(variants[(digest >> shift) % len(variants)] for shift in range(0, 40, 8))
+        return f"Here is an explanation of \"{question[:120]}\". {body}"
+
+    def _usage(self, messages: List[BaseMessage], text: str) -> dict:
+        input_tokens = len(self._prompt_text(messages)) // 4 + 1
+        output_tokens = len(text) // 4 + 1
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        rng = self._rng()
+        text = self._answer(messages, **kwargs)
+        # A full response takes the first-token delay plus the time to produce every token
+        time.sleep(self._first_token_delay(rng) + len(text.split()) / self.tokens_per_second)
+        self._maybe_fail(rng)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        rng = self._rng()
+        text = self._answer(messages, **kwargs)
+        time.sleep(self._first_token_delay(rng))
+        self._maybe_fail(rng)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            piece = word if i == len(words) - 1 else word + " "
+            usage = self._usage(messages, text) if i == len(words) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+            time.sleep(1.0 / self.tokens_per_second)
+
+
+def canned_topic_json(question: str, digest: int = 0) -> str:
+    """Valid TopicExplanation JSON for a question"""
+    subject = question.strip().rstrip("?") or "the topic"
+    data = {
+        "main_topic": subject,
+        "sub_topics": [f"Core idea {i + 1} of {subject}: a short description" for i in range(3 + digest % 2)],
+        "real_world_examples": [f"Example {i + 1}: how a team applies {subject}" for i in range(3)],
+        "connection_to_main_topic": f"Each sub-topic is one building block of {subject}.",
+        "future_learning_resources": ["https://example.com/intro", "https://example.com/advanced"],
+        "quizz_me_on_it": [f"Q{i + 1}: What is core idea {i + 1}? A: See sub-topic {i + 1}." for i in range(3)],
+    }
+    return json.dumps(data)
+
+
+def create_fake_model(model_name: str, api_key: str, temperature: float) -> FakeGeminiModel:
+    """Build a fake model configured from FAKE_LLM_* environment variables"""
+    return FakeGeminiModel(
+        model=model_name,
+        temperature=temperature,
+        latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "400")),
+        latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+        tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "80")),
+        error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+        rate_limit_rate=float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+        seed=int(os.getenv("FAKE_LLM_SEED", "42"))
+    )
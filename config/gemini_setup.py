@@ -1,11 +1,18 @@
 import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Load environment variables from .env file
 load_dotenv()
 
+DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_TEMPERATURE = 0.7
+
 def check_password():
     """First security layer - password protection"""
     def password_entered():
@@ -73,19 +80,163 @@ def get_user_api_key():
     
     return api_key
 
-def get_gemini_model(model_name="gemini-2.5-flash", temperature=0.7, api_key=None):
-    """Create and return a Gemini model instance using provided API key."""
-    
-    if not api_key:
-        raise ValueError("API key is required!")
-    
-    model = ChatGoogleGenerativeAI(
+class ModelPool:
+    """Process-wide pool of Gemini clients with LRU and idle-TTL eviction.
+
+    Clients are keyed by (backend, hashed API key, model name, temperature) so every
+    chain and every Streamlit session reuses the same client, and with it the
+    underlying HTTP/gRPC connections, instead of building a new one per call.
+    """
+
+    def __init__(self, max_size: int = 32, idle_ttl: float = 1800.0):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_api_key(api_key: str) -> str:
+        """Hash the API key so raw keys are never kept as dictionary keys"""
+        return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    def get(self, api_key: str, model_name: str, temperature: float):
+        """Return a pooled client, creating it on first use"""
+        # The backend is part of the key so switching LLM_BACKEND never reuses the other backend's client
+        key = (get_backend(), self.hash_api_key(api_key), model_name, round(float(temperature), 2))
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                entry[1] = now
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Build outside the lock; client construction is the slow part
+        model = _create_model(model_name, api_key, temperature)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                # Another thread won the race, keep its client
+                entry[1] = now
+                return entry[0]
+            self._clients[key] = [model, now]
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return model
+
+    def _evict_idle(self, now: float):
+        """Drop clients that have not been used within the idle TTL"""
+        expired = [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]
+        for k in expired:
+            del self._clients[k]
+
+    def warm_up(self, api_key: str, model_name: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE):
+        """Create the client for a key ahead of the first question"""
+        try:
+            self.get(api_key, model_name, temperature)
+        except Exception:
+            # Warm-up is best effort; the real call will surface any error
+            pass
+
+    def clear(self):
+        """Remove every pooled client"""
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get pool size and hit/miss counters"""
+        with self._lock:
+            return {"size": len(self._clients), "hits": self.hits, "misses": self.misses}
+
+
+def _create_gemini_model(model_name: str, api_key: str, temperature: float):
+    """Build a new Gemini client"""
+    # Imported on first use: the Gemini SDK is the slowest import in the app
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
         model=model_name,
         google_api_key=api_key,
-        temperature=temperature
+        temperature=temperature,
+        # A single attempt; the request scheduler owns retries and backoff
+        max_retries=1
     )
+
+
+def _create_fake_model(model_name: str, api_key: str, temperature: float):
+    """Build a local fake model for benchmarks and load tests"""
+    from config.fake_llm import create_fake_model
+
+    return create_fake_model(model_name, api_key, temperature)
+
+
+# Model backends by name; select one with the LLM_BACKEND setting
+MODEL_BACKENDS = {
+    "gemini": _create_gemini_model,
+    "fake": _create_fake_model,
+}
+
+
+def register_backend(name: str, factory):
+    """Add a model backend; factory takes (model_name, api_key, temperature)."""
+    MODEL_BACKENDS[name] = factory
+
+
+def get_backend() -> str:
+    """Get the configured model backend name."""
+    return os.getenv("LLM_BACKEND", "gemini")
+
+
+def _create_model(model_name: str, api_key: str, temperature: float):
+    """Build a new client with the configured backend"""
+    backend = get_backend()
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{backend}'. Choose one of: {', '.join(MODEL_BACKENDS)}")
+    return MODEL_BACKENDS[backend](model_name, api_key, temperature)
+
+
+_model_pool = ModelPool(
+    max_size=int(os.getenv("MODEL_POOL_SIZE", "32")),
+    idle_ttl=float(os.getenv("MODEL_POOL_IDLE_TTL", "1800"))
+)
+
+
+def get_model_pool() -> ModelPool:
+    """Get the process-wide model pool."""
+    return _model_pool
+
+
+def get_gemini_model(model_name=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE, api_key=None):
+    """Return a pooled Gemini model instance for the provided API key."""
+    
+    if not api_key:
+        raise ValueError("API key is required!")
     
-    return model
+    return _model_pool.get(api_key, model_name, temperature)
+
+
+def get_scheduled_model(mode: str, model_name=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE, api_key=None):
+    """Return the pooled model with its calls routed through the request scheduler."""
+    # Imported here: the scheduler needs LangChain, which pages without a model call never load
+    from config.scheduler import scheduled_model
+
+    model = get_gemini_model(model_name=model_name, temperature=temperature, api_key=api_key)
+    return scheduled_model(model, ModelPool.hash_api_key(api_key), mode, model_name)
+
+
+def warm_up_model(api_key: str, model_name=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE):
+    """Pre-build the pooled client for a newly entered API key.
+
+    Runs in the background so the page doesn't wait on the SDK import.
+    """
+    if api_key:
+        threading.Thread(target=_model_pool.warm_up, args=(api_key, model_name, temperature),
+                         name="model-warm-up", daemon=True).start()
 
 def get_topic():
     """Get the current learning topic from environment or Streamlit secrets."""
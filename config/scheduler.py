@@ -0,0 +1,377 @@
+import os
+import re
+import time
+import asyncio
+import heapq
+import random
+import itertools
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ensure_config
+from utils.call_handler import CallMetricsHandler
+from utils.call_metrics import TAG_KEYS, with_handler
+
+# Lower numbers go first. Interactive modes jump ahead of heavier and bulk work.
+# A call can run at another mode's priority by naming it in its run config
+# metadata, e.g. call_config(topic, priority="batch"); the chain functions
+# take the same name as their priority argument.
+PRIORITIES = {
+    "quick": 0,
+    "tutor": 0,
+    "deep": 1,
+    "parallel": 1,
+    "summary": 2,
+    "batch": 3,
+}
+
+# Completion tokens assumed for a request until the real usage is known
+EXPECTED_COMPLETION_TOKENS = 500
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when Gemini keeps rejecting a request for quota (429) after all retries"""
+
+
+class ServiceUnavailable(Exception):
+    """Raised when Gemini keeps failing with a server error or timeout after all retries"""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of an API error, if the exception carries one"""
+    try:
+        from google.api_core.exceptions import GoogleAPICallError
+    except ImportError:
+        GoogleAPICallError = None
+    if GoogleAPICallError is not None and isinstance(error, GoogleAPICallError):
+        return error.code
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "code"):
+            code = getattr(source, attr, None)
+            if isinstance(code, int):
+                return code
+    return None
+
+
+# Only consulted for wrapped errors that carry no status code
+RETRYABLE_MESSAGE = re.compile(r"\b429\b|RESOURCE_EXHAUSTED|Too Many Requests")
+
+
+def retries_exhausted(error: Exception, retries: int) -> Exception:
+    """The error to raise once a retryable failure is still failing after all retries"""
+    code = _status_code(error)
+    if code == 429 or (code is None and RETRYABLE_MESSAGE.search(str(error))):
+        return RateLimitExceeded(f"Gemini is still rate limiting after {retries} retries: {error}")
+    status = f"status {code}" if code is not None else type(error).__name__
+    return ServiceUnavailable(f"Gemini is still failing ({status}) after {retries} retries: {error}")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check whether an error is a quota (429) or transient server (5xx) failure"""
+    code = _status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return bool(RETRYABLE_MESSAGE.search(str(error)))
+
+
+def estimate_request_tokens(prompt: Any) -> int:
+    """Estimate prompt plus completion tokens for a request"""
+    text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+    return len(text) // 4 + EXPECTED_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken; 0 if it can be taken now"""
+        self._refill(now)
+        # A request larger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+    def adjust(self, amount: float):
+        """Charge (or refund) the difference once actual usage is known"""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _KeyQueue:
+    """Rate limits and the waiting queue for one API key"""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiting = []
+        self.condition = threading.Condition()
+        self.last_wait = 0.0
+        self.total_wait = 0.0
+        self.granted = 0
+        self.retries = 0
+
+
+class RequestScheduler:
+    """Per-API-key token-bucket limits with a priority queue in front of Gemini.
+
+    Each key gets requests-per-minute and tokens-per-minute buckets. Callers
+    wait in a priority queue, so an interactive question is granted before
+    queued Deep Dive, summary or batch requests for the same key. Quota and
+    server errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, rpm: float = 60, tpm: float = 1_000_000, max_retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 20.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._keys: Dict[str, _KeyQueue] = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _queue(self, key_id: str) -> _KeyQueue:
+        with self._lock:
+            queue = self._keys.get(key_id)
+            if queue is None:
+                queue = self._keys[key_id] = _KeyQueue(self.rpm, self.tpm)
+            return queue
+
+    def acquire(self, key_id: str, priority: int, tokens: int) -> float:
+        """Wait for this request's turn and capacity; return the seconds waited"""
+        queue = self._queue(key_id)
+        ticket = (priority, next(self._sequence))
+        started = time.monotonic()
+        with queue.condition:
+            heapq.heappush(queue.waiting, ticket)
+            try:
+                while True:
+                    timeout = 1.0
+                    if queue.waiting[0] == ticket:
+                        now = time.monotonic()
+                        timeout = max(queue.requests.wait_time(1, now), queue.tokens.wait_time(tokens, now))
+                        if timeout <= 0:
+                            queue.requests.take(1)
+                            queue.tokens.take(tokens)
+                            break
+                    queue.condition.wait(timeout=timeout)
+            finally:
+                # Leave the queue whether granted or interrupted
+                queue.waiting.remove(ticket)
+                heapq.heapify(queue.waiting)
+            waited = time.monotonic() - started
+            queue.last_wait = waited
+            queue.total_wait += waited
+            queue.granted += 1
+            # Let the next ticket re-check the buckets
+            queue.condition.notify_all()
+        return waited
+
+    def record_usage(self, key_id: str, estimated: int, actual: Optional[int]):
+        """Correct the token bucket once the real token count is known"""
+        if actual is None:
+            return
+        queue = self._queue(key_id)
+        with queue.condition:
+            queue.tokens.adjust(actual - estimated)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def run(self, key_id: str, priority: int, tokens: int, call: Callable[[], Any], observer=None) -> Any:
+        """Run a call once granted, retrying quota and server errors.
+
+        observer, if given, is told about queue waits and retries
+        (record_queue_wait / record_retry).
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = self.acquire(key_id, priority, tokens)
+            if observer:
+                observer.record_queue_wait(waited)
+            try:
+                return call()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise retries_exhausted(e, self.max_retries) from e
+                self._queue(key_id).retries += 1
+                if observer:
+                    observer.record_retry(e)
+                time.sleep(self._backoff(attempt))
+
+    def stream(self, key_id: str, priority: int, tokens: int, start: Callable[[], Iterator], observer=None) -> Iterator:
+        """Stream a call once granted; only retried if it fails before the first chunk"""
+        for attempt in range(self.max_retries + 1):
+            waited = self.acquire(key_id, priority, tokens)
+            if observer:
+                observer.record_queue_wait(waited)
+            iterator = start()
+            try:
+                first = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise retries_exhausted(e, self.max_retries) from e
+                self._queue(key_id).retries += 1
+                if observer:
+                    observer.record_retry(e)
+                time.sleep(self._backoff(attempt))
+                continue
+            yield first
+            yield from iterator
+            return
+
+    def stats(self, key_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue depth and wait times, for one key or summed over all keys"""
+        with self._lock:
+            queues = [self._keys[key_id]] if key_id in self._keys else ([] if key_id else list(self._keys.values()))
+        granted = sum(q.granted for q in queues)
+        total_wait = sum(q.total_wait for q in queues)
+        return {
+            "queue_depth": sum(len(q.waiting) for q in queues),
+            "last_wait": max((q.last_wait for q in queues), default=0.0),
+            "avg_wait": total_wait / granted if granted else 0.0,
+            "granted": granted,
+            "retries": sum(q.retries for q in queues)
+        }
+
+
+class ScheduledModel(Runnable):
+    """Wrap a chat model so every call goes through the request scheduler.
+
+    Each call also gets a CallMetricsHandler, tagged with the mode, model and
+    the topic/user/session metadata from the run config. A "priority" mode
+    name in the run config metadata overrides the mode's priority for that
+    call only.
+    """
+
+    def __init__(self, model: Runnable, scheduler: RequestScheduler, key_id: str, priority: int,
+                 mode: Optional[str] = None, model_name: Optional[str] = None):
+        self.model = model
+        self.scheduler = scheduler
+        self.key_id = key_id
+        self.priority = priority
+        self.mode = mode
+        self.model_name = model_name
+
+    @property
+    def InputType(self):
+        return self.model.InputType
+
+    @property
+    def OutputType(self):
+        return self.model.OutputType
+
+    def bind(self, **kwargs) -> "ScheduledModel":
+        return ScheduledModel(self.model.bind(**kwargs), self.scheduler, self.key_id, self.priority,
+                              self.mode, self.model_name)
+
+    def _priority(self, config) -> int:
+        """This call's priority: the mode's, unless the run config names another"""
+        override = (config.get("metadata") or {}).get("priority")
+        return PRIORITIES.get(override, self.priority) if override else self.priority
+
+    def _instrument(self, config):
+        """A metrics handler for this call and the config that carries it"""
+        config = ensure_config(config)
+        metadata = config.get("metadata") or {}
+        tags = {"mode": self.mode, "model": self.model_name,
+                **{key: metadata[key] for key in TAG_KEYS if key in metadata}}
+        handler = CallMetricsHandler(tags)
+        return handler, with_handler(config, handler)
+
+    def invoke(self, input, config=None, **kwargs):
+        tokens = estimate_request_tokens(input)
+        handler, config = self._instrument(config)
+        error = None
+        try:
+            response = self.scheduler.run(self.key_id, self._priority(config), tokens,
+                                          lambda: self.model.invoke(input, config, **kwargs), observer=handler)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            handler.finish(error)
+        usage = getattr(response, "usage_metadata", None)
+        self.scheduler.record_usage(self.key_id, tokens, usage.get("total_tokens") if usage else None)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        tokens = estimate_request_tokens(input)
+        handler, config = self._instrument(config)
+        usage = None
+        error = None
+        try:
+            for chunk in self.scheduler.stream(self.key_id, self._priority(config), tokens,
+                                               lambda: iter(self.model.stream(input, config, **kwargs)),
+                                               observer=handler):
+                if getattr(chunk, "usage_metadata", None):
+                    usage = chunk.usage_metadata
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Also runs when the consumer stops reading early
+            handler.finish(error)
+        self.scheduler.record_usage(self.key_id, tokens, usage.get("total_tokens") if usage else None)
+
+    async def astream(self, input, config=None, **kwargs):
+        # Wait for a slot off the event loop; async streams are not retried
+        tokens = estimate_request_tokens(input)
+        handler, config = self._instrument(config)
+        waited = await asyncio.to_thread(self.scheduler.acquire, self.key_id, self._priority(config), tokens)
+        handler.record_queue_wait(waited)
+        usage = None
+        error = None
+        try:
+            async for chunk in self.model.astream(input, config, **kwargs):
+                if getattr(chunk, "usage_metadata", None):
+                    usage = chunk.usage_metadata
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            handler.finish(error)
+        self.scheduler.record_usage(self.key_id, tokens, usage.get("total_tokens") if usage else None)
+
+
+_scheduler = RequestScheduler(
+    rpm=float(os.getenv("GEMINI_RPM", "60")),
+    tpm=float(os.getenv("GEMINI_TPM", "1000000")),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+)
+
+
+def get_scheduler() -> RequestScheduler:
+    """Get the process-wide request scheduler."""
+    return _scheduler
+
+
+def scheduled_model(model: Runnable, key_id: str, mode: str, model_name: Optional[str] = None) -> ScheduledModel:
+    """Route a model's calls through the scheduler at the mode's priority."""
+    return ScheduledModel(model, _scheduler, key_id, PRIORITIES.get(mode, 1), mode, model_name)
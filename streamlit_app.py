@@ -1,16 +1,10 @@
 import streamlit as st
 import os
+import sys
+import uuid
+from contextlib import nullcontext
 from dotenv import load_dotenv
-from chains.basic_qa import ask_question
-from chains.conversational import chat_with_memory
-from chains.parallel_analysis import analyze_from_multiple_perspectives
-from chains.structured_analysis import analyze_topic
-from config.gemini_setup import get_gemini_model, get_topic
 from auth.user_auth import check_authentication, show_user_info
-from auth.api_manager import get_user_api_key
-from utils.chat_manager import show_chat_export_ui
-from utils.gdrive_integration import show_quick_gdrive_actions
-from langchain.memory import ConversationBufferMemory
 
 # Load environment variables
 load_dotenv()
@@ -28,11 +22,26 @@ authenticated, auth = check_authentication()
 if not authenticated:
     st.stop()
 
-# Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "conversation_memory" not in st.session_state:
-    st.session_state.conversation_memory = ConversationBufferMemory(return_messages=True)
+# Imported after the login check so the login page renders without LangChain.
+# Nothing here imports LangChain or numpy either: the chain modules, the
+# scheduler and the caches load when a mode is first used, and the Gemini SDK
+# and pyarrow on the first model call and Parquet export.
+from chains.streaming import StreamTimer
+from models.topic_analysis import TopicExplanation
+from config.gemini_setup import get_topic, ModelPool
+from auth.api_manager import get_user_api_key
+from auth.usage import get_usage_tracker, get_quota_policy, is_admin, QUOTA_SOFT, QUOTA_HARD
+from utils.chat_manager import get_message_log, show_chat_export_ui, show_chat_search_ui
+from utils.call_metrics import get_call_log
+from utils.gdrive_integration import show_quick_gdrive_actions
+from utils.transcript import (HIDDEN_PAGE, PAGE_SIZE, cached_markdown, cached_message_index, find_message, page_of,
+                              prune_cache, recent_start, request_jump, scroll_script, topic_markdown)
+
+# Initialize session state; the chat is kept as a MessageLog
+get_message_log()
+if "conversation_id" not in st.session_state:
+    # Keys this browser session's tutor memory in the shared conversation engine
+    st.session_state.conversation_id = f"{st.session_state.username}:{uuid.uuid4().hex}"
 if "current_topic" not in st.session_state:
     st.session_state.current_topic = get_topic()
 
@@ -73,13 +82,17 @@ api_key = get_user_api_key()
 if not api_key:
     st.stop()
 
-# Sidebar configuration
-with st.sidebar:
-    st.title("🎓 Learning Assistant Settings")
-    
-    # Show user info
-    show_user_info()
+def invalidate_page():
+    """Widget callback for changes that affect more than the widget's own fragment"""
+    st.session_state.page_stale = True
+
+@st.fragment
+def show_settings_panel(api_key: str):
+    """Topic, mode and model settings.
     
+    A fragment, so moving a slider reruns only this panel. Changing the topic
+    or mode reruns the whole page, whose header and chat input show them.
+    """
     # Topic management
     st.subheader("📚 Topic Configuration")
     current_topic = st.text_input(
@@ -91,15 +104,18 @@ with st.sidebar:
     if current_topic != st.session_state.current_topic:
         st.session_state.current_topic = current_topic
         os.environ["CURRENT_TOPIC"] = current_topic
-        st.success(f"Topic updated to: {current_topic}")
+        st.toast(f"Topic updated to: {current_topic}")
+        st.rerun()
     
     st.divider()
     
     # Mode selection
     st.subheader("🔧 Chat Mode")
-    mode = st.selectbox(
+    st.selectbox(
         "How would you like to learn?",
         ["Quick Answer", "Deep Dive", "Multiple Viewpoints", "Interactive Tutor"],
+        key="mode",
+        on_change=invalidate_page,
         help="Choose your preferred learning style"
     )
     
@@ -117,25 +133,101 @@ with st.sidebar:
     
     st.divider()
     
-    # Advanced settings
+    # Advanced settings; the chat input reads them from session state
     with st.expander("⚙️ Advanced Settings"):
-        temperature = st.slider(
+        st.slider(
             "Response Creativity",
             min_value=0.0,
             max_value=1.0,
             value=0.7,
             step=0.1,
+            key="temperature",
             help="Higher values make responses more creative but less focused"
         )
         
-        model_name = st.selectbox(
+        st.selectbox(
             "Model",
             ["gemini-2.5-flash", "gemini-1.5-pro"],
+            key="model_name",
             help="Select the AI model to use"
         )
+        
+        st.toggle(
+            "Stream responses",
+            value=True,
+            key="stream_responses",
+            help="Show replies word by word as they are generated"
+        )
+        
+        # Stats only for parts a question has already loaded; importing them here would pull in LangChain and numpy
+        if "utils.semantic_cache" in sys.modules:
+            from utils.response_cache import get_response_cache
+            from utils.semantic_cache import get_semantic_cache
+            cache_stats = get_response_cache().stats()
+            semantic_stats = get_semantic_cache().stats()
+            st.caption(f"🗄️ Answer cache: {cache_stats['hits']} exact + {semantic_stats['hits']} similar hits · {cache_stats['entries']} saved")
+        
+        if "utils.single_flight" in sys.modules:
+            from utils.single_flight import get_single_flight
+            flight_stats = get_single_flight().stats()
+            st.caption(f"🤝 Shared in-flight answers: {flight_stats['saved']} Gemini calls saved")
+        
+        if "config.scheduler" in sys.modules:
+            from config.scheduler import get_scheduler
+            queue_stats = get_scheduler().stats(ModelPool.hash_api_key(api_key))
+            st.caption(f"🚦 Gemini queue: {queue_stats['queue_depth']} waiting · last wait {queue_stats['last_wait']:.1f}s · {queue_stats['retries']} retries")
+    
+    if st.session_state.pop("page_stale", False):
+        st.rerun()
+
+# Sidebar configuration
+with st.sidebar:
+    st.title("🎓 Learning Assistant Settings")
+    
+    # Show user info
+    show_user_info()
+    
+    show_settings_panel(api_key)
+    mode = st.session_state.mode
+    temperature = st.session_state.temperature
+    model_name = st.session_state.model_name
+    stream_responses = st.session_state.stream_responses
+    
+    # Conversation memory usage (Interactive Tutor), once the tutor has been used
+    conversation_memory = None
+    if "chains.conversational" in sys.modules:
+        from chains.conversational import get_conversation_engine
+        conversation_memory = get_conversation_engine().peek(st.session_state.conversation_id)
+    if conversation_memory is not None and not conversation_memory.is_empty():
+        st.caption(f"🧠 Tutor memory: {conversation_memory.token_count():,} tokens per prompt · {conversation_memory.tokens_saved():,} saved by summarizing")
+    
+    # LLM usage for this session; filled in at the end of the run so it includes this run's answer
+    call_summary_slot = st.empty()
+    
+    # Daily usage against the quota
+    usage_tracker = get_usage_tracker()
+    quota_policy = get_quota_policy()
+    today_usage = usage_tracker.get_usage(st.session_state.username)
+    quota_status = quota_policy.status(today_usage)
+    st.caption(f"📊 Today: {today_usage['tokens']:,} tokens · {today_usage['requests']} requests")
+    if quota_status == QUOTA_HARD:
+        st.error("🚫 Daily usage limit reached. It resets at midnight.")
+    elif quota_status == QUOTA_SOFT:
+        st.warning("⚠️ Close to today's usage limit: Multiple Viewpoints now uses a single combined request.")
+    
+    if is_admin(st.session_state.username):
+        with st.expander("🛡️ Top Consumers Today"):
+            top_users = usage_tracker.top_users()
+            if top_users:
+                st.table([{**row, "quota": quota_policy.status(row)} for row in top_users])
+            else:
+                st.caption("No usage recorded today")
     
     st.divider()
     
+    # Search across saved chats
+    show_chat_search_ui()
+    
     # Chat Export & Save Features
     show_chat_export_ui()
     
@@ -148,8 +240,10 @@ with st.sidebar:
     
     # Clear conversation button
     if st.button("🗑️ Clear Conversation", type="secondary", use_container_width=True):
-        st.session_state.messages = []
-        st.session_state.conversation_memory = ConversationBufferMemory(return_messages=True)
+        st.session_state.messages.clear()
+        if "chains.conversational" in sys.modules:
+            from chains.conversational import get_conversation_engine
+            get_conversation_engine().drop_session(st.session_state.conversation_id)
         st.rerun()
     
     # Footer
@@ -165,152 +259,262 @@ with col1:
 with col2:
     st.info(f"🔧 **Mode:** {mode}")
 
-# Message container
-message_container = st.container()
+PERSPECTIVE_TIMED_OUT = "⏱️ This perspective took too long and timed out. Try asking again."
+
+def show_topic_explanation(data):
+    """Show the sections of a (possibly partial) Deep Dive answer"""
+    st.markdown(topic_markdown(data))
+
+def show_timing(timing):
+    """Show first-token and total latency under a streamed answer"""
+    if timing.get("time_to_first_token") is not None:
+        st.caption(f"⚡ First token {timing['time_to_first_token']:.2f}s · Total {timing['total_time']:.2f}s")
+
+def show_message(message, cache):
+    """Show one chat message in full"""
+    with st.chat_message(message["role"]):
+        if message["role"] == "assistant" and message.get("type") == "parallel":
+            st.markdown("### 👥 Multiple Viewpoints")
+            for perspective, content in message["content"].items():
+                with st.expander(f"**{perspective.capitalize()} Perspective**", expanded=True):
+                    st.write(content)
+        else:
+            st.markdown(cached_markdown(message, cache))
+        if "timing" in message:
+            show_timing(message["timing"])
+
+def jump_to_selected_message():
+    request_jump(st.session_state.transcript_jump)
+
+@st.fragment
+def show_transcript():
+    """Show the chat history.
+    
+    Only the last RECENT_TURNS turns are drawn on every run; older messages
+    are drawn one page at a time, when picked, the same way. The jump index
+    is kept in session state until the chat changes.
+    Its own fragment, so paging and jumping rerun only the transcript.
+    """
+    messages = st.session_state.messages
+    cache = st.session_state.setdefault("transcript_cache", {})
+    prune_cache(cache, messages)
+    start = recent_start(len(messages))
+    
+    target = st.session_state.pop("transcript_scroll_to", None)
+    target_position = find_message(messages, target) if target else None
+    
+    if start:
+        index = cached_message_index(messages)
+        labels = {entry["id"]: entry["label"] for entry in index}
+        pages = [HIDDEN_PAGE] + list(range(0, start, PAGE_SIZE))
+        if target_position is not None and target_position < start:
+            st.session_state.transcript_page = page_of(target_position)
+        if st.session_state.get("transcript_page") not in pages:
+            st.session_state.transcript_page = HIDDEN_PAGE
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.selectbox(
+                "🔎 Jump to message",
+                list(labels),
+                index=None,
+                format_func=labels.get,
+                key="transcript_jump",
+                on_change=jump_to_selected_message,
+                placeholder="Pick a question..."
+            )
+        with col2:
+            page = st.selectbox(
+                f"📜 Earlier messages ({start})",
+                pages,
+                format_func=lambda p: "Hidden" if p == HIDDEN_PAGE else f"Messages {p + 1}–{min(p + PAGE_SIZE, start)}",
+                key="transcript_page"
+            )
+        
+        if page != HIDDEN_PAGE:
+            for position in range(page, min(page + PAGE_SIZE, start)):
+                if position == target_position:
+                    st.html(scroll_script(target), unsafe_allow_javascript=True)
+                show_message(messages[position], cache)
+            st.divider()
+    
+    for position in range(start, len(messages)):
+        if position == target_position:
+            st.html(scroll_script(target), unsafe_allow_javascript=True)
+        show_message(messages[position], cache)
 
 # Display chat history
-with message_container:
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            if message["role"] == "assistant" and "type" in message:
-                if message["type"] == "structured":
-                    st.markdown("### 🔍 Deep Dive Analysis")
-                    st.json(message["content"])
-                elif message["type"] == "parallel":
-                    st.markdown("### 👥 Multiple Viewpoints")
-                    for perspective, content in message["content"].items():
-                        with st.expander(f"**{perspective.capitalize()} Perspective**", expanded=True):
-                            st.write(content)
-                else:
-                    st.markdown(message["content"])
-            else:
-                st.markdown(message["content"])
+show_transcript()
 
 # Input area
 if prompt := st.chat_input("Ask me anything about " + st.session_state.current_topic + "..."):
-    # Add user message to history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    # Re-checked here so calls made earlier in this run count
+    quota_status = quota_policy.status(usage_tracker.get_usage(st.session_state.username))
+    if quota_status == QUOTA_HARD:
+        # Refused questions are not answered, so they stay out of the chat history
+        st.error("🚫 You've reached today's usage limit. It resets at midnight.")
+    else:
+        from config.scheduler import RateLimitExceeded, ServiceUnavailable
+        
+        # Add user message to history
+        st.session_state.messages.append({"role": "user", "content": prompt})
     
-    # Display user message
-    with st.chat_message("user"):
-        st.markdown(prompt)
+        # Display user message
+        with st.chat_message("user"):
+            st.markdown(prompt)
     
-    # Generate and display assistant response
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                if mode == "Quick Answer":
-                    response = ask_question(prompt, api_key)
-                    st.markdown(response)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response
-                    })
+        # Generate and display assistant response
+        with st.chat_message("assistant"):
+            # Near the soft quota, Multiple Viewpoints makes one combined request instead of four
+            single_call_viewpoints = mode == "Multiple Viewpoints" and quota_status == QUOTA_SOFT
+            streaming = stream_responses and mode in ("Quick Answer", "Interactive Tutor")
+            # Answers that render progressively don't need a spinner
+            show_spinner = not streaming and (mode != "Multiple Viewpoints" or single_call_viewpoints)
+            with (st.spinner("Thinking...") if show_spinner else nullcontext()):
+                try:
+                    if mode == "Quick Answer":
+                        from chains.basic_qa import ask_question, stream_question
+                        if streaming:
+                            timer = StreamTimer()
+                            response = st.write_stream(timer.wrap(
+                                stream_question(prompt, api_key, model_name=model_name, temperature=temperature)
+                            ))
+                            show_timing(timer.as_dict())
+                            st.session_state.messages.append({
+                                "role": "assistant",
+                                "content": response,
+                                "timing": timer.as_dict()
+                            })
+                        else:
+                            response = ask_question(prompt, api_key, model_name=model_name, temperature=temperature)
+                            st.markdown(response)
+                            st.session_state.messages.append({
+                                "role": "assistant",
+                                "content": response
+                            })
                 
-                elif mode == "Deep Dive":
-                    response = analyze_topic(prompt, api_key)
-                    st.markdown("### 🔍 Deep Dive Analysis")
+                    elif mode == "Deep Dive":
+                        from chains.structured_analysis import analyze_topic, stream_topic
+                        st.markdown("### 🔍 Deep Dive Analysis")
                     
-                    # Try to parse as structured data
-                    try:
-                        import json
-                        if isinstance(response, str):
-                            # Try to extract JSON from the response
-                            if "{" in response and "}" in response:
-                                json_start = response.find("{")
-                                json_end = response.rfind("}") + 1
-                                json_str = response[json_start:json_end]
-                                structured_data = json.loads(json_str)
-                                
-                                # Display structured data nicely
-                                if "topic" in structured_data:
-                                    st.subheader(f"Topic: {structured_data['topic']}")
-                                if "key_concepts" in structured_data:
-                                    st.write("**Key Concepts:**")
-                                    for concept in structured_data["key_concepts"]:
-                                        st.write(f"• {concept}")
-                                if "explanation" in structured_data:
-                                    st.write("**Explanation:**")
-                                    st.write(structured_data["explanation"])
-                                if "practical_examples" in structured_data:
-                                    st.write("**Practical Examples:**")
-                                    for example in structured_data["practical_examples"]:
-                                        st.write(f"• {example}")
-                                if "summary" in structured_data:
-                                    st.write("**Summary:**")
-                                    st.write(structured_data["summary"])
-                            else:
-                                st.write(response)
+                        if stream_responses:
+                            # Fill in each section as its part of the JSON streams in
+                            placeholder = st.empty()
+                            response = None
+                            for result in stream_topic(prompt, api_key, model_name=model_name, temperature=temperature):
+                                if isinstance(result, TopicExplanation):
+                                    response = result
+                                    result = result.model_dump()
+                                with placeholder.container():
+                                    show_topic_explanation(result)
                         else:
-                            st.json(response)
-                    except:
-                        # Fallback to plain text display
-                        st.write(response)
+                            response = analyze_topic(prompt, api_key, model_name=model_name, temperature=temperature)
+                            show_topic_explanation(response.model_dump())
                     
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "type": "structured",
-                        "content": response
-                    })
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "type": "structured",
+                            "content": response
+                        })
+                
+                    elif single_call_viewpoints:
+                        from chains.parallel_analysis import analyze_perspectives_single_call
+                        st.markdown("### 👥 Multiple Viewpoints")
+                        perspectives_content = analyze_perspectives_single_call(prompt, api_key, model_name=model_name,
+                                                                                temperature=temperature)
+                        for perspective, content in perspectives_content.items():
+                            with st.expander(f"**{perspective.capitalize()} Perspective**", expanded=True):
+                                st.write(content)
+                    
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "type": "parallel",
+                            "content": perspectives_content
+                        })
                 
-                elif mode == "Multiple Viewpoints":
-                    results = analyze_from_multiple_perspectives(prompt, api_key)
-                    st.markdown("### 👥 Multiple Viewpoints")
+                    elif mode == "Multiple Viewpoints":
+                        from chains.parallel_analysis import iter_perspectives, PERSPECTIVE_PROMPTS
+                        st.markdown("### 👥 Multiple Viewpoints")
                     
-                    perspectives_content = {}
-                    for perspective, response in results.items():
-                        with st.expander(f"**{perspective.capitalize()} Perspective**", expanded=True):
-                            content = response.content if hasattr(response, 'content') else str(response)
-                            st.write(content)
+                        # Draw every expander up front and fill each one as its perspective arrives
+                        placeholders = {}
+                        for perspective in PERSPECTIVE_PROMPTS:
+                            with st.expander(f"**{perspective.capitalize()} Perspective**", expanded=True):
+                                placeholders[perspective] = st.empty()
+                                placeholders[perspective].caption("⏳ Thinking...")
+                    
+                        perspectives_content = {}
+                        for perspective, content in iter_perspectives(prompt, api_key, model_name=model_name,
+                                                                      temperature=temperature, stream=stream_responses):
+                            if content is None:
+                                content = PERSPECTIVE_TIMED_OUT
+                                placeholders[perspective].warning(content)
+                            else:
+                                placeholders[perspective].write(content)
                             perspectives_content[perspective] = content
                     
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "type": "parallel",
+                            "content": perspectives_content
+                        })
+                
+                    elif mode == "Interactive Tutor":
+                        from chains.conversational import stream_with_memory
+                        # Use the conversational chain with this session's memory
+                        timer = StreamTimer()
+                        chunks = timer.wrap(stream_with_memory(
+                            prompt,
+                            api_key,
+                            session_id=st.session_state.conversation_id,
+                            topic=st.session_state.current_topic,
+                            model_name=model_name,
+                            temperature=temperature
+                        ))
+                        if streaming:
+                            response_content = st.write_stream(chunks)
+                            show_timing(timer.as_dict())
+                        else:
+                            response_content = "".join(chunks)
+                            st.markdown(response_content)
+                    
+                        message = {
+                            "role": "assistant",
+                            "content": response_content
+                        }
+                        if streaming:
+                            message["timing"] = timer.as_dict()
+                        st.session_state.messages.append(message)
+                
+                except RateLimitExceeded as e:
+                    st.error("⏳ Gemini is rate limiting this API key right now. Please wait a minute and try again.")
                     st.session_state.messages.append({
                         "role": "assistant",
-                        "type": "parallel",
-                        "content": perspectives_content
+                        "content": f"Error: {str(e)}"
                     })
-                
-                elif mode == "Interactive Tutor":
-                    # Use the conversational chain with memory
-                    chat_history = st.session_state.conversation_memory.chat_memory.messages
-                    
-                    # Get response using the existing chain
-                    from langchain_core.prompts import ChatPromptTemplate
-                    from config.gemini_setup import get_gemini_model
-                    
-                    template = ChatPromptTemplate.from_messages([
-                        ("system", f"You are a helpful and fun tutor who understands {st.session_state.current_topic} well. You will always respond in simple terms and explain the foundations clearly."),
-                        ("placeholder", "{chat_history}"),
-                        ("human", "{question}")
-                    ])
-                    
-                    chain = template | get_gemini_model(api_key=api_key)
-                    response = chain.invoke({
-                        "question": prompt,
-                        "chat_history": chat_history
+                except ServiceUnavailable as e:
+                    st.error("⚠️ Gemini is having server trouble right now. Please try again shortly.")
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": f"Error: {str(e)}"
                     })
-                    
-                    response_content = response.content if hasattr(response, 'content') else str(response)
-                    st.markdown(response_content)
-                    
-                    # Save to memory
-                    st.session_state.conversation_memory.save_context(
-                        {"input": prompt},
-                        {"output": response_content}
-                    )
-                    
+                except Exception as e:
+                    st.error(f"An error occurred: {str(e)}")
+                    st.warning("Please check your API key and internet connection.")
                     st.session_state.messages.append({
                         "role": "assistant",
-                        "content": response_content
+                        "content": f"Error: {str(e)}"
                     })
-                
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
-                st.warning("Please check your API key and internet connection.")
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": f"Error: {str(e)}"
-                })
+
+# Per-session LLM usage in the sidebar
+call_summary = get_call_log().session_summary(st.session_state.conversation_id)
+if call_summary:
+    first_token = call_summary["last_time_to_first_token"]
+    call_summary_slot.caption(
+        f"📈 Last call {call_summary['last_latency']:.1f}s"
+        + (f" (first token {first_token:.2f}s)" if first_token is not None else "")
+        + f" · {call_summary['tokens']:,} tokens this session (~${call_summary['cost']:.4f})"
+    )
 
 # Help section at the bottom
 with st.expander("💡 How to use this assistant"):
@@ -0,0 +1,344 @@
+"""Micro-benchmarks for code that runs on every rerun or user action.
+
+Covers ChatManager stats and exports, the saved-chat store and search, the UserAuth
+load/save cycle, the chat history render loop in streamlit_app.py, prompt
+construction for each chain and a cold start of the app on the login page
+and logged in. Results can be saved as a baseline and later runs compared
+against it, flagging anything slower than the threshold.
+
+    python -m tests.benchmarks --save-baseline
+    python -m tests.benchmarks --compare --threshold 0.2
+
+Runs in a throwaway working directory against the fake LLM backend, so no
+API key, network or real users.json is needed.
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import statistics
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "streamlit_app.py")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "tests", "benchmark_baseline.json")
+
+API_KEY = "AIza" + "Benchmark" * 4
+CHAT_SIZES = [10, 100, 1000, 10000]
+USER_COUNTS = [10, 1000, 100000]
+SEARCH_SIZES = [1000, 100000]
+RENDER_SIZES = [10, 100, 500]
+TUTOR_TURNS = [2, 20]
+
+# Smaller sizes for a quick local check
+QUICK_CHAT_SIZES = [10, 100]
+QUICK_USER_COUNTS = [10, 1000]
+QUICK_SEARCH_SIZES = [1000]
+QUICK_RENDER_SIZES = [10]
+
+
+def sample_messages(count: int) -> List[Dict]:
+    """A chat history cycling through every message type the app stores"""
+    from models.topic_analysis import TopicExplanation
+
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"Question {i}: how does retrieval work in step {i}?"})
+            continue
+        kind = (i // 2) % 4
+        if kind == 0:
+            messages.append({"role": "assistant", "content": "A quick answer sentence. " * 20,
+                             "timing": {"time_to_first_token": 0.4, "total_time": 2.1}})
+        elif kind == 1:
+            messages.append({"role": "assistant", "type": "structured", "content": TopicExplanation(
+                main_topic=f"Topic {i}",
+                sub_topics=["Sub-topic one", "Sub-topic two", "Sub-topic three"],
+                real_world_examples=["Example one", "Example two"],
+                connection_to_main_topic="How it all connects.",
+                future_learning_resources=["https://example.com"],
+                quizz_me_on_it=["Q1? A1", "Q2? A2"],
+            )})
+        elif kind == 2:
+            messages.append({"role": "assistant", "type": "parallel", "content": {
+                perspective: f"The {perspective} view of the answer. " * 10
+                for perspective in ("simple", "technical", "code", "history")
+            }})
+        else:
+            messages.append({"role": "assistant", "content": "A tutor reply that builds on the last answer. " * 15})
+    return messages
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Median and best seconds per call over several timed repeats"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_call = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(per_call), "best": min(per_call), "loops": number * repeat}
+
+
+def chat_manager_cases(sizes: List[int]) -> Dict[str, Callable[[], object]]:
+    import streamlit as st
+    from utils.chat_manager import ChatManager, MessageLog, iter_sessions_archive
+
+    st.session_state["current_topic"] = "RAG"
+    chat_manager = ChatManager()
+    cases = {}
+    for size in sizes:
+        messages = MessageLog(sample_messages(size))
+        cases[f"chat_stats[{size}]"] = lambda m=messages: chat_manager.get_chat_stats(m)
+        cases[f"export_json[{size}]"] = lambda m=messages: chat_manager.export_chat_json(m)
+        cases[f"export_txt[{size}]"] = lambda m=messages: chat_manager.export_chat_txt(m)
+        cases[f"export_csv[{size}]"] = lambda m=messages: chat_manager.export_chat_csv(m)
+        cases[f"export_ndjson_gz[{size}]"] = lambda m=messages: chat_manager.export_chat_ndjson_gz(m)
+        cases[f"export_parquet[{size}]"] = lambda m=messages: chat_manager.export_chat_parquet(m)
+        # Ten saved sessions of this size in one zip
+        sessions = [{"name": f"Chat {i}", "timestamp": f"2024-01-{i + 1:02d}T12:00:00", "topic": "RAG",
+                     "messages": messages, "message_count": size} for i in range(10)]
+        cases[f"export_archive[{size}]"] = lambda s=sessions: b"".join(iter_sessions_archive(s, "json", "zip"))
+    return cases
+
+
+def chat_store_cases(sizes: List[int]) -> Dict[str, Callable[[], object]]:
+    from utils.chat_manager import MessageLog
+    from utils.chat_store import ChatStore
+
+    store = ChatStore("chats.sqlite3")
+    cases = {}
+    for size in sizes:
+        user = f"user_{size}"
+        messages = MessageLog(sample_messages(size))
+        store.save(user, "chat", "RAG", messages)
+        store.save(user, "loaded", "RAG", messages)
+        for i in range(size):
+            store.save(user, f"chat_{i}", "RAG", messages[:2])
+
+        def resave(user=user, messages=messages):
+            # Another question and answer, then save again: only those two are written
+            messages.add("user", "One more question?")
+            messages.add("assistant", "One more answer.")
+            store.save(user, "chat", "RAG", messages)
+
+        cases[f"chat_store_resave[{size}]"] = resave
+        cases[f"chat_store_list[{size}]"] = lambda user=user: store.list_chats(user, 10, size // 2)
+        cases[f"chat_store_load[{size}]"] = lambda user=user: MessageLog(store.iter_messages(user, "loaded"))
+    return cases
+
+
+def chat_search_cases(sizes: List[int]) -> Dict[str, Callable[[], object]]:
+    from utils.chat_manager import MessageLog
+    from utils.chat_store import ChatStore
+
+    store = ChatStore("search.sqlite3")
+    cases = {}
+    for size in sizes:
+        # Saved chats of 1,000 messages each, every one matching the common words
+        user = f"user_{size}"
+        chat = MessageLog(sample_messages(min(size, 1000)))
+        for i in range(size // len(chat)):
+            store.save(user, f"chat_{i}", "RAG" if i % 2 else "LLMs", chat)
+        cases[f"chat_search_common[{size}]"] = lambda user=user: store.search(user, "how does retrieval work")
+        cases[f"chat_search_rare[{size}]"] = lambda user=user: store.search(user, "step 998")
+        cases[f"chat_search_filtered[{size}]"] = lambda user=user: store.search(
+            user, "technical view", topic="RAG", types=["parallel"])
+    return cases
+
+
+def user_auth_cases(counts: List[int]) -> Dict[str, Callable[[], object]]:
+    from auth.user_auth import UserAuth
+
+    cases = {}
+    for count in counts:
+        auth = UserAuth()
+        auth.users_file = os.path.join("auth", f"users_{count}.json")
+        auth.users = {
+            f"user_{i}": {
+                "password": auth.hash_password(f"password_{i}"),
+                "email": f"user_{i}@example.com",
+                "created_at": "2025-01-01T00:00:00",
+                "last_login": None,
+                "api_key": None,
+            }
+            for i in range(count)
+        }
+        auth.save_users()
+
+        def cycle(auth=auth):
+            # What a login or API key change does: read the file, then write it back
+            auth.load_users()
+            auth.save_users()
+
+        cases[f"user_auth_cycle[{count}]"] = cycle
+    return cases
+
+
+def render_cases(sizes: List[int]) -> Dict[str, Callable[[], object]]:
+    from streamlit.testing.v1 import AppTest
+
+    cases = {}
+    for size in sizes:
+        at = AppTest.from_file(APP_PATH, default_timeout=120)
+        at.session_state["authenticated"] = True
+        at.session_state["username"] = "benchmark"
+        at.session_state["user_data"] = {}
+        at.session_state["user_api_key"] = API_KEY
+        at.session_state["messages"] = sample_messages(size)
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"streamlit_app.py failed to render: {at.exception[0].message}")
+        cases[f"render_history[{size}]"] = lambda at=at: at.run()
+    return cases
+
+
+def prompt_cases(turns: List[int]) -> Dict[str, Callable[[], object]]:
+    from chains.basic_qa import build_qa_chain
+    from chains.structured_analysis import build_structured_chain
+    from chains.parallel_analysis import build_perspective_chains
+    from chains.conversational import build_tutor_chain
+    from chains.memory import TokenBudgetMemory
+
+    inputs = {"question": "How does chunking affect retrieval quality?", "topic": "RAG"}
+
+    def perspectives():
+        return [chain.first.invoke(inputs) for chain in build_perspective_chains(API_KEY).values()]
+
+    cases = {
+        "prompt_quick": lambda: build_qa_chain(API_KEY).first.invoke(inputs),
+        "prompt_deep": lambda: build_structured_chain(API_KEY).first.invoke(inputs),
+        "prompt_parallel": perspectives,
+    }
+    for count in turns:
+        memory = TokenBudgetMemory()
+        for turn in range(count):
+            memory.save_context({"input": f"Question {turn} about chunking?"},
+                                {"output": "An answer that explains the idea in simple terms. " * 10})
+
+        def tutor(memory=memory):
+            return build_tutor_chain(API_KEY).first.invoke({**inputs, "chat_history": memory.load_messages()})
+
+        cases[f"prompt_tutor[{count}]"] = tutor
+    return cases
+
+
+def startup_cases() -> Dict[str, Callable[[], object]]:
+    from tests.startup import run_app
+
+    # A whole fresh interpreter per call: Python, Streamlit and the app's imports
+    return {f"cold_start[{page}]": lambda page=page: run_app(page) for page in ("login", "app")}
+
+
+def run_benchmarks(quick: bool, repeat: int, only: Optional[str]) -> Dict[str, Dict[str, float]]:
+    """Build every case, time the selected ones and return the results by name"""
+    groups = [
+        lambda: chat_manager_cases(QUICK_CHAT_SIZES if quick else CHAT_SIZES),
+        lambda: chat_store_cases(QUICK_CHAT_SIZES if quick else CHAT_SIZES),
+        lambda: chat_search_cases(QUICK_SEARCH_SIZES if quick else SEARCH_SIZES),
+        lambda: user_auth_cases(QUICK_USER_COUNTS if quick else USER_COUNTS),
+        lambda: render_cases(QUICK_RENDER_SIZES if quick else RENDER_SIZES),
+        lambda: prompt_cases(TUTOR_TURNS),
+        startup_cases,
+    ]
+    results = {}
+    for build in groups:
+        for name, func in build().items():
+            if only and only not in name:
+                continue
+            results[name] = measure(func, repeat)
+            print(f"{name:<28} {format_seconds(results[name]['best']):>10} best"
+                  f" {format_seconds(results[name]['median']):>10} median", file=sys.stderr)
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """Print each case against the baseline and return the regressed case names.
+
+    Compares the best time per call, which is the least affected by noise
+    from other processes.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<28} {'-':>10} {format_seconds(result['best']):>10} {'new':>8}")
+            continue
+        before = baseline[name]["best"]
+        change = result["best"] / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<28} {format_seconds(before):>10} {format_seconds(result['best']):>10} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown that counts as a regression (0.2 = 20%%)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repeats per benchmark")
+    parser.add_argument("--quick", action="store_true", help="Only the smaller sizes")
+    parser.add_argument("-k", dest="only", help="Only run benchmarks whose name contains this text")
+    parser.add_argument("--output", help="Also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    os.chdir(tempfile.mkdtemp(prefix="streamlit-benchmarks-"))
+    sys.path.insert(0, REPO_ROOT)
+
+    results = run_benchmarks(args.quick, args.repeat, args.only)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    exit_code = 0
+    if args.compare:
+        try:
+            with open(baseline_path) as f:
+                baseline = json.load(f)["results"]
+        except (OSError, ValueError, KeyError):
+            print(f"No baseline at {baseline_path}; run with --save-baseline first", file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}: "
+                  f"{', '.join(regressions)}")
+            exit_code = 1
+
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {baseline_path}", file=sys.stderr)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,17 @@
+"""Run the pytest suite against the fake LLM backend in a throwaway directory.
+
+Set up before any app module is imported, since the caches, stores and
+model backend are configured from the environment at import time.
+"""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["FAKE_LLM_LATENCY_MS"] = "1"
+os.environ["FAKE_LLM_TOKENS_PER_SEC"] = "100000"
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+os.chdir(tempfile.mkdtemp(prefix="streamlit-tests-"))
+sys.path.insert(0, REPO_ROOT)
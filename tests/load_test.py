@@ -0,0 +1,363 @@
+"""Concurrent-session load test for streamlit_app.py.
+
+Drives N simulated learners in parallel with Streamlit's AppTest against the
+fake LLM backend. Each session signs in through auth/user_auth, sets an API
+key, switches modes, asks questions, saves and exports. Reports rerun time,
+LLM time, memory per session and throughput as JSON that can be diffed
+between releases.
+
+    python -m tests.load_test --sessions 20 --messages 4 --output load.json
+
+Runs in a throwaway working directory, so users.json and the .cache
+directories of the real checkout are not touched.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import traceback
+import threading
+import subprocess
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "streamlit_app.py")
+
+MODES = ["Quick Answer", "Deep Dive", "Multiple Viewpoints", "Interactive Tutor"]
+QUESTIONS = [
+    "What is retrieval augmented generation?",
+    "How does chunking affect retrieval quality?",
+    "What is an embedding?",
+    "Why do we need a vector database?",
+    "How do I evaluate a RAG pipeline?",
+    "What is reranking?",
+    "How do I keep the index up to date?",
+    "What causes hallucinations in RAG answers?",
+]
+API_KEY = "AIza" + "LoadTest" * 5
+PASSWORD = "loadtest-password"
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (nearest rank), mean and max of a list of seconds"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50), 4),
+        "p95": round(rank(95), 4),
+        "p99": round(rank(99), 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Peak rather than current RSS where /proc is not available (KB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class LLMTimings:
+    """Wall time of every fake model call, collected across threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.first_token: List[float] = []
+        self.total: List[float] = []
+
+    def record(self, first_token: Optional[float], total: float):
+        with self._lock:
+            if first_token is not None:
+                self.first_token.append(first_token)
+            self.total.append(total)
+
+
+llm_timings = LLMTimings()
+
+# Patches that stay in place for the whole load test
+_apptest_patches = ExitStack()
+
+
+def install_timed_backend():
+    """Register a 'fake' backend that also records how long each call takes"""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from config.fake_llm import FakeGeminiModel, create_fake_model
+    from config.gemini_setup import register_backend
+
+    class TimedFakeModel(FakeGeminiModel):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super()._generate(messages, stop, run_manager, **kwargs)
+            finally:
+                llm_timings.record(None, time.perf_counter() - started)
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            started = time.perf_counter()
+            first_token = None
+            try:
+                for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    yield chunk
+            finally:
+                llm_timings.record(first_token, time.perf_counter() - started)
+
+    def create_timed_model(model_name: str, api_key: str, temperature: float):
+        settings = set(FakeGeminiModel.model_fields) - set(BaseChatModel.model_fields)
+        return TimedFakeModel(**create_fake_model(model_name, api_key, temperature).model_dump(include=settings))
+
+    register_backend("fake", create_timed_model)
+
+
+def share_apptest_runtime():
+    """Let several AppTests run at once in this process.
+
+    AppTest installs a mock Runtime singleton (and a config patch) at the start
+    of every run and clears it at the end, so parallel sessions would tear
+    down each other's runtime mid-script. Install one shared mock runtime for
+    the whole load test instead and make the per-run swap a no-op. The script
+    is also compiled once and shared, as the real server does, since
+    concurrent compiles of the same file are not safe on every Python.
+    """
+    from contextlib import nullcontext
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # AppTest assigns Runtime._instance through its module's name for the class
+    app_test.Runtime = SimpleNamespace(_instance=None)
+    app_test.patch_config_options = lambda options: nullcontext()
+    script_cache = ScriptCache()
+    script_cache.get_bytecode(APP_PATH)
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    _apptest_patches.enter_context(patch_config_options({"global.appTest": True}))
+
+
+class SessionRun:
+    """One simulated learner driving the app through AppTest"""
+
+    def __init__(self, index: int, messages: int, timeout: float):
+        self.index = index
+        self.username = f"loadtest_{index}"
+        self.messages = messages
+        self.timeout = timeout
+        self.reruns: Dict[str, List[float]] = {}
+        self.errors: List[str] = []
+        self.answered = 0
+
+    def _run(self, action: str, element=None):
+        """Rerun the script (optionally through a widget) and time it"""
+        started = time.perf_counter()
+        at = (element.run if element is not None else self.at.run)(timeout=self.timeout)
+        self.reruns.setdefault(action, []).append(time.perf_counter() - started)
+        for exception in at.exception:
+            self.errors.append(f"{action}: {exception.message}")
+        return at
+
+    def _button(self, label: str):
+        return next(b for b in self.at.button if b.label == label)
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        self._run("login_page")
+
+        # Sign in through the login form
+        username_input = next(w for w in self.at.text_input if w.label == "Username")
+        password_input = next(w for w in self.at.text_input if w.label == "Password")
+        username_input.set_value(self.username)
+        password_input.set_value(PASSWORD)
+        self._run("login", self._button("🔑 Login").click())
+        if "authenticated" not in self.at.session_state or not self.at.session_state["authenticated"]:
+            raise RuntimeError(f"{self.username} could not log in")
+
+        self._run("api_key", self.at.text_input(key="api_key_input").set_value(API_KEY))
+
+        current_mode = MODES[0]
+        for turn in range(self.messages):
+            mode = MODES[(self.index + turn) % len(MODES)]
+            if mode != current_mode:
+                self._run("switch_mode", self.at.selectbox(key="mode").set_value(mode))
+                current_mode = mode
+            question = QUESTIONS[(self.index + turn) % len(QUESTIONS)]
+            self._run("message", self.at.chat_input[0].set_value(question))
+            last = self.at.session_state["messages"][-1]
+            if last["role"] == "assistant" and not str(last["content"]).startswith("Error:"):
+                self.answered += 1
+            else:
+                self.errors.append(f"message: {str(last['content'])[:200]}")
+
+        self._run("save", self._button("💾 Save Current Chat").click())
+        self._export()
+        return self
+
+    def _export(self):
+        """Time the JSON export the download button would generate"""
+        from utils.chat_manager import iter_chat_json
+
+        started = time.perf_counter()
+        "".join(iter_chat_json(self.at.session_state["messages"], self.at.session_state["current_topic"]))
+        self.reruns.setdefault("export", []).append(time.perf_counter() - started)
+
+
+def run_load_test(sessions: int, messages: int, concurrency: int, timeout: float) -> Dict:
+    """Run the sessions and summarize the results"""
+    from auth.user_auth import UserAuth
+    from config.scheduler import get_scheduler
+    from utils.single_flight import get_single_flight
+
+    auth = UserAuth()
+    for index in range(sessions):
+        auth.create_user(f"loadtest_{index}", PASSWORD, f"loadtest_{index}@example.com")
+
+    # Warm-up run so module imports and lazy initialization are not timed
+    from streamlit.testing.v1 import AppTest
+    AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+
+    baseline_mb = rss_mb()
+    runs = [SessionRun(index, messages, timeout) for index in range(sessions)]
+    failures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="session") as executor:
+        futures = [executor.submit(run.run) for run in runs]
+        for run, future in zip(runs, futures):
+            try:
+                future.result()
+            except Exception as e:
+                frame = traceback.extract_tb(e.__traceback__)[-1]
+                failures.append(f"{run.username}: {type(e).__name__}: {e} ({os.path.basename(frame.filename)}:{frame.lineno})")
+    wall_time = time.perf_counter() - started
+    # Measured while every AppTest, and so every session's state, is still alive
+    memory_mb = rss_mb() - baseline_mb
+
+    reruns_by_action: Dict[str, List[float]] = {}
+    for run in runs:
+        for action, durations in run.reruns.items():
+            reruns_by_action.setdefault(action, []).extend(durations)
+    all_reruns = [d for durations in reruns_by_action.values() for d in durations]
+    answered = sum(run.answered for run in runs)
+    errors = [error for run in runs for error in run.errors] + failures
+    scheduler_stats = get_scheduler().stats()
+
+    return {
+        "rerun_seconds": percentiles(all_reruns),
+        "rerun_seconds_by_action": {action: percentiles(d) for action, d in sorted(reruns_by_action.items())},
+        "llm_seconds": {
+            "time_to_first_token": percentiles(llm_timings.first_token),
+            "total": percentiles(llm_timings.total),
+            "scheduler_avg_wait": round(scheduler_stats["avg_wait"], 4),
+            "scheduler_retries": scheduler_stats["retries"],
+            "single_flight_saved": get_single_flight().stats()["saved"],
+        },
+        "memory": {
+            "baseline_rss_mb": round(baseline_mb, 1),
+            "added_rss_mb": round(memory_mb, 1),
+            "per_session_mb": round(memory_mb / sessions, 2) if sessions else 0.0,
+        },
+        "throughput": {
+            "wall_seconds": round(wall_time, 2),
+            "messages_answered": answered,
+            "messages_per_second": round(answered / wall_time, 3) if wall_time else 0.0,
+            "reruns_per_second": round(len(all_reruns) / wall_time, 3) if wall_time else 0.0,
+        },
+        "errors": {"count": len(errors), "samples": errors[:20]},
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test streamlit_app.py with simulated concurrent sessions")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of simulated learners")
+    parser.add_argument("--messages", type=int, default=4, help="Questions asked per session")
+    parser.add_argument("--concurrency", type=int, default=None, help="Sessions running at once (default: all)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed per script rerun")
+    parser.add_argument("--latency-ms", type=float, default=None, help="Fake LLM first-token latency")
+    parser.add_argument("--error-rate", type=float, default=None, help="Share of fake LLM calls failing with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=None, help="Share of fake LLM calls failing with 429")
+    parser.add_argument("--cache", action="store_true", help="Keep the answer caches on (off by default)")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    # Module-level singletons read these at import, so set them before importing the app
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    os.environ.setdefault("GEMINI_RPM", "100000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    for name, value in (("FAKE_LLM_LATENCY_MS", args.latency_ms), ("FAKE_LLM_ERROR_RATE", args.error_rate),
+                        ("FAKE_LLM_RATE_LIMIT_RATE", args.rate_limit_rate)):
+        if value is not None:
+            os.environ[name] = str(value)
+    if not args.cache:
+        os.environ["RESPONSE_CACHE_MODES"] = ""
+        os.environ["SEMANTIC_CACHE_MODES"] = ""
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="streamlit-load-test-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    install_timed_backend()
+    share_apptest_runtime()
+
+    concurrency = args.concurrency or args.sessions
+    results = run_load_test(args.sessions, args.messages, concurrency, args.timeout)
+    report = {
+        "config": {
+            "sessions": args.sessions,
+            "messages_per_session": args.messages,
+            "concurrency": concurrency,
+            "cache": args.cache,
+            "fake_llm": {name: os.getenv(name) for name in sorted(os.environ) if name.startswith("FAKE_LLM_")},
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+        },
+        **results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(output + "\n")
+    return 1 if results["errors"]["count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
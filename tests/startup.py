@@ -0,0 +1,123 @@
+"""Cold-start import profile of streamlit_app.py.
+
+Runs the app once in a fresh interpreter under `python -X importtime`, either
+as a visitor on the login page or as a logged-in user, and reports how long
+the run spent importing, the slowest imports, and any heavy module (LangChain,
+the Gemini SDK, numpy) that the page pulled in. Neither page should need one
+before the first question.
+
+    python -m tests.startup                 # login page
+    python -m tests.startup --page app --top 30
+
+Exits 1 if the page imports a heavy module. Runs in a throwaway working
+directory against the fake LLM backend. The logged-in run skips the model
+client warm-up, which builds the client on a background thread and would
+otherwise race the measurement.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "streamlit_app.py")
+
+# Modules neither page should need. The app never imports pandas, but Streamlit
+# (which installs it) does for some elements, e.g. st.dataframe
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_google_genai", "langsmith", "google.generativeai",
+                 "pandas", "pyarrow", "numpy")
+
+RUN_MARKER = "--- app run ---"
+
+# Runs in the child interpreter: one AppTest run of the app, timed, after the test harness is imported
+CHILD_SCRIPT = """
+import sys, json, time
+from streamlit.testing.v1 import AppTest
+page, app_path = sys.argv[1], sys.argv[2]
+at = AppTest.from_file(app_path, default_timeout=120)
+if page == "app":
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = "startup"
+    at.session_state["user_data"] = {}
+    at.session_state["user_api_key"] = "AIza" + "Startup" * 5
+    at.session_state["warmed_api_key"] = at.session_state["user_api_key"]
+before = set(sys.modules)
+print(%r, file=sys.stderr, flush=True)
+start = time.perf_counter()
+at.run()
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "modules": sorted(set(sys.modules) - before),
+    "exception": at.exception[0].message if at.exception else None,
+}))
+""" % RUN_MARKER
+
+
+def run_app(page: str, importtime: bool = False) -> Tuple[Dict, str]:
+    """Run the app in a new interpreter; returns its result and stderr"""
+    env = dict(os.environ, LLM_BACKEND="fake", PYTHONPATH=REPO_ROOT, STREAMLIT_LOGGER_LEVEL="error")
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD_SCRIPT, page, APP_PATH]
+    process = subprocess.run(command, capture_output=True, text=True, env=env, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Top-level imports made during the app run, slowest first"""
+    imports = []
+    for line in stderr.split(RUN_MARKER, 1)[-1].splitlines():
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # Nested imports are indented further under the module that triggered them
+        name = fields[2][1:]
+        if not name.startswith(" "):
+            imports.append({"module": name, "seconds": int(fields[1]) / 1e6})
+    return sorted(imports, key=lambda row: row["seconds"], reverse=True)
+
+
+def heavy_modules(modules: List[str]) -> List[str]:
+    """The HEAVY_MODULES among a list of imported modules"""
+    return [name for name in HEAVY_MODULES if name in modules]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Profile the app's cold-start imports")
+    parser.add_argument("--page", choices=["login", "app"], default="login", help="Page to render")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--output", help="Also write the profile to a JSON file")
+    args = parser.parse_args(argv)
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="streamlit-startup-"))
+
+    result, stderr = run_app(args.page, importtime=True)
+    if result["exception"]:
+        print(f"streamlit_app.py failed: {result['exception']}", file=sys.stderr)
+        return 2
+    imports = parse_importtime(stderr)
+    heavy = heavy_modules(result["modules"])
+    report = {
+        "page": args.page,
+        "run_seconds": round(result["seconds"], 3),
+        "import_seconds": round(sum(row["seconds"] for row in imports), 3),
+        "modules_imported": len(result["modules"]),
+        "heavy_modules": heavy,
+        "slowest_imports": [{"module": row["module"], "seconds": round(row["seconds"], 3)}
+                            for row in imports[:args.top]],
+    }
+    print(json.dumps(report, indent=2))
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if heavy:
+        print(f"The {args.page} page imported heavy modules: {', '.join(heavy)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
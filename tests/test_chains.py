@@ -0,0 +1,126 @@
+"""Smoke test every chain end to end against the fake LLM backend."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from langchain_core.runnables import RunnableLambda
+from chains.basic_qa import ask_question, stream_question
+from chains.structured_analysis import analyze_topic, stream_topic
+from chains.parallel_analysis import (PERSPECTIVE_PROMPTS, analyze_from_multiple_perspectives,
+                                      analyze_perspectives_single_call, iter_perspectives)
+from chains.conversational import chat_with_memory, get_conversation_engine, stream_with_memory
+from auth.usage import UsageTracker
+from chains.memory import TokenBudgetMemory, build_summarizer
+from config.gemini_setup import get_model_pool
+from utils.call_metrics import call_config, get_call_log
+from models.topic_analysis import TopicExplanation
+
+API_KEY = "AIza" + "PytestSmoke" * 3
+
+
+@pytest.fixture
+def question(request):
+    # A new question per test, so no answer comes from an earlier test's cache
+    return f"How does retrieval work in {request.node.name}?"
+
+
+def test_quick_answer(question):
+    answer = ask_question(question, API_KEY)
+    assert isinstance(answer, str) and answer
+    # Asked again, the same answer comes back from the response cache
+    assert ask_question(question, API_KEY) == answer
+
+
+def test_quick_answer_streams(question):
+    chunks = list(stream_question(question, API_KEY))
+    assert len(chunks) > 1
+    assert all(isinstance(chunk, str) for chunk in chunks)
+
+
+def test_deep_dive(question):
+    result = analyze_topic(question, API_KEY)
+    assert isinstance(result, TopicExplanation)
+    assert result.main_topic
+
+
+def test_deep_dive_streams_partials_then_result(question):
+    parts = list(stream_topic(question, API_KEY))
+    assert isinstance(parts[-1], TopicExplanation)
+    assert all(isinstance(part, dict) for part in parts[:-1])
+
+
+def test_multiple_viewpoints(question):
+    results = analyze_from_multiple_perspectives(question, API_KEY)
+    assert set(results) == set(PERSPECTIVE_PROMPTS)
+    assert all(results.values())
+
+
+def test_multiple_viewpoints_stream_every_perspective(question):
+    finished = {}
+    for perspective, text in iter_perspectives(question, API_KEY, stream=True, timeout=30):
+        finished[perspective] = text
+    assert set(finished) == set(PERSPECTIVE_PROMPTS)
+    assert all(finished.values())
+
+
+def test_timed_out_viewpoint_is_reported_at_its_deadline(question, monkeypatch):
+    hung, *others = PERSPECTIVE_PROMPTS
+    delays = {hung: 5.0, **{perspective: 0.6 for perspective in others}}
+    monkeypatch.setattr("chains.parallel_analysis.build_perspective_chains", lambda *args: {
+        perspective: RunnableLambda(lambda inputs, delay=delay: time.sleep(delay) or "answer")
+        for perspective, delay in delays.items()
+    })
+    # Three workers, so the last branch starts late and finishes after the hung one's deadline
+    executor = ThreadPoolExecutor(max_workers=3)
+    monkeypatch.setattr("chains.parallel_analysis._executor", executor)
+    order = [perspective for perspective, _ in iter_perspectives(question, API_KEY, timeout=1.0)]
+    executor.shutdown(wait=False)
+    assert order.index(hung) < order.index(others[-1])
+
+
+def test_multiple_viewpoints_single_call(question):
+    sections = analyze_perspectives_single_call(question, API_KEY)
+    assert sections and all(sections.values())
+
+
+def test_tutor_remembers_the_conversation(question):
+    session_id = f"pytest:{question}"
+    engine = get_conversation_engine()
+    first = chat_with_memory(question, API_KEY, session_id=session_id)
+    second = "".join(stream_with_memory("Can you say that more simply?", API_KEY, session_id=session_id))
+    assert first and second
+    memory = engine.peek(session_id)
+    assert [m.content for m in memory.messages] == [question, first, "Can you say that more simply?", second]
+    engine.drop_session(session_id)
+    assert engine.peek(session_id) is None
+
+
+def summarize_in_background(question, config):
+    """Run one background summary the way the tutor does after a turn"""
+    memory = TokenBudgetMemory(keep_turns=1)
+    summarize = build_summarizer(API_KEY, config=config)
+    for _ in range(2):
+        memory.save_context({"input": question}, {"output": "An answer."}, summarizer=summarize)
+    memory.wait(timeout=10)
+    assert memory.summary
+    return [record for record in get_call_log().recent() if record.get("mode") == "summary"][-1]
+
+
+def test_summaries_carry_the_callers_tags(question):
+    record = summarize_in_background(question, call_config("RAG", user="pytest-user", session="pytest-session"))
+    assert (record["topic"], record["user"], record["session"]) == ("RAG", "pytest-user", "pytest-session")
+
+
+def test_summaries_count_toward_the_users_daily_usage(question, tmp_path):
+    tracker = UsageTracker(usage_file=str(tmp_path / "usage.json"))
+    record = summarize_in_background(question, call_config("RAG", user="pytest-quota"))
+    tracker.record(record)
+    usage = tracker.get_usage("pytest-quota")
+    assert usage["requests"] == 1
+    assert usage["tokens"] == record["prompt_tokens"] + record["completion_tokens"] > 0
+
+
+def test_chains_share_pooled_clients(question):
+    ask_question(question, API_KEY)
+    misses = get_model_pool().stats()["misses"]
+    ask_question(question + " again", API_KEY)
+    assert get_model_pool().stats()["misses"] == misses
@@ -0,0 +1,336 @@
+"""Unit tests for the scheduler, single-flight, caches, MessageLog and ChatStore."""
+import threading
+import time
+import pytest
+from config.scheduler import PRIORITIES, RateLimitExceeded, RequestScheduler, ScheduledModel, ServiceUnavailable
+from config.fake_llm import FakeLLMError, create_fake_model
+from config.gemini_setup import ModelPool
+from utils.single_flight import SingleFlight, flight_key
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
+from utils.chat_manager import ChatManager, Message, MessageLog, MessageType, Role
+from utils.chat_store import ChatStore
+from utils.call_metrics import call_config
+
+
+# Request scheduler
+
+def test_scheduler_grants_higher_priority_first():
+    scheduler = RequestScheduler(rpm=60, tpm=1_000_000)
+    # Drain the request bucket so later requests have to queue
+    for _ in range(60):
+        scheduler.acquire("key", 0, 1)
+    order = []
+    threads = [threading.Thread(target=lambda p=p: (scheduler.acquire("key", p, 1), order.append(p)))
+               for p in (3, 2, 0)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(timeout=10)
+    assert order == [0, 2, 3]
+
+
+def test_scheduler_retries_rate_limits_only():
+    scheduler = RequestScheduler(max_retries=2, backoff_base=0.0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeLLMError("429 RESOURCE_EXHAUSTED", 429)
+        return "ok"
+
+    assert scheduler.run("key", 0, 1, flaky) == "ok"
+    assert scheduler.stats("key")["retries"] == 2
+
+    with pytest.raises(RateLimitExceeded):
+        scheduler.run("key", 0, 1, lambda: (_ for _ in ()).throw(FakeLLMError("429 RESOURCE_EXHAUSTED", 429)))
+    # Server errors are retried too, but not reported as a rate limit
+    with pytest.raises(ServiceUnavailable, match="status 503"):
+        scheduler.run("key", 0, 1, lambda: (_ for _ in ()).throw(FakeLLMError("503 UNAVAILABLE", 503)))
+    with pytest.raises(ValueError):
+        scheduler.run("key", 0, 1, lambda: (_ for _ in ()).throw(ValueError("bad request")))
+    assert scheduler.stats("key")["retries"] == 6
+
+
+def test_scheduler_stream_retries_before_first_chunk():
+    scheduler = RequestScheduler(max_retries=1, backoff_base=0.0)
+    starts = []
+
+    def start():
+        starts.append(1)
+        if len(starts) == 1:
+            raise FakeLLMError("429 RESOURCE_EXHAUSTED", 429)
+        yield from "abc"
+
+    assert "".join(scheduler.stream("key", 0, 1, lambda: start())) == "abc"
+    assert len(starts) == 2
+
+
+def test_priority_is_set_per_call_in_the_run_config():
+    scheduler = RequestScheduler()
+    granted = []
+    scheduler.acquire = lambda key_id, priority, tokens: granted.append(priority) or 0.0
+    model = ScheduledModel(create_fake_model("model", "AIza-priority", 0.7), scheduler, "key", PRIORITIES["quick"], "quick")
+    model.invoke("hi", config=call_config("RAG"))
+    model.invoke("hi", config=call_config("RAG", priority="batch"))
+    model.invoke("hi")
+    assert granted == [PRIORITIES["quick"], PRIORITIES["batch"], PRIORITIES["quick"]]
+
+
+def test_async_streams_correct_the_token_bucket():
+    import asyncio
+    scheduler = RequestScheduler()
+    recorded = []
+    scheduler.record_usage = lambda key_id, estimated, actual: recorded.append(actual)
+    model = ScheduledModel(create_fake_model("model", "AIza-astream", 0.7), scheduler, "key", PRIORITIES["quick"], "quick")
+
+    async def consume():
+        return [chunk async for chunk in model.astream("hi")]
+
+    assert asyncio.run(consume())
+    assert recorded and recorded[0] > 0
+
+
+# Single-flight
+
+def test_single_flight_shares_concurrent_calls():
+    group = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do("k", call))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == ["answer"] * 3
+    assert len(calls) == 1
+    assert group.stats() == {"calls": 1, "saved": 2, "in_flight": 0}
+
+
+def test_single_flight_late_stream_subscriber_gets_whole_answer():
+    group = SingleFlight()
+    release = threading.Event()
+
+    def start():
+        yield "a"
+        release.wait(5)
+        yield "b"
+
+    first = group.stream("k", start)
+    assert next(first) == "a"
+    second = group.stream("k", start)
+    release.set()
+    assert "".join(second) == "ab"
+    assert "".join(first) == "b"
+
+
+def test_single_flight_errors_reach_every_caller():
+    group = SingleFlight()
+    with pytest.raises(ValueError):
+        group.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    # A failed flight is not reused
+    assert group.do("k", lambda: "ok") == "ok"
+
+
+def test_flight_keys_are_scoped_to_the_api_key():
+    assert flight_key("AIza-one", "request") != flight_key("AIza-two", "request")
+    assert flight_key("AIza-one", "request") == flight_key("AIza-one", "request")
+    assert "AIza-one" not in flight_key("AIza-one", "request")
+
+
+# Model pool
+
+def test_model_pool_keys_include_the_backend(monkeypatch):
+    pool = ModelPool()
+    fake = pool.get("AIza-pool", "model", 0.5)
+    assert pool.get("AIza-pool", "model", 0.5) is fake
+    monkeypatch.setattr("config.gemini_setup.MODEL_BACKENDS", {"other": lambda *args: object(), "fake": None})
+    monkeypatch.setenv("LLM_BACKEND", "other")
+    assert pool.get("AIza-pool", "model", 0.5) is not fake
+
+
+# Caches
+
+ARGS = ("quick", "What is RAG?", "RAG", "model", 0.7, "v1")
+
+
+def test_response_cache_round_trip_and_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), ttl=60)
+    assert cache.get(*ARGS) is None
+    cache.set(*ARGS, {"text": "answer"})
+    assert cache.get(*ARGS) == {"text": "answer"}
+    # The question is normalized; other settings are part of the key
+    assert cache.get("quick", "  what is rag ", "RAG", "model", 0.7, "v1") == {"text": "answer"}
+    assert cache.get("quick", "What is RAG?", "RAG", "model", 0.2, "v1") is None
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get(*ARGS) is None
+
+
+def test_response_cache_skips_disabled_modes(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), enabled_modes="deep")
+    cache.set(*ARGS, "answer")
+    assert cache.get(*ARGS) is None
+
+
+def test_semantic_cache_matches_paraphrases(tmp_path):
+    cache = SemanticCache(str(tmp_path / "semantic"))
+    cache.set("quick", "What is retrieval augmented generation?", "RAG", "model", 0.7, "v1", "answer")
+    assert cache.get("quick", "what is retrieval-augmented generation", "RAG", "model", 0.7, "v1") == "answer"
+    assert cache.get("quick", "How do I bake bread?", "RAG", "model", 0.7, "v1") is None
+    assert cache.get("quick", "What is retrieval augmented generation?", "Other", "model", 0.7, "v1") is None
+
+
+def test_semantic_cache_overwrites_the_same_question(tmp_path):
+    cache = SemanticCache(str(tmp_path / "semantic"))
+    for answer in ("old", "new"):
+        cache.set("quick", "What is RAG?", "RAG", "model", 0.7, "v1", answer)
+    assert cache.get("quick", "What is RAG?", "RAG", "model", 0.7, "v1") == "new"
+    assert cache.stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is RAG?", "Why RAG?"),
+    ("What is RAG?", "Is RAG for me?"),
+    ("What is RAG?", "When is RAG?"),
+    ("How does RAG work?", "Why does RAG work?"),
+    ("When should I use RAG?", "When should I not use RAG?"),
+    ("When should I use RAG?", "When shouldn't I use RAG?"),
+    ("Give me 3 examples", "Give me 10 examples"),
+])
+def test_semantic_cache_misses_different_questions(tmp_path, cached, asked):
+    cache = SemanticCache(str(tmp_path / "semantic"))
+    cache.set("quick", cached, "RAG", "model", 0.7, "v1", "answer")
+    assert cache.get("quick", asked, "RAG", "model", 0.7, "v1") is None
+
+
+def test_semantic_cache_keeps_different_questions_apart(tmp_path):
+    cache = SemanticCache(str(tmp_path / "semantic"))
+    cache.set("quick", "What is RAG?", "RAG", "model", 0.7, "v1", "Retrieval plus generation")
+    cache.set("quick", "Is RAG for me?", "RAG", "model", 0.7, "v1", "Yes if...")
+    assert cache.get("quick", "What is RAG?", "RAG", "model", 0.7, "v1") == "Retrieval plus generation"
+    assert cache.stats()["entries"] == 2
+
+
+def test_semantic_cache_bounds_open_and_stored_topics(tmp_path):
+    cache = SemanticCache(str(tmp_path / "semantic"), max_open_topics=2, max_topics=3)
+    # A lookup in an unknown topic creates nothing
+    assert cache.get("quick", "What is RAG?", "Nothing yet", "model", 0.7, "v1") is None
+    assert not list((tmp_path / "semantic").glob("*.f32"))
+
+    for topic in ("one", "two", "three", "four"):
+        cache.set("quick", "What is RAG?", topic, "model", 0.7, "v1", topic)
+        time.sleep(0.01)
+    assert len(cache._partitions) == 2
+    assert len(list((tmp_path / "semantic").glob("*.f32"))) == 3
+    # The least recently written topic is gone; closed ones reload from disk
+    assert cache.get("quick", "What is RAG?", "one", "model", 0.7, "v1") is None
+    assert cache.get("quick", "What is RAG?", "two", "model", 0.7, "v1") == "two"
+    assert cache.stats()["entries"] == 3
+
+
+# MessageLog
+
+def test_message_log_keeps_running_stats():
+    log = MessageLog([{"role": "user", "content": "hi"}])
+    reply = log.add(Role.ASSISTANT, "hello there", MessageType.STANDARD)
+    assert log.last_id == reply.id
+    assert log.stats() == {"total_messages": 2, "user_messages": 1, "assistant_messages": 1,
+                           "total_characters": 13, "avg_message_length": 6}
+
+    snapshot = log.copy()
+    log.add(Role.USER, "more")
+    assert len(snapshot) == 2 and len(log) == 3
+    assert snapshot.stats()["total_characters"] == 13
+
+    log.clear()
+    assert not log and log.last_id is None and log.stats()["total_characters"] == 0
+
+
+def test_message_round_trips_through_dicts():
+    message = Message(Role.ASSISTANT, {"main_topic": "RAG"}, MessageType.STRUCTURED, {"total_time": 1.0})
+    data = message.to_dict()
+    assert data["type"] == "structured" and "timing" in data
+    copy = Message.from_dict(data)
+    assert (copy.id, copy.type, copy.content) == (message.id, message.type, message.content)
+    assert "type" not in Message(Role.USER, "hi").to_dict()
+
+
+# ChatStore
+
+def chat(*texts):
+    return [Message(Role.USER if i % 2 == 0 else Role.ASSISTANT, text) for i, text in enumerate(texts)]
+
+
+def test_chat_store_saves_appends_and_deletes(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.sqlite3"))
+    messages = chat("What is a vector index?", "A data structure for similarity search.")
+    store.save("alice", "first", "RAG", messages)
+    result = store.save("alice", "first", "RAG", messages + chat("And chunking?"))
+    # Only the new message is written
+    assert result["written_from"] == 2
+
+    assert [m["content"] for m in store.iter_messages("alice", "first")][-1] == "And chunking?"
+    assert store.get_chat("alice", "first")["message_count"] == 3
+    assert store.count_chats("alice") == 1 and store.count_chats("bob") == 0
+    assert store.list_topics("alice") == ["RAG"]
+
+    assert store.delete("alice", "first")
+    assert store.get_chat("alice", "first") is None
+    assert not store.delete("alice", "first")
+
+
+def test_chat_store_search_is_per_user(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.sqlite3"))
+    store.save("alice", "a", "RAG", chat("How do embeddings work?", "Embeddings map text to vectors."))
+    store.save("bob", "b", "RAG", chat("How do embeddings work?", "Something else."))
+
+    hits = store.search("alice", "embed")
+    assert hits and {hit["name"] for hit in hits} == {"a"}
+    assert "**" in hits[0]["snippet"]
+    assert store.search("alice", "embeddings", topic="Other") == []
+    assert store.search("alice", "   ") == []
+    store.delete("alice", "a")
+    assert store.search("alice", "embeddings") == []
+
+
+def test_chat_store_remembers_the_last_export_per_user(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.sqlite3"))
+    assert store.last_export("alice") is None
+    store.mark_exported("alice", "2026-01-02T00:00:00")
+    store.mark_exported("alice", "2026-01-01T00:00:00")
+    assert store.last_export("alice") == "2026-01-02T00:00:00"
+    assert store.last_export("bob") is None
+    # Kept across connections, i.e. across sessions and restarts
+    assert ChatStore(str(tmp_path / "chats.sqlite3")).last_export("alice") == "2026-01-02T00:00:00"
+
+
+def test_incremental_archive_only_advances_after_a_complete_export(tmp_path, monkeypatch):
+    store = ChatStore(str(tmp_path / "chats.sqlite3"))
+    monkeypatch.setattr("utils.chat_manager.get_chat_store", lambda: store)
+    manager = ChatManager()
+    store.save(manager.user, "first", "RAG", chat("What is RAG?", "Retrieval plus generation."))
+
+    assert manager.deferred_archive("json", "zip")()
+    first_export = manager.last_archive_export()
+    assert first_export is not None
+
+    store.save(manager.user, "second", "RAG", chat("What is a chunk?", "A piece of a document."))
+    monkeypatch.setattr(manager, "load_messages", lambda data: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        manager.deferred_archive("json", "zip", incremental=True)()
+    # The failed export did not move the mark, so the new chat is still pending
+    assert manager.last_archive_export() == first_export
+    assert manager.count_saved_chats(first_export) == 1
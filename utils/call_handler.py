@@ -0,0 +1,58 @@
+import time
+from typing import Any, Dict, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.call_metrics import get_call_log
+
+# Kept apart from utils.call_metrics so the call log can be used without importing LangChain
+
+
+class CallMetricsHandler(BaseCallbackHandler):
+    """Collect timing, tokens and errors for one scheduled model request.
+
+    One handler spans the whole request, including time queued in the
+    scheduler and any retries; finish() turns it into a record in the call log.
+    """
+
+    def __init__(self, tags: Dict[str, Any]):
+        self.tags = tags
+        self.started = time.monotonic()
+        self.queue_time = 0.0
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+
+    def record_queue_wait(self, seconds: float):
+        self.queue_time += seconds
+
+    def record_retry(self, error: Exception):
+        self.retries += 1
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        if token and self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def on_llm_end(self, response, **kwargs: Any):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.prompt_tokens = usage.get("input_tokens", 0)
+                    self.completion_tokens = usage.get("output_tokens", 0)
+
+    def finish(self, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        """Build the call record and add it to the call log"""
+        latency = time.monotonic() - self.started
+        record = {
+            "ts": round(time.time(), 3),
+            **self.tags,
+            "queue_time": round(self.queue_time, 4),
+            "time_to_first_token": round(self.first_token_at - self.started, 4) if self.first_token_at else None,
+            "latency": round(latency, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "retries": self.retries,
+            "error": f"{type(error).__name__}: {error}"[:300] if error else None,
+        }
+        get_call_log().add(record)
+        return record
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Metadata keys copied from the LangChain run config onto each call record
+TAG_KEYS = ("topic", "user", "session", "perspective")
+
+# Upper bounds in seconds for the latency histograms
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per million tokens as model=input/output; override with MODEL_PRICES
+DEFAULT_MODEL_PRICES = "gemini-2.5-flash=0.30/2.50,gemini-1.5-pro=1.25/5.00"
+
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse 'model=input/output,...' into {model: (input, output)}"""
+    prices = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, rates = item.split("=", 1)
+        input_rate, output_rate = rates.split("/", 1)
+        prices[model.strip()] = (float(input_rate), float(output_rate))
+    return prices
+
+
+def session_tags() -> Dict[str, str]:
+    """User and session of the Streamlit script run on this thread, if any"""
+    try:
+        import streamlit as st
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx(suppress_warning=True) is None:
+            return {}
+        tags = {"user": st.session_state.get("username"), "session": st.session_state.get("conversation_id")}
+        return {name: value for name, value in tags.items() if value}
+    except Exception:
+        return {}
+
+
+def call_config(topic: str, priority: Optional[str] = None, **tags) -> Dict:
+    """LangChain run config tagging a chain call with its topic, user and session.
+
+    Build it on the calling thread: worker and single-flight threads have no
+    Streamlit session to read the user from. priority is a key of
+    config.scheduler.PRIORITIES.
+    """
+    metadata = {"topic": topic, **session_tags(), **tags}
+    if priority:
+        metadata["priority"] = priority
+    return {"metadata": metadata}
+
+
+def with_handler(config: Optional[Dict], handler: Any) -> Dict:
+    """Copy of a run config with one more callback handler"""
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        callbacks = [handler]
+    elif isinstance(callbacks, list):
+        callbacks = [*callbacks, handler]
+    else:
+        # Already a callback manager, e.g. when called inside a chain
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    config["callbacks"] = callbacks
+    return config
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class CallLog:
+    """Where call records go: a ring buffer, a rotating JSONL log and Prometheus metrics.
+
+    Prometheus series are labelled by mode and model only; user and topic
+    stay in the JSONL log so the label cardinality stays bounded.
+    """
+
+    def __init__(self, size: int = 1000, log_path: Optional[str] = ".cache/metrics/calls.jsonl",
+                 max_bytes: int = 10_000_000, backups: int = 5, prom_path: Optional[str] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None, max_sessions: int = 10_000):
+        self.records = deque(maxlen=size)
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.prom_path = prom_path
+        self.prices = prices if prices is not None else parse_prices(DEFAULT_MODEL_PRICES)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        self._prom_written_at = 0.0
+        self._listeners = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Call listener with every new record, e.g. for usage accounting"""
+        self._listeners.append(listener)
+
+    def cost(self, model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+        """Estimated USD cost of a call; 0 for models without a price"""
+        input_rate, output_rate = self.prices.get((model or "").replace("models/", ""), (0.0, 0.0))
+        return (prompt_tokens * input_rate + completion_tokens * output_rate) / 1_000_000
+
+    def add(self, record: Dict[str, Any]):
+        record["cost"] = round(self.cost(record.get("model"), record["prompt_tokens"], record["completion_tokens"]), 6)
+        labels = (("mode", record.get("mode") or ""), ("model", record.get("model") or ""))
+        with self._lock:
+            self.records.append(record)
+            self._count("llm_requests_total", labels + (("status", "error" if record["error"] else "ok"),))
+            self._count("llm_retries_total", labels, record["retries"])
+            self._count("llm_tokens_total", labels + (("type", "prompt"),), record["prompt_tokens"])
+            self._count("llm_tokens_total", labels + (("type", "completion"),), record["completion_tokens"])
+            self._count("llm_cost_usd_total", labels, record["cost"])
+            self._observe("llm_request_latency_seconds", labels, record["latency"])
+            self._observe("llm_queue_wait_seconds", labels, record["queue_time"])
+            if record["time_to_first_token"] is not None:
+                self._observe("llm_time_to_first_token_seconds", labels, record["time_to_first_token"])
+            if record.get("session"):
+                self._add_to_session(record)
+        self._write_jsonl(record)
+        self._maybe_write_prometheus()
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception:
+                logging.getLogger(__name__).exception("Call log listener failed")
+
+    def _count(self, name: str, labels: Tuple, amount: float = 1):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def _observe(self, name: str, labels: Tuple, value: float):
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = _Histogram()
+        histogram.observe(value)
+
+    def _add_to_session(self, record: Dict[str, Any]):
+        summary = self._sessions.pop(record["session"], None) or {"calls": 0, "tokens": 0, "cost": 0.0, "errors": 0}
+        summary["calls"] += 1
+        summary["tokens"] += record["prompt_tokens"] + record["completion_tokens"]
+        summary["cost"] += record["cost"]
+        summary["errors"] += 1 if record["error"] else 0
+        summary["last_latency"] = record["latency"]
+        summary["last_time_to_first_token"] = record["time_to_first_token"]
+        summary["last_mode"] = record.get("mode")
+        self._sessions[record["session"]] = summary
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def session_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Calls, tokens, cost and last-call latency for one session"""
+        with self._lock:
+            summary = self._sessions.get(session_id)
+            return dict(summary) if summary else None
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The most recent call records, newest last"""
+        with self._lock:
+            return list(self.records)[-limit:]
+
+    def _write_jsonl(self, record: Dict[str, Any]):
+        if not self.log_path:
+            return
+        try:
+            if self._logger is None:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                logger = logging.getLogger("call_metrics")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                if not logger.handlers:
+                    handler = RotatingFileHandler(self.log_path, maxBytes=self.max_bytes, backupCount=self.backups)
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    logger.addHandler(handler)
+                self._logger = logger
+            self._logger.info(json.dumps(record, ensure_ascii=False))
+        except OSError:
+            pass
+
+    def prometheus_text(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        def format_labels(labels):
+            return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            for name in sorted({name for (name, _), _ in counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in counters:
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for name in sorted({name for (name, _), _ in histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in histograms:
+                    if metric != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.total:g}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _maybe_write_prometheus(self, interval: float = 5.0):
+        """Refresh the textfile-collector file at most every interval seconds"""
+        if not self.prom_path or time.monotonic() - self._prom_written_at < interval:
+            return
+        self._prom_written_at = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.prom_path) or ".", exist_ok=True)
+            tmp_path = f"{self.prom_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prom_path)
+        except OSError:
+            pass
+
+
+def start_metrics_server(call_log: CallLog, port: int) -> ThreadingHTTPServer:
+    """Serve the Prometheus metrics on http://0.0.0.0:port/metrics"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = call_log.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_call_log = None
+_call_log_lock = threading.Lock()
+
+
+def get_call_log() -> CallLog:
+    """Get the process-wide call log (configured from METRICS_* environment variables)"""
+    global _call_log
+    if _call_log is None:
+        with _call_log_lock:
+            if _call_log is None:
+                _call_log = CallLog(
+                    size=int(os.getenv("METRICS_RING_SIZE", "1000")),
+                    log_path=os.getenv("METRICS_LOG_PATH", ".cache/metrics/calls.jsonl") or None,
+                    max_bytes=int(os.getenv("METRICS_LOG_MAX_BYTES", "10000000")),
+                    backups=int(os.getenv("METRICS_LOG_BACKUPS", "5")),
+                    prom_path=os.getenv("METRICS_PROM_PATH", ".cache/metrics/metrics.prom") or None,
+                    prices=parse_prices(os.getenv("MODEL_PRICES", DEFAULT_MODEL_PRICES))
+                )
+                port = os.getenv("METRICS_PORT")
+                if port:
+                    try:
+                        start_metrics_server(_call_log, int(port))
+                    except OSError:
+                        # Another process (or an earlier reload) already serves this port
+                        pass
+    return _call_log
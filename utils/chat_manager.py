@@ -1,136 +1,577 @@
 import streamlit as st
 import json
-import pandas as pd
-from datetime import datetime
-from typing import List, Dict, Any
+import time
+import uuid
+from enum import Enum
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
 import io
+import re
+import csv
+import zlib
 import base64
+import tarfile
+import zipfile
+import tempfile
+from utils.chat_store import get_chat_store
+from utils.transcript import request_jump
 
-class ChatManager:
+class Role(str, Enum):
+    USER = "user"
+    ASSISTANT = "assistant"
+
+class MessageType(str, Enum):
+    STANDARD = "standard"
+    STRUCTURED = "structured"
+    PARALLEL = "parallel"
+
+class Message:
+    """One chat message.
+    
+    Reads like the dicts the app used to store (message["role"],
+    message.get("type"), "timing" in message) so rendering and export code
+    works on either. Deep Dive answers are kept as plain dicts rather than
+    TopicExplanation models, and the character count is worked out once.
+    """
+    
+    __slots__ = ("id", "ts", "role", "type", "content", "timing", "chars")
+    
+    def __init__(self, role: Role, content: Any, type: MessageType = MessageType.STANDARD,
+                 timing: Optional[Dict] = None, id: Optional[str] = None, ts: Optional[float] = None):
+        if hasattr(content, "model_dump"):
+            content = content.model_dump()
+        self.id = id or uuid.uuid4().hex[:12]
+        self.ts = ts if ts is not None else time.time()
+        self.role = Role(role)
+        self.type = MessageType(type)
+        self.content = content
+        self.timing = timing
+        self.chars = len(str(content))
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Message":
+        return cls(data["role"], data["content"], data.get("type") or MessageType.STANDARD,
+                   data.get("timing"), data.get("id"), data.get("ts"))
+    
+    def to_dict(self) -> Dict:
+        """Plain dict for JSON; the content is shared, not copied"""
+        data = {"id": self.id, "ts": self.ts, "role": self.role.value, "content": self.content}
+        if self.type is not MessageType.STANDARD:
+            data["type"] = self.type.value
+        if self.timing is not None:
+            data["timing"] = self.timing
+        return data
+    
+    def _field(self, key: str):
+        if key == "role":
+            return self.role.value
+        if key == "type":
+            return None if self.type is MessageType.STANDARD else self.type.value
+        if key in ("id", "ts", "content", "timing"):
+            return getattr(self, key)
+        return None
+    
+    def __getitem__(self, key: str):
+        value = self._field(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def get(self, key: str, default: Any = None):
+        value = self._field(key)
+        return default if value is None else value
+    
+    def __contains__(self, key: str) -> bool:
+        return self._field(key) is not None
+
+class MessageLog:
+    """Append-only list of chat messages with running statistics.
+    
+    Counts and character totals are updated on append, so get_chat_stats is
+    O(1) however long the chat is.
+    """
+    
+    __slots__ = ("_messages", "chars", "role_counts", "role_chars")
+    
+    def __init__(self, messages: Iterable[Union[Message, Dict]] = ()):
+        self._messages: List[Message] = []
+        self.chars = 0
+        self.role_counts = {role: 0 for role in Role}
+        self.role_chars = {role: 0 for role in Role}
+        for message in messages:
+            self.append(message)
+    
+    def append(self, message: Union[Message, Dict]) -> Message:
+        """Add a message; dicts in the old format are converted"""
+        if not isinstance(message, Message):
+            message = Message.from_dict(message)
+        self._messages.append(message)
+        self.chars += message.chars
+        self.role_counts[message.role] += 1
+        self.role_chars[message.role] += message.chars
+        return message
+    
+    def add(self, role: Role, content: Any, type: MessageType = MessageType.STANDARD,
+            timing: Optional[Dict] = None) -> Message:
+        return self.append(Message(role, content, type, timing))
+    
+    def clear(self):
+        self._messages = []
+        self.chars = 0
+        self.role_counts = {role: 0 for role in Role}
+        self.role_chars = {role: 0 for role in Role}
+    
+    def copy(self) -> "MessageLog":
+        """A snapshot sharing the (unchanging) message records"""
+        log = MessageLog()
+        log._messages = list(self._messages)
+        log.chars = self.chars
+        log.role_counts = dict(self.role_counts)
+        log.role_chars = dict(self.role_chars)
+        return log
+    
+    @property
+    def last_id(self) -> Optional[str]:
+        return self._messages[-1].id if self._messages else None
+    
+    def stats(self) -> Dict[str, int]:
+        count = len(self._messages)
+        return {
+            "total_messages": count,
+            "user_messages": self.role_counts[Role.USER],
+            "assistant_messages": self.role_counts[Role.ASSISTANT],
+            "total_characters": self.chars,
+            "avg_message_length": self.chars // count if count else 0,
+        }
+    
+    def to_list(self) -> List[Dict]:
+        return [message.to_dict() for message in self._messages]
+    
+    @classmethod
+    def from_list(cls, messages: Iterable[Union[Message, Dict]]) -> "MessageLog":
+        return messages.copy() if isinstance(messages, MessageLog) else cls(messages)
+    
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+    
+    def __len__(self) -> int:
+        return len(self._messages)
+    
+    def __bool__(self) -> bool:
+        return bool(self._messages)
+    
+    def __getitem__(self, index):
+        return self._messages[index]
+
+def as_message_log(messages: Optional[Iterable] = None) -> MessageLog:
+    """A MessageLog for a list of messages; defaults to the current chat"""
+    if messages is None:
+        return get_message_log()
+    if isinstance(messages, MessageLog):
+        return messages
+    return MessageLog(messages)
+
+def get_message_log() -> MessageLog:
+    """The current chat's MessageLog, converting a plain list left in session state"""
+    messages = st.session_state.get("messages")
+    if not isinstance(messages, MessageLog):
+        messages = st.session_state["messages"] = MessageLog(messages or [])
+    return messages
+
+def iter_chat_json(messages: MessageLog, topic: str) -> Iterator[str]:
+    """Chat export as JSON, one message per chunk"""
+    export_info = {
+        "timestamp": datetime.now().isoformat(),
+        "topic": topic,
+        "app": "AI Learning Assistant",
+        "total_messages": len(messages)
+    }
+    info = json.dumps(export_info, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+    yield f'{{\n  "export_info": {info},\n  "conversation": ['
+    for i, message in enumerate(messages):
+        yield ("," if i else "") + "\n    " + json.dumps(message.to_dict(), ensure_ascii=False)
+    yield "\n  ]\n}\n"
+
+def iter_chat_txt(messages: MessageLog, topic: str) -> Iterator[str]:
+    """Chat export as readable text, one message per chunk"""
+    yield "\n".join([
+        "=" * 50,
+        "AI LEARNING ASSISTANT - CHAT EXPORT",
+        "=" * 50,
+        f"Topic: {topic}",
+        f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Total Messages: {len(messages)}",
+        "=" * 50,
+        "",
+        ""
+    ])
+    
+    for i, message in enumerate(messages, 1):
+        role = "🙋 YOU" if message.role is Role.USER else "🤖 AI ASSISTANT"
+        lines = [f"[{i}] {role}:", "-" * 30]
+        if message.type is MessageType.STRUCTURED:
+            lines.append("📊 STRUCTURED ANALYSIS:")
+            lines.append(str(message.content))
+        elif message.type is MessageType.PARALLEL:
+            lines.append("👥 MULTIPLE PERSPECTIVES:")
+            lines.append("\n".join([f"\n{k.upper()}: {v}" for k, v in message.content.items()]))
+        else:
+            lines.append(str(message.content))
+        lines.append("")
+        yield "\n".join(lines) + "\n"
+    
+    yield "\n".join([
+        "=" * 50,
+        "Generated by AI Learning Assistant",
+        "https://github.com/agentic-kiwi/streamlit-app"
+    ])
+
+def iter_chat_csv(messages: MessageLog, topic: str, rows_per_chunk: int = 200) -> Iterator[str]:
+    """Chat export as CSV, written with the csv module a batch of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["message_id", "timestamp", "role", "content", "message_type", "topic"])
+    for i, message in enumerate(messages, 1):
+        writer.writerow([
+            i,
+            datetime.fromtimestamp(message.ts).isoformat(),
+            message.role.value,
+            str(message.content),
+            message.type.value,
+            topic
+        ])
+        if i % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def chat_rows(messages: MessageLog, topic: str) -> Iterator[Dict[str, Any]]:
+    """Flat rows for analytics: one per message, or one per perspective for
+    Multiple Viewpoints answers. Deep Dive content is a JSON string."""
+    for message in messages:
+        row = {"message_id": message.id, "ts": message.ts, "role": message.role.value,
+               "type": message.type.value, "topic": topic, "perspective": None}
+        if message.type is MessageType.PARALLEL:
+            for perspective, text in message.content.items():
+                yield {**row, "perspective": perspective, "content": str(text)}
+        elif message.type is MessageType.STRUCTURED:
+            yield {**row, "content": json.dumps(message.content, ensure_ascii=False)}
+        else:
+            yield {**row, "content": str(message.content)}
+
+def iter_chat_ndjson_gz(messages: MessageLog, topic: str, compress_level: int = 6) -> Iterator[bytes]:
+    """Gzip-compressed NDJSON, one row per line, compressed as it is written"""
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for row in chat_rows(messages, topic):
+        chunk = compressor.compress((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+class _ChunkSink:
+    """Write-only file object that hands back what was written since the last take()"""
+    
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+def chat_arrow_schema():
+    import pyarrow as pa
+    
+    text = pa.dictionary(pa.int8(), pa.string())
+    return pa.schema([
+        ("message_id", pa.string()),
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("role", text),
+        ("type", text),
+        ("topic", text),
+        ("perspective", text),
+        ("content", pa.large_string()),
+    ])
+
+def iter_chat_parquet(messages: MessageLog, topic: str, rows_per_group: int = 2000) -> Iterator[bytes]:
+    """Parquet with typed columns, written one row group at a time.
+    
+    pyarrow is imported here rather than at module level so it only loads
+    for this export.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = chat_arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    
+    def write(rows):
+        columns = {name: [row[name] for row in rows] for name in schema.names}
+        columns["ts"] = [int(ts * 1000) for ts in columns["ts"]]
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+    
+    rows = []
+    for row in chat_rows(messages, topic):
+        rows.append(row)
+        if len(rows) == rows_per_group:
+            write(rows)
+            rows = []
+            yield sink.take()
+    if rows or not sink.tell():
+        write(rows)
+    writer.close()
+    yield sink.take()
+
+# Export format -> (chunk generator, MIME type, file extension, button label)
+EXPORT_FORMATS = {
+    "json": (iter_chat_json, "application/json", "json", "📋 JSON"),
+    "txt": (iter_chat_txt, "text/plain", "txt", "📝 TXT"),
+    "csv": (iter_chat_csv, "text/csv", "csv", "📊 CSV"),
+    "ndjson": (iter_chat_ndjson_gz, "application/gzip", "ndjson.gz", "🗜️ NDJSON"),
+    "parquet": (iter_chat_parquet, "application/vnd.apache.parquet", "parquet", "🧱 Parquet"),
+}
+
+class ExportCache:
+    """The last export of each format for one chat.
+    
+    Keyed by (topic, message count, last message ID): messages are only ever
+    appended, so an unchanged key means an unchanged chat and a repeat
+    download reuses the bytes.
+    """
+    
     def __init__(self):
-        self.chat_history_key = "chat_sessions"
-        self.ensure_chat_history()
+        self._entries: Dict[str, tuple] = {}
+        self.hits = 0
+    
+    def get(self, fmt: str, messages: MessageLog, topic: str) -> bytes:
+        key = (topic, len(messages), messages.last_id)
+        entry = self._entries.get(fmt)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        generate = EXPORT_FORMATS[fmt][0]
+        data = b"".join(chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                        for chunk in generate(messages, topic))
+        self._entries[fmt] = (key, data)
+        return data
+
+# Saved chats listed per page in the sidebar
+SAVED_CHATS_PAGE_SIZE = 10
+
+# Search filter -> message type; Quick Answer and Tutor replies are both plain text
+SEARCH_MODES = {
+    "Quick Answer / Tutor": MessageType.STANDARD.value,
+    "Deep Dive": MessageType.STRUCTURED.value,
+    "Multiple Viewpoints": MessageType.PARALLEL.value,
+}
+ALL_TOPICS = "All topics"
+
+# Archive format -> (MIME type, file extension)
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+
+# Formats that are already compressed; zip stores them as they are
+COMPRESSED_FORMATS = {"ndjson", "parquet"}
+
+def archive_member_names(sessions: List[Dict], extension: str) -> List[str]:
+    """A unique, filesystem-safe file name per session"""
+    names, used = [], set()
+    for data in sessions:
+        stem = re.sub(r"[^\w.-]+", "_", data["name"]).strip("._") or "chat"
+        name, number = stem, 1
+        while name in used:
+            number += 1
+            name = f"{stem}_{number}"
+        used.add(name)
+        names.append(f"sessions/{name}.{extension}")
+    return names
+
+def iter_sessions_archive(sessions: List[Dict], fmt: str = "json", archive: str = "zip",
+                          since: Optional[str] = None, exported_at: Optional[str] = None,
+                          load: Optional[Callable[[Dict], MessageLog]] = None) -> Iterator[bytes]:
+    """A zip or tar.gz of saved sessions, one file each plus manifest.json.
+    
+    Sessions are loaded (load(session), default its "messages") and exported
+    one at a time, and their bytes handed back as each is added, so only one
+    session is in memory. tar needs a member's size up front, so each member
+    is spooled first (to disk past 1 MB).
+    """
+    load = load or (lambda data: MessageLog.from_list(data["messages"]))
+    generate, _, extension, _ = EXPORT_FORMATS[fmt]
+    exported_at = exported_at or datetime.now().isoformat()
+    sink = _ChunkSink()
+    manifest = {"exported_at": exported_at, "since": since, "format": fmt, "sessions": []}
+    
+    def chunks(data):
+        for chunk in generate(load(data), data["topic"]):
+            yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+    
+    if archive == "zip":
+        # The sink can't seek, so zipfile writes sizes after each member's data
+        bundle = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+        
+        def add(name, data, timestamp, stored=False):
+            info = zipfile.ZipInfo(name, date_time=datetime.fromisoformat(timestamp).timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            size = 0
+            with bundle.open(info, "w") as member:
+                for chunk in data:
+                    member.write(chunk)
+                    size += len(chunk)
+            return size
+    else:
+        bundle = tarfile.open(fileobj=sink, mode="w|gz")
+        
+        def add(name, data, timestamp, stored=False):
+            with tempfile.SpooledTemporaryFile(max_size=1 << 20) as spool:
+                for chunk in data:
+                    spool.write(chunk)
+                info = tarfile.TarInfo(name)
+                info.size = spool.tell()
+                info.mtime = datetime.fromisoformat(timestamp).timestamp()
+                spool.seek(0)
+                bundle.addfile(info, spool)
+            return info.size
     
-    def ensure_chat_history(self):
-        """Initialize chat history in session state"""
-        if self.chat_history_key not in st.session_state:
-            st.session_state[self.chat_history_key] = {}
+    for data, name in zip(sessions, archive_member_names(sessions, extension)):
+        size = add(name, chunks(data), data["timestamp"], stored=fmt in COMPRESSED_FORMATS)
+        manifest["sessions"].append({"name": data["name"], "file": name, "topic": data["topic"],
+                                     "saved_at": data["timestamp"], "message_count": data["message_count"],
+                                     "bytes": size})
+        yield sink.take()
+    add("manifest.json", [json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8")], exported_at)
+    bundle.close()
+    yield sink.take()
+
+class ChatManager:
+    def __init__(self):
+        self.store = get_chat_store()
+        self.user = st.session_state.get("username") or "anonymous"
     
     def save_current_chat(self, session_name: str = None) -> str:
-        """Save current chat session"""
+        """Save current chat session; re-saving writes only new messages"""
         if not session_name:
             session_name = f"Chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        chat_data = {
-            "name": session_name,
-            "timestamp": datetime.now().isoformat(),
-            "topic": st.session_state.get("current_topic", "General"),
-            "messages": st.session_state.get("messages", []),
-            "message_count": len(st.session_state.get("messages", []))
-        }
-        
-        st.session_state[self.chat_history_key][session_name] = chat_data
+        self.store.save(self.user, session_name, self._topic(), get_message_log())
         return session_name
     
     def load_chat(self, session_name: str) -> bool:
         """Load a saved chat session"""
-        if session_name in st.session_state[self.chat_history_key]:
-            chat_data = st.session_state[self.chat_history_key][session_name]
-            st.session_state.messages = chat_data["messages"]
-            st.session_state.current_topic = chat_data["topic"]
-            return True
-        return False
+        chat_data = self.store.get_chat(self.user, session_name)
+        if chat_data is None:
+            return False
+        messages = self.load_messages(chat_data)
+        st.session_state.messages = messages
+        st.session_state.current_topic = chat_data["topic"]
+        # Rebuild the tutor's memory so follow-up questions have the loaded context
+        if "conversation_id" in st.session_state:
+            from chains.conversational import get_conversation_engine
+            get_conversation_engine().restore_from_messages(st.session_state.conversation_id, messages)
+        return True
+    
+    def load_messages(self, chat_data: Dict) -> MessageLog:
+        """A saved chat's messages, read from the store"""
+        return MessageLog(self.store.iter_messages(self.user, chat_data["name"]))
     
     def delete_chat(self, session_name: str) -> bool:
         """Delete a saved chat session"""
-        if session_name in st.session_state[self.chat_history_key]:
-            del st.session_state[self.chat_history_key][session_name]
-            return True
-        return False
+        return self.store.delete(self.user, session_name)
+    
+    def get_saved_chats(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        """Saved chat metadata (name, topic, timestamp, message_count), newest first"""
+        return self.store.list_chats(self.user, limit, offset)
+    
+    def count_saved_chats(self, since: Optional[str] = None) -> int:
+        return self.store.count_chats(self.user, since)
     
-    def get_saved_chats(self) -> Dict[str, Dict]:
-        """Get all saved chat sessions"""
-        return st.session_state[self.chat_history_key]
+    def search_chats(self, query: str, topic: Optional[str] = None, modes: Optional[List[str]] = None,
+                     start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+        """Ranked matches in this user's saved chats; modes are SEARCH_MODES keys, dates inclusive"""
+        since = datetime.combine(start, datetime.min.time()).timestamp() if start else None
+        until = datetime.combine(end + timedelta(days=1), datetime.min.time()).timestamp() if end else None
+        types = [SEARCH_MODES[mode] for mode in modes or []]
+        return self.store.search(self.user, query, topic, types, since, until)
+    
+    def open_search_hit(self, hit: Dict) -> bool:
+        """Load the chat a search result is in, scrolled to the message"""
+        if not self.load_chat(hit["name"]):
+            return False
+        request_jump(hit["message_id"])
+        return True
+    
+    def _topic(self) -> str:
+        return st.session_state.get("current_topic", "General")
     
     def export_chat_json(self, messages: List[Dict] = None) -> str:
         """Export chat as JSON"""
-        if messages is None:
-            messages = st.session_state.get("messages", [])
-        
-        export_data = {
-            "export_info": {
-                "timestamp": datetime.now().isoformat(),
-                "topic": st.session_state.get("current_topic", "General"),
-                "app": "AI Learning Assistant",
-                "total_messages": len(messages)
-            },
-            "conversation": messages
-        }
-        
-        return json.dumps(export_data, indent=2, ensure_ascii=False)
+        return "".join(iter_chat_json(as_message_log(messages), self._topic()))
     
     def export_chat_txt(self, messages: List[Dict] = None) -> str:
         """Export chat as readable text"""
-        if messages is None:
-            messages = st.session_state.get("messages", [])
-        
-        text_lines = []
-        text_lines.append("=" * 50)
-        text_lines.append("AI LEARNING ASSISTANT - CHAT EXPORT")
-        text_lines.append("=" * 50)
-        text_lines.append(f"Topic: {st.session_state.get('current_topic', 'General')}")
-        text_lines.append(f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        text_lines.append(f"Total Messages: {len(messages)}")
-        text_lines.append("=" * 50)
-        text_lines.append("")
-        
-        for i, message in enumerate(messages, 1):
-            role = "🙋 YOU" if message["role"] == "user" else "🤖 AI ASSISTANT"
-            text_lines.append(f"[{i}] {role}:")
-            text_lines.append("-" * 30)
-            
-            if message["role"] == "assistant" and "type" in message:
-                if message["type"] == "structured":
-                    text_lines.append("📊 STRUCTURED ANALYSIS:")
-                    content = str(message["content"])
-                elif message["type"] == "parallel":
-                    text_lines.append("👥 MULTIPLE PERSPECTIVES:")
-                    content = "\n".join([f"\n{k.upper()}: {v}" for k, v in message["content"].items()])
-                else:
-                    content = message["content"]
-            else:
-                content = message["content"]
-            
-            text_lines.append(content)
-            text_lines.append("")
-        
-        text_lines.append("=" * 50)
-        text_lines.append("Generated by AI Learning Assistant")
-        text_lines.append("https://github.com/agentic-kiwi/streamlit-app")
-        
-        return "\n".join(text_lines)
+        return "".join(iter_chat_txt(as_message_log(messages), self._topic()))
     
     def export_chat_csv(self, messages: List[Dict] = None) -> str:
         """Export chat as CSV"""
-        if messages is None:
-            messages = st.session_state.get("messages", [])
+        return "".join(iter_chat_csv(as_message_log(messages), self._topic()))
+    
+    def export_chat_ndjson_gz(self, messages: List[Dict] = None) -> bytes:
+        """Export chat as gzip-compressed NDJSON"""
+        return b"".join(iter_chat_ndjson_gz(as_message_log(messages), self._topic()))
+    
+    def export_chat_parquet(self, messages: List[Dict] = None) -> bytes:
+        """Export chat as a Parquet table"""
+        return b"".join(iter_chat_parquet(as_message_log(messages), self._topic()))
+    
+    def deferred_export(self, fmt: str) -> Callable[[], bytes]:
+        """Data for st.download_button, built only when the download starts.
         
-        # Prepare data for CSV
-        csv_data = []
-        for i, message in enumerate(messages, 1):
-            row = {
-                "message_id": i,
-                "timestamp": datetime.now().isoformat(),
-                "role": message["role"],
-                "content": str(message["content"]),
-                "message_type": message.get("type", "standard"),
-                "topic": st.session_state.get("current_topic", "General")
-            }
-            csv_data.append(row)
+        The chat, topic and cache are captured now: the callable runs outside
+        the script run, without session state.
+        """
+        messages = get_message_log()
+        topic = self._topic()
+        cache = st.session_state.setdefault("export_cache", ExportCache())
+        return lambda: cache.get(fmt, messages, topic)
+    
+    def deferred_archive(self, fmt: str, archive: str, incremental: bool = False) -> Callable[[], bytes]:
+        """Data for st.download_button: every saved session in one archive.
         
-        # Create DataFrame and convert to CSV
-        df = pd.DataFrame(csv_data)
-        return df.to_csv(index=False)
+        With incremental, only sessions saved since the last archive export.
+        The export time is stored per user in the chat store, and only once
+        the whole archive has been built, so a failed export skips nothing.
+        """
+        def build() -> bytes:
+            since = self.store.last_export(self.user) if incremental else None
+            exported_at = datetime.now().isoformat()
+            sessions = self.store.list_chats(self.user, since=since, newest_first=False)
+            data = b"".join(iter_sessions_archive(sessions, fmt, archive, since, exported_at, self.load_messages))
+            self.store.mark_exported(self.user, exported_at)
+            return data
+        return build
+    
+    def last_archive_export(self) -> Optional[str]:
+        """ISO time of this user's last complete archive export, if any"""
+        return self.store.last_export(self.user)
     
     def create_download_link(self, content: str, filename: str, mime_type: str) -> str:
         """Create a download link for content"""
@@ -139,54 +580,86 @@ class ChatManager:
         return href
     
     def get_chat_stats(self, messages: List[Dict] = None) -> Dict[str, Any]:
-        """Get statistics about the chat"""
-        if messages is None:
-            messages = st.session_state.get("messages", [])
-        
-        user_messages = [m for m in messages if m["role"] == "user"]
-        assistant_messages = [m for m in messages if m["role"] == "assistant"]
+        """Get statistics about the chat; O(1), from the log's running counters"""
+        messages = as_message_log(messages)
         
-        total_chars = sum(len(str(m["content"])) for m in messages)
-        
-        stats = {
-            "total_messages": len(messages),
-            "user_messages": len(user_messages),
-            "assistant_messages": len(assistant_messages),
-            "total_characters": total_chars,
-            "avg_message_length": total_chars // len(messages) if messages else 0,
-            "topic": st.session_state.get("current_topic", "General"),
-            "conversation_started": "Yes" if messages else "No"
-        }
+        stats = messages.stats()
+        stats["topic"] = st.session_state.get("current_topic", "General")
+        stats["conversation_started"] = "Yes" if messages else "No"
         
         return stats
 
-def show_chat_export_ui():
-    """Show chat export interface in sidebar"""
+def show_saved_chats_page(page: int):
+    """Button callback: list another page of saved chats"""
+    st.session_state.saved_chats_page = page
+
+@st.fragment
+def show_chat_search_ui():
+    """Search the user's saved chats; call inside `with st.sidebar`.
+
+    Opening a result loads its chat and reruns the whole page, scrolled to
+    the message.
+    """
     chat_manager = ChatManager()
-    messages = st.session_state.get("messages", [])
-    
-    if not messages:
-        st.sidebar.info("💬 Start a conversation to enable export options")
+    if not chat_manager.count_saved_chats():
         return
     
-    st.sidebar.markdown("### 💾 Chat Management")
+    with st.expander("🔎 Search Saved Chats"):
+        query = st.text_input("Search", placeholder="chunking strategies", key="chat_search_query")
+        topic = st.selectbox("Topic", [ALL_TOPICS] + chat_manager.store.list_topics(chat_manager.user),
+                             key="chat_search_topic")
+        modes = st.multiselect("Mode", list(SEARCH_MODES), key="chat_search_modes")
+        col1, col2 = st.columns(2)
+        with col1:
+            start = st.date_input("From", value=None, key="chat_search_from")
+        with col2:
+            end = st.date_input("To", value=None, key="chat_search_to")
+        
+        if not query.strip():
+            return
+        hits = chat_manager.search_chats(query, None if topic == ALL_TOPICS else topic, modes, start, end)
+        if not hits:
+            st.caption("No matches")
+        for hit in hits:
+            icon = "🙋" if hit["role"] == Role.USER.value else "🤖"
+            if st.button(f"{icon} {hit['name']}", key=f"search_{hit['name']}_{hit['message_id']}",
+                         use_container_width=True):
+                if chat_manager.open_search_hit(hit):
+                    st.rerun()
+            st.caption(f"{hit['snippet']}  \n📅 {datetime.fromtimestamp(hit['ts']):%Y-%m-%d} · {hit['topic']}")
+
+@st.fragment
+def show_chat_export_ui():
+    """Show chat export interface; call inside `with st.sidebar`.
+
+    A fragment, so its buttons rerun only this panel. Loading a chat reruns
+    the whole page.
+    """
+    chat_manager = ChatManager()
+    messages = get_message_log()
+    
+    st.markdown("### 💾 Chat Management")
     
     # Save current chat
-    with st.sidebar.expander("💾 Save Chat"):
-        save_name = st.text_input("Chat Name", placeholder="My Learning Session", key="save_chat_name")
-        if st.button("💾 Save Current Chat", use_container_width=True):
-            if save_name:
-                session_name = chat_manager.save_current_chat(save_name)
-                st.success(f"✅ Chat saved as '{session_name}'")
-            else:
-                session_name = chat_manager.save_current_chat()
-                st.success(f"✅ Chat saved as '{session_name}'")
-    
-    # Load saved chats
-    saved_chats = chat_manager.get_saved_chats()
-    if saved_chats:
-        with st.sidebar.expander("📂 Load Saved Chats"):
-            for name, data in saved_chats.items():
+    if messages:
+        with st.expander("💾 Save Chat"):
+            save_name = st.text_input("Chat Name", placeholder="My Learning Session", key="save_chat_name")
+            if st.button("💾 Save Current Chat", use_container_width=True):
+                if save_name:
+                    session_name = chat_manager.save_current_chat(save_name)
+                    st.success(f"✅ Chat saved as '{session_name}'")
+                else:
+                    session_name = chat_manager.save_current_chat()
+                    st.success(f"✅ Chat saved as '{session_name}'")
+    
+    # Load saved chats, a page at a time
+    saved_count = chat_manager.count_saved_chats()
+    if saved_count:
+        with st.expander("📂 Load Saved Chats"):
+            pages = (saved_count + SAVED_CHATS_PAGE_SIZE - 1) // SAVED_CHATS_PAGE_SIZE
+            page = min(st.session_state.get("saved_chats_page", 0), pages - 1)
+            for data in chat_manager.get_saved_chats(SAVED_CHATS_PAGE_SIZE, page * SAVED_CHATS_PAGE_SIZE):
+                name = data["name"]
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     if st.button(f"📄 {name}", key=f"load_{name}", use_container_width=True):
@@ -197,12 +670,56 @@ def show_chat_export_ui():
                     if st.button("🗑️", key=f"delete_{name}", help=f"Delete {name}"):
                         if chat_manager.delete_chat(name):
                             st.success(f"🗑️ Deleted '{name}'")
-                            st.rerun()
+                            st.rerun(scope="fragment")
                 
                 st.caption(f"📅 {data['timestamp'][:16]} | 💬 {data['message_count']} msgs")
+            
+            if pages > 1:
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col1:
+                    st.button("◀", key="saved_chats_prev", disabled=page == 0,
+                              on_click=show_saved_chats_page, args=(page - 1,))
+                with col2:
+                    st.caption(f"Page {page + 1} of {pages}")
+                with col3:
+                    st.button("▶", key="saved_chats_next", disabled=page >= pages - 1,
+                              on_click=show_saved_chats_page, args=(page + 1,))
+    
+    # Every saved session in one file
+    if saved_count:
+        with st.expander("🗄️ Export All Saved Chats"):
+            col1, col2 = st.columns(2)
+            with col1:
+                fmt = st.selectbox("File format", list(EXPORT_FORMATS), key="archive_format",
+                                   format_func=lambda name: EXPORT_FORMATS[name][3])
+            with col2:
+                archive = st.selectbox("Archive", list(ARCHIVE_FORMATS), key="archive_type")
+            last_export = chat_manager.last_archive_export()
+            incremental = st.checkbox("Only chats saved since the last export", key="archive_incremental",
+                                      disabled=not last_export)
+            count = chat_manager.count_saved_chats(last_export if incremental else None)
+            if last_export:
+                st.caption(f"Last export: {last_export[:16]}. Remembered for your account, and only updated "
+                           "once an archive has been built in full, so a failed download skips no chats.")
+            else:
+                st.caption("Your first complete export is remembered, so later ones can include only newer chats.")
+            mime, extension = ARCHIVE_FORMATS[archive]
+            st.download_button(
+                label=f"📦 Download {count} chat{'s' if count != 1 else ''}",
+                data=chat_manager.deferred_archive(fmt, archive, incremental and bool(last_export)),
+                file_name=f"chats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                mime=mime,
+                on_click="ignore",
+                disabled=not count,
+                use_container_width=True
+            )
+    
+    if not messages:
+        st.info("💬 Start a conversation to enable export options")
+        return
     
     # Export options
-    with st.sidebar.expander("📤 Export Chat"):
+    with st.expander("📤 Export Chat"):
         st.markdown("**Choose format:**")
         
         # Chat stats
@@ -210,45 +727,19 @@ def show_chat_export_ui():
         st.metric("Messages", stats["total_messages"])
         st.metric("Characters", stats["total_characters"])
         
-        # Export buttons
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            # JSON Export
-            if st.button("📋 JSON", use_container_width=True):
-                json_content = chat_manager.export_chat_json()
-                filename = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                st.download_button(
-                    label="📥 Download JSON",
-                    data=json_content,
-                    file_name=filename,
-                    mime="application/json",
-                    use_container_width=True
-                )
-        
-        with col2:
-            # TXT Export
-            if st.button("📝 TXT", use_container_width=True):
-                txt_content = chat_manager.export_chat_txt()
-                filename = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                st.download_button(
-                    label="📥 Download TXT",
-                    data=txt_content,
-                    file_name=filename,
-                    mime="text/plain",
-                    use_container_width=True
-                )
-        
-        # CSV Export
-        if st.button("📊 CSV", use_container_width=True):
-            csv_content = chat_manager.export_chat_csv()
-            filename = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            st.download_button(
-                label="📥 Download CSV",
-                data=csv_content,
-                file_name=filename,
-                mime="text/csv",
-                use_container_width=True
-            )
+        # Each file is generated when its button is clicked, not on every rerun
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        formats = list(EXPORT_FORMATS.items())
+        for row_start in range(0, len(formats), 3):
+            for column, (fmt, (_, mime, extension, label)) in zip(st.columns(3), formats[row_start:row_start + 3]):
+                with column:
+                    st.download_button(
+                        label=label,
+                        data=chat_manager.deferred_export(fmt),
+                        file_name=f"chat_{stamp}.{extension}",
+                        mime=mime,
+                        on_click="ignore",
+                        use_container_width=True
+                    )
         
-        st.info("💡 Files download to your Downloads folder")
\ No newline at end of file
+        st.info("💡 Files download to your Downloads folder")
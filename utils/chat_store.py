@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Search rows are keyed by chat ID and message position packed into one rowid,
+# so a chat's rows are one rowid range
+POSITION_BITS = 32
+
+
+def search_rowid(chat_id: int, position: int) -> int:
+    return (chat_id << POSITION_BITS) | position
+
+
+def user_token(user: str) -> str:
+    """A single search-index token standing for a user"""
+    return "u" + hashlib.sha1(user.encode("utf-8")).hexdigest()[:20]
+
+
+def search_text(content: Any) -> str:
+    """Plain text of a message's content for the search index"""
+    if isinstance(content, dict):
+        return "\n".join(search_text(value) for value in content.values() if value)
+    if isinstance(content, list):
+        return "\n".join(search_text(item) for item in content)
+    return str(content)
+
+
+def fts_query(text: str) -> str:
+    """An FTS5 query matching every word of free text, the last one as a prefix"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+SEARCH_INSERT = ("INSERT INTO message_search (rowid, text, user, type, message_id, role, ts) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+
+class ChatStore:
+    """Saved chats in SQLite, per user.
+
+    Chat metadata (name, topic, save time, message count) is in one table,
+    indexed by user and save time, so listing a page of chats never reads a
+    message. Messages are in their own table, one row per message, and are
+    only read when a chat is loaded or exported.
+
+    Saves are append-only: re-saving a chat that has only grown since it
+    was last saved inserts just the new messages. The FTS5 search index is
+    updated in the same transaction. Its rows carry the user and the
+    message type (for a question, its answer's type) as tokens, so those
+    filters are part of the full-text match rather than checked row by row.
+
+    Each user's last archive export time is kept here too, so "saved since
+    the last export" survives new sessions and restarts.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the tables"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chats (
+                id INTEGER PRIMARY KEY,
+                user TEXT NOT NULL,
+                name TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                saved_at TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                last_message_id TEXT,
+                UNIQUE (user, name)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_saved_at ON chats(user, saved_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (chat_id, position)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_exports (
+                user TEXT PRIMARY KEY,
+                exported_at TEXT NOT NULL
+            )
+        """)
+        indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_search'").fetchone()
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                text, user, type, message_id UNINDEXED, role UNINDEXED, ts UNINDEXED,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        if not indexed:
+            # Rank on the message text alone
+            conn.execute("INSERT INTO message_search (message_search, rank) VALUES ('rank', 'bm25(1.0, 0.0, 0.0)')")
+            # Index chats saved before there was a search index
+            for chat_id, user in conn.execute("SELECT id, user FROM chats").fetchall():
+                records = [json.loads(row[0]) for row in conn.execute(
+                    "SELECT data FROM chat_messages WHERE chat_id = ? ORDER BY position", (chat_id,))]
+                conn.executemany(SEARCH_INSERT, self._search_rows(chat_id, user, records, 0))
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _search_rows(chat_id: int, user: str, records: Sequence[Dict], first: int) -> Iterator[Tuple]:
+        """Search index rows for consecutive messages starting at position first"""
+        token = user_token(user)
+        for i, record in enumerate(records):
+            message_type = record.get("type") or "standard"
+            if record["role"] == "user" and i + 1 < len(records):
+                message_type = records[i + 1].get("type") or "standard"
+            yield (search_rowid(chat_id, first + i), search_text(record["content"]), token, message_type,
+                   record.get("id"), record["role"], record.get("ts"))
+
+    def _unindex(self, chat_id: int, first: int = 0):
+        self._conn.execute("DELETE FROM message_search WHERE rowid BETWEEN ? AND ?",
+                           (search_rowid(chat_id, first), search_rowid(chat_id + 1, 0) - 1))
+
+    @staticmethod
+    def _metadata(row) -> Dict[str, Any]:
+        return {"name": row[0], "topic": row[1], "timestamp": row[2], "message_count": row[3]}
+
+    def save(self, user: str, name: str, topic: str, messages: List[Any]) -> Dict[str, Any]:
+        """Save a chat under a name, replacing any chat of that name.
+
+        messages are Message objects (anything with .id and .to_dict()).
+        When the stored chat is a prefix of this one, only the messages
+        after it are written. Returns the chat's metadata and the position
+        of the first message written.
+        """
+        saved_at = datetime.now().isoformat()
+        last_id = messages[-1].id if messages else None
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, message_count, last_message_id FROM chats WHERE user = ? AND name = ?", (user, name)
+            ).fetchone()
+            if row is None:
+                chat_id = self._conn.execute(
+                    "INSERT INTO chats (user, name, topic, saved_at, message_count, last_message_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user, name, topic, saved_at, len(messages), last_id)
+                ).lastrowid
+                start = 0
+            else:
+                chat_id, stored_count, stored_last_id = row
+                grown = stored_count <= len(messages) and (
+                    stored_count == 0 or messages[stored_count - 1].id == stored_last_id)
+                if grown:
+                    start = stored_count
+                else:
+                    # A different chat saved under the same name
+                    self._conn.execute("DELETE FROM chat_messages WHERE chat_id = ?", (chat_id,))
+                    self._unindex(chat_id)
+                    start = 0
+                self._conn.execute(
+                    "UPDATE chats SET topic = ?, saved_at = ?, message_count = ?, last_message_id = ? WHERE id = ?",
+                    (topic, saved_at, len(messages), last_id, chat_id)
+                )
+            # A question saved before its answer is indexed again, now with the answer's type
+            first = start - 1 if start and messages[start - 1].role == "user" else start
+            records = [messages[position].to_dict() for position in range(first, len(messages))]
+            self._conn.executemany(
+                "INSERT INTO chat_messages (chat_id, position, data) VALUES (?, ?, ?)",
+                ((chat_id, first + i, json.dumps(record, ensure_ascii=False))
+                 for i, record in enumerate(records) if first + i >= start)
+            )
+            self._unindex(chat_id, first)
+            self._conn.executemany(SEARCH_INSERT, self._search_rows(chat_id, user, records, first))
+        return {"name": name, "topic": topic, "timestamp": saved_at, "message_count": len(messages),
+                "chat_id": chat_id, "written_from": start}
+
+    def list_chats(self, user: str, limit: Optional[int] = None, offset: int = 0,
+                   since: Optional[str] = None, newest_first: bool = True) -> List[Dict[str, Any]]:
+        """A page of a user's chat metadata; since keeps chats saved after an ISO time"""
+        query = "SELECT name, topic, saved_at, message_count FROM chats WHERE user = ?"
+        params: List[Any] = [user]
+        if since:
+            query += " AND saved_at > ?"
+            params.append(since)
+        query += f" ORDER BY saved_at {'DESC' if newest_first else 'ASC'} LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._metadata(row) for row in rows]
+
+    def count_chats(self, user: str, since: Optional[str] = None) -> int:
+        """Number of chats a user has saved, optionally only those saved after an ISO time"""
+        query, params = "SELECT COUNT(*) FROM chats WHERE user = ?", [user]
+        if since:
+            query += " AND saved_at > ?"
+            params.append(since)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def get_chat(self, user: str, name: str) -> Optional[Dict[str, Any]]:
+        """Metadata of one chat, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name, topic, saved_at, message_count FROM chats WHERE user = ? AND name = ?", (user, name)
+            ).fetchone()
+        return self._metadata(row) if row else None
+
+    def iter_messages(self, user: str, name: str) -> Iterable[Dict]:
+        """A chat's messages as dicts, in order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT m.data FROM chat_messages m JOIN chats c ON c.id = m.chat_id "
+                "WHERE c.user = ? AND c.name = ? ORDER BY m.position", (user, name)
+            ).fetchall()
+        return (json.loads(row[0]) for row in rows)
+
+    def list_topics(self, user: str) -> List[str]:
+        """Topics of a user's saved chats"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT topic FROM chats WHERE user = ? ORDER BY topic",
+                                      (user,)).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, user: str, query: str, topic: Optional[str] = None, types: Optional[List[str]] = None,
+               since: Optional[float] = None, until: Optional[float] = None, limit: int = 20,
+               candidates: int = 2000) -> List[Dict[str, Any]]:
+        """Best-matching messages in a user's saved chats, with a snippet each.
+
+        query is free text; every word must match, the last as a prefix.
+        types are message types (the answer's type for a question), since
+        and until are Unix times.
+
+        Scoring a match costs far more than finding it, so only the newest
+        candidates matches (after the filters) are ranked. A word found in
+        more messages than that is ranked within the newest chats.
+        """
+        words = fts_query(query)
+        if not words:
+            return []
+        match = f"text : ({words}) AND user : {user_token(user)}"
+        if types:
+            match += " AND type : (" + " OR ".join(f'"{message_type}"' for message_type in types) + ")"
+        where = "WHERE message_search MATCH ? AND c.user = ?"
+        params: List[Any] = [match, user]
+        if topic:
+            where += " AND c.topic = ?"
+            params.append(topic)
+        if since is not None:
+            where += " AND s.ts >= ?"
+            params.append(since)
+        if until is not None:
+            where += " AND s.ts < ?"
+            params.append(until)
+        tables = f"FROM message_search s JOIN chats c ON c.id = s.rowid >> {POSITION_BITS}"
+        with self._lock:
+            # The oldest of the newest candidates; none if fewer match
+            oldest = self._conn.execute(
+                f"SELECT s.rowid {tables} {where} ORDER BY s.rowid DESC LIMIT 1 OFFSET ?", params + [candidates - 1]
+            ).fetchone()
+            if oldest:
+                where += " AND s.rowid >= ?"
+                params.append(oldest[0])
+            rows = self._conn.execute(
+                "SELECT s.rowid, c.name, c.topic, s.message_id, s.role, s.type, s.ts, "
+                f"snippet(message_search, 0, '**', '**', '…', 16) {tables} {where} ORDER BY s.rank LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [{"name": row[1], "topic": row[2], "message_id": row[3],
+                 "position": row[0] & ((1 << POSITION_BITS) - 1), "role": row[4], "type": row[5], "ts": row[6],
+                 "snippet": row[7]} for row in rows]
+
+    def last_export(self, user: str) -> Optional[str]:
+        """ISO time of the user's last complete archive export, if any"""
+        with self._lock:
+            row = self._conn.execute("SELECT exported_at FROM archive_exports WHERE user = ?", (user,)).fetchone()
+        return row[0] if row else None
+
+    def mark_exported(self, user: str, exported_at: str):
+        """Record a complete archive export; the mark never moves backwards"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO archive_exports (user, exported_at) VALUES (?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET exported_at = max(exported_at, excluded.exported_at)",
+                (user, exported_at)
+            )
+
+    def delete(self, user: str, name: str) -> bool:
+        """Delete a chat, its messages and their search rows"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM chats WHERE user = ? AND name = ?", (user, name)).fetchone()
+            if row is None:
+                return False
+            self._unindex(row[0])
+            self._conn.execute("DELETE FROM chats WHERE id = ?", (row[0],))
+            return True
+
+
+_chat_store: Optional[ChatStore] = None
+_chat_store_lock = threading.Lock()
+
+
+def get_chat_store() -> ChatStore:
+    """Get the process-wide chat store, configured from the environment"""
+    global _chat_store
+    with _chat_store_lock:
+        if _chat_store is None:
+            _chat_store = ChatStore(os.getenv("CHAT_STORE_PATH", ".cache/chats.sqlite3"))
+        return _chat_store
@@ -132,23 +132,24 @@ def show_gdrive_export(chat_content: str, filename: str):
         - Collaboration features
         """)
 
+@st.fragment
 def show_quick_gdrive_actions():
-    """Show quick Google Drive actions in sidebar"""
-    st.sidebar.markdown("### 🔗 Google Drive")
+    """Show quick Google Drive actions; call inside `with st.sidebar`"""
+    st.markdown("### 🔗 Google Drive")
     
     # Quick actions
-    col1, col2 = st.sidebar.columns(2)
+    col1, col2 = st.columns(2)
     
     with col1:
         if st.button("📂 Open Drive", use_container_width=True):
-            st.sidebar.markdown("[🚀 Google Drive](https://drive.google.com)")
+            st.markdown("[🚀 Google Drive](https://drive.google.com)")
     
     with col2:
         if st.button("📝 New Doc", use_container_width=True):
-            st.sidebar.markdown("[📄 New Google Doc](https://docs.google.com/document/create)")
+            st.markdown("[📄 New Google Doc](https://docs.google.com/document/create)")
     
     # Tips
-    st.sidebar.info("""
+    st.info("""
     💡 **Quick tip:** 
     Export your chat first, then use Google Drive's upload feature!
     """)
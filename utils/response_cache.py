@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+# Modes cache answers by default; the Interactive Tutor is excluded because its
+# answers depend on the conversation history, not just the question
+DEFAULT_CACHED_MODES = "quick,deep,parallel"
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivial differences map to the same cache key"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+class ResponseCache:
+    """Persistent exact-match cache of chain responses backed by SQLite.
+
+    Entries are keyed on the normalized question plus topic, mode, model,
+    temperature and prompt-template version. Values are stored as JSON, so
+    callers keep structured results in a form they can rebuild directly.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 5000,
+                 enabled_modes: str = DEFAULT_CACHED_MODES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled_modes = {m.strip() for m in enabled_modes.split(",") if m.strip()}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the table"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                mode TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        conn.commit()
+        return conn
+
+    def is_enabled(self, mode: str) -> bool:
+        """Check whether a mode has opted in to caching"""
+        return mode in self.enabled_modes
+
+    @staticmethod
+    def make_key(mode: str, question: str, topic: str, model_name: str, temperature: float,
+                 prompt_version: str) -> str:
+        """Build the cache key for a request"""
+        parts = [mode, normalize_question(question), topic.strip().lower(), model_name,
+                 f"{float(temperature):.2f}", prompt_version]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _count(self, mode: str, outcome: str):
+        counters = self.counters.setdefault(mode, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def get(self, mode: str, question: str, topic: str, model_name: str, temperature: float,
+            prompt_version: str) -> Optional[Any]:
+        """Get a cached value, or None on a miss"""
+        if not self.is_enabled(mode):
+            return None
+        key = self.make_key(mode, question, topic, model_name, temperature, prompt_version)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self._count(mode, "misses")
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._count(mode, "hits")
+        return json.loads(row[0])
+
+    def set(self, mode: str, question: str, topic: str, model_name: str, temperature: float,
+            prompt_version: str, value: Any):
+        """Store a JSON-serializable value"""
+        if not self.is_enabled(mode):
+            return
+        key = self.make_key(mode, question, topic, model_name, temperature, prompt_version)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, mode, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, mode, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get entry count and hit/miss counters"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = sum(c["hits"] for c in self.counters.values())
+        misses = sum(c["misses"] for c in self.counters.values())
+        return {"entries": entries, "hits": hits, "misses": misses, "by_mode": dict(self.counters)}
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Get the process-wide response cache, configured from the environment"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                db_path=os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite3"),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))),
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+                enabled_modes=os.getenv("RESPONSE_CACHE_MODES", DEFAULT_CACHED_MODES)
+            )
+        return _response_cache
+
+
+def lookup_response(mode: str, question: str, topic: str, model_name: str, temperature: float,
+                    prompt_version: str) -> Optional[Any]:
+    """Check the exact-match cache, then fall back to the semantic cache"""
+    # Imported here because the semantic cache builds on this module
+    from utils.semantic_cache import get_semantic_cache
+
+    value = get_response_cache().get(mode, question, topic, model_name, temperature, prompt_version)
+    if value is None:
+        value = get_semantic_cache().get(mode, question, topic, model_name, temperature, prompt_version)
+    return value
+
+
+def store_response(mode: str, question: str, topic: str, model_name: str, temperature: float,
+                   prompt_version: str, value: Any):
+    """Save a response to both the exact-match and semantic caches"""
+    from utils.semantic_cache import get_semantic_cache
+
+    get_response_cache().set(mode, question, topic, model_name, temperature, prompt_version, value)
+    get_semantic_cache().set(mode, question, topic, model_name, temperature, prompt_version, value)
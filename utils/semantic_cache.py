@@ -0,0 +1,362 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.response_cache import DEFAULT_CACHED_MODES, normalize_question
+
+DEFAULT_THRESHOLDS = "quick=0.92,deep=0.92,parallel=0.92"
+
+# Articles and prepositions only; question words, negations and numbers change the question
+STOP_WORDS = set("a an the of to in on at by for with from about into".split())
+
+QUESTION_WORDS = {"what", "why", "how", "when", "where", "which", "who", "whom", "whose"}
+NEGATIONS = {"not", "no", "never", "without", "cannot", "nor"}
+# Verbs that take "n't", so "dont" and "don't" both read as "do not"
+AUXILIARIES = {"ca", "can", "could", "do", "does", "did", "is", "are", "was", "were", "has", "have", "had",
+               "should", "would", "wo", "must", "need"}
+
+
+def _words(text: str) -> List[str]:
+    """Split a question into words, expanding "n't" and "what's" style contractions"""
+    words = []
+    for word in re.findall(r"[\w']+", normalize_question(text)):
+        word = word.replace("'", "")
+        if word.endswith("nt") and word[:-2] in AUXILIARIES:
+            words.extend([{"ca": "can", "wo": "will"}.get(word[:-2], word[:-2]), "not"])
+            continue
+        if word.endswith("s") and word[:-1] in QUESTION_WORDS:
+            word = word[:-1]
+        if word not in STOP_WORDS:
+            words.append(word)
+    return words
+
+
+def key_terms(text: str) -> str:
+    """The question words, negations and numbers in a question, in order.
+
+    Questions that differ in these ("What is RAG?" / "Why RAG?", "use" /
+    "not use", "3 examples" / "10 examples") never match, however close
+    their vectors are.
+    """
+    return " ".join(w for w in _words(text) if w in QUESTION_WORDS or w in NEGATIONS or w.isdigit())
+
+
+class HashedNgramEmbedder:
+    """Embed text as a signed, hashed bag of character n-grams and words.
+
+    Needs nothing beyond NumPy and is deterministic across processes, so
+    vectors written by one server process stay valid for the next.
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: Tuple[int, int] = (3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @staticmethod
+    def _stem(word: str) -> str:
+        """Crude suffix stripping so "simply" and "simple" share a feature"""
+        if len(word) > 4 and word.endswith(("bly", "ply", "tly")):
+            return word[:-1]
+        for suffix in ("ingly", "edly", "ing", "ly", "es", "ed", "s", "e", "y"):
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                return word[:-len(suffix)]
+        return word
+
+    def _features(self, text: str) -> List[str]:
+        words = [w if w in QUESTION_WORDS or w in NEGATIONS else self._stem(w) for w in _words(text)]
+        # Whole words count double so they outweigh shared n-grams
+        features = [f"w:{w}" for w in words] * 2
+        low, high = self.ngram_range
+        for word in words:
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return a unit-length float32 vector"""
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in self._features(text)), dtype=np.uint32)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes.size:
+            signs = np.where(hashes & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, (hashes >> 1) % self.dim, signs)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class _TopicPartition:
+    """Vectors and slot metadata for a single topic"""
+
+    def __init__(self, path: str, capacity: int, dim: int):
+        mode = "r+" if os.path.exists(path) else "w+"
+        self.vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self.variants = np.full(capacity, "", dtype=object)
+        # Normalized question and key terms per slot
+        self.questions = np.full(capacity, "", dtype=object)
+        self.terms = np.full(capacity, "", dtype=object)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.created_at = np.zeros(capacity, dtype=np.float64)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+
+
+class SemanticCache:
+    """Answer cache matching paraphrased questions by cosine similarity.
+
+    Each topic gets its own memory-mapped float32 matrix of question vectors,
+    so lookups only scan the entries for the current topic. Answers and slot
+    metadata live in SQLite next to the vectors. Only the most recently used
+    max_open_topics are kept in memory, and at most max_topics are kept on
+    disk; the least recently written topics are dropped first.
+    """
+
+    def __init__(self, cache_dir: str, thresholds: str = DEFAULT_THRESHOLDS,
+                 enabled_modes: str = DEFAULT_CACHED_MODES, max_entries_per_topic: int = 2000,
+                 ttl: float = 7 * 24 * 3600, top_k: int = 5, embedder: Optional[HashedNgramEmbedder] = None,
+                 max_open_topics: int = 32, max_topics: int = 200):
+        self.cache_dir = cache_dir
+        self.thresholds = self._parse_thresholds(thresholds)
+        self.enabled_modes = {m.strip() for m in enabled_modes.split(",") if m.strip()}
+        self.capacity = max_entries_per_topic
+        self.ttl = ttl
+        self.top_k = top_k
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.max_open_topics = max_open_topics
+        self.max_topics = max_topics
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._partitions: "OrderedDict[str, _TopicPartition]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "entries.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                topic_key TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                variant TEXT NOT NULL,
+                question TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (topic_key, slot)
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _parse_thresholds(thresholds: str) -> Dict[str, float]:
+        parsed = {}
+        for item in thresholds.split(","):
+            if "=" in item:
+                mode, value = item.split("=", 1)
+                parsed[mode.strip()] = float(value)
+        return parsed
+
+    @staticmethod
+    def _variant(mode: str, model_name: str, temperature: float, prompt_version: str) -> str:
+        """Entries only match requests with the same mode, model and prompt"""
+        return f"{mode}|{model_name}|{float(temperature):.2f}|{prompt_version}"
+
+    @staticmethod
+    def _topic_key(topic: str) -> str:
+        return hashlib.sha256(topic.strip().lower().encode()).hexdigest()[:16]
+
+    def is_enabled(self, mode: str) -> bool:
+        """Check whether a mode has opted in to semantic matching"""
+        return mode in self.enabled_modes and mode in self.thresholds
+
+    def _path(self, topic_key: str) -> str:
+        return os.path.join(self.cache_dir, f"{topic_key}.f32")
+
+    def _partition(self, topic_key: str, create: bool = False) -> Optional[_TopicPartition]:
+        """Load a topic's vectors and slot metadata on first use; None if the topic has no file yet"""
+        partition = self._partitions.get(topic_key)
+        if partition is not None:
+            self._partitions.move_to_end(topic_key)
+            return partition
+        path = self._path(topic_key)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            # Rows without vectors are useless, and a new file may push the cache over max_topics
+            self._conn.execute("DELETE FROM entries WHERE topic_key = ?", (topic_key,))
+            self._prune_topics()
+        partition = _TopicPartition(path, self.capacity, self.embedder.dim)
+        rows = self._conn.execute(
+            "SELECT slot, variant, question, created_at, hits FROM entries WHERE topic_key = ? AND slot < ?",
+            (topic_key, self.capacity)
+        ).fetchall()
+        for slot, variant, question, created_at, hits in rows:
+            partition.variants[slot] = variant
+            partition.questions[slot] = normalize_question(question)
+            partition.terms[slot] = key_terms(question)
+            partition.active[slot] = True
+            partition.created_at[slot] = created_at
+            partition.hits[slot] = hits
+        self._partitions[topic_key] = partition
+        # Vectors are flushed on every write, so a closed topic reloads from disk intact
+        while len(self._partitions) > self.max_open_topics:
+            self._partitions.popitem(last=False)
+        return partition
+
+    def _prune_topics(self):
+        """Drop expired entries, then the least recently written topics beyond max_topics - 1"""
+        self._conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,))
+        topics = [key for (key,) in self._conn.execute(
+            "SELECT topic_key FROM entries GROUP BY topic_key ORDER BY MAX(created_at) DESC"
+        )]
+        keep = set(topics[:max(self.max_topics - 1, 0)])
+        for topic_key in topics[len(keep):]:
+            self._conn.execute("DELETE FROM entries WHERE topic_key = ?", (topic_key,))
+        self._conn.commit()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".f32") and name[:-4] not in keep:
+                self._partitions.pop(name[:-4], None)
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _count(self, mode: str, outcome: str):
+        counters = self.counters.setdefault(mode, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def search(self, mode: str, question: str, topic: str, model_name: str, temperature: float,
+               prompt_version: str) -> List[Tuple[float, int]]:
+        """Return up to top_k (similarity, slot) pairs for live, matching entries"""
+        variant = self._variant(mode, model_name, temperature, prompt_version)
+        query = self.embedder.embed(question)
+        with self._lock:
+            partition = self._partition(self._topic_key(topic))
+            if partition is None:
+                return []
+            candidates = partition.active & (partition.variants == variant)
+            candidates &= partition.terms == key_terms(question)
+            candidates &= partition.created_at >= time.time() - self.ttl
+            slots = np.flatnonzero(candidates)
+            if not slots.size:
+                return []
+            similarities = partition.vectors[slots] @ query
+        k = min(self.top_k, slots.size)
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+        return [(float(similarities[i]), int(slots[i])) for i in best]
+
+    def get(self, mode: str, question: str, topic: str, model_name: str, temperature: float,
+            prompt_version: str) -> Optional[Any]:
+        """Get the answer to the most similar cached question above the mode's threshold"""
+        if not self.is_enabled(mode):
+            return None
+        matches = self.search(mode, question, topic, model_name, temperature, prompt_version)
+        if not matches or matches[0][0] < self.thresholds[mode]:
+            self._count(mode, "misses")
+            return None
+        slot = matches[0][1]
+        topic_key = self._topic_key(topic)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE topic_key = ? AND slot = ?", (topic_key, slot)
+            ).fetchone()
+            if row is None:
+                self._count(mode, "misses")
+                return None
+            partition = self._partition(topic_key)
+            if partition is not None:
+                partition.hits[slot] += 1
+            self._conn.execute(
+                "UPDATE entries SET hits = hits + 1 WHERE topic_key = ? AND slot = ?", (topic_key, slot)
+            )
+            self._conn.commit()
+            self._count(mode, "hits")
+        return json.loads(row[0])
+
+    def set(self, mode: str, question: str, topic: str, model_name: str, temperature: float,
+            prompt_version: str, value: Any):
+        """Add a question and its answer to the topic's index"""
+        if not self.is_enabled(mode):
+            return
+        variant = self._variant(mode, model_name, temperature, prompt_version)
+        vector = self.embedder.embed(question)
+        topic_key = self._topic_key(topic)
+        now = time.time()
+        with self._lock:
+            partition = self._partition(topic_key, create=True)
+            slot = self._duplicate_slot(partition, variant, question)
+            if slot is None:
+                slot = self._free_slot(partition, now)
+            partition.vectors[slot] = vector
+            partition.vectors.flush()
+            partition.variants[slot] = variant
+            partition.questions[slot] = normalize_question(question)
+            partition.terms[slot] = key_terms(question)
+            partition.active[slot] = True
+            partition.created_at[slot] = now
+            partition.hits[slot] = 0
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (topic_key, slot, variant, question, value, created_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (topic_key, slot, variant, question, json.dumps(value, ensure_ascii=False), now)
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _duplicate_slot(partition: _TopicPartition, variant: str, question: str) -> Optional[int]:
+        """Find an entry for the same question, so re-storing it overwrites instead of duplicating"""
+        same = partition.active & (partition.variants == variant)
+        same &= partition.questions == normalize_question(question)
+        slots = np.flatnonzero(same)
+        return int(slots[0]) if slots.size else None
+
+    def _free_slot(self, partition: _TopicPartition, now: float) -> int:
+        """Find an empty slot, evicting by age and then by access count"""
+        expired = partition.active & (partition.created_at < now - self.ttl)
+        partition.active[expired] = False
+        free = np.flatnonzero(~partition.active)
+        if free.size:
+            return int(free[0])
+        # Full: drop the least used entry, oldest first among equals
+        order = np.lexsort((partition.created_at, partition.hits))
+        return int(order[0])
+
+    def clear(self):
+        """Remove every entry in every topic"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._partitions.clear()
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".f32"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get entry count and hit/miss counters"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        hits = sum(c["hits"] for c in self.counters.values())
+        misses = sum(c["misses"] for c in self.counters.values())
+        return {"entries": entries, "hits": hits, "misses": misses, "by_mode": dict(self.counters)}
+
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Get the process-wide semantic cache, configured from the environment"""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                cache_dir=os.getenv("SEMANTIC_CACHE_DIR", ".cache/semantic"),
+                thresholds=os.getenv("SEMANTIC_CACHE_THRESHOLDS", DEFAULT_THRESHOLDS),
+                enabled_modes=os.getenv("SEMANTIC_CACHE_MODES", DEFAULT_CACHED_MODES),
+                max_entries_per_topic=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000")),
+                ttl=float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600))),
+                max_open_topics=int(os.getenv("SEMANTIC_CACHE_OPEN_TOPICS", "32")),
+                max_topics=int(os.getenv("SEMANTIC_CACHE_MAX_TOPICS", "200"))
+            )
+        return _semantic_cache
@@ -0,0 +1,121 @@
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator
+
+
+class _Flight:
+    """One in-flight call and everything it has produced so far"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into a single upstream call.
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait for and share its result. Streams are pumped by a background
+    thread into a shared buffer that every subscriber replays from the start,
+    so late joiners still get the whole answer. Works across Streamlit script
+    threads in one process. The chains build keys with flight_key, so only
+    identical requests on the same API key share a call.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.saved = 0
+
+    def _join(self, key: str):
+        """Return (flight, is_leader) for a key"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.saved += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.done = True
+            flight.condition.notify_all()
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        """Run call, or wait for the identical call already in flight"""
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                flight.result = call()
+            except Exception as e:
+                flight.error = e
+            finally:
+                self._finish(key, flight)
+        else:
+            with flight.condition:
+                flight.condition.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key: str, start: Callable[[], Iterable]) -> Iterator:
+        """Subscribe to a shared stream, starting it if nobody else has"""
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, start), name="single-flight", daemon=True).start()
+        return self._replay(flight)
+
+    def _pump(self, key: str, flight: _Flight, start: Callable[[], Iterable]):
+        """Drive the upstream iterator into the shared buffer"""
+        try:
+            for chunk in start():
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight)
+
+    @staticmethod
+    def _replay(flight: _Flight) -> Iterator:
+        position = 0
+        while True:
+            with flight.condition:
+                flight.condition.wait_for(lambda: position < len(flight.chunks) or flight.done)
+                chunks = flight.chunks[position:]
+                finished = flight.done
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if finished and position == len(flight.chunks):
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    def stats(self) -> Dict[str, int]:
+        """Upstream calls made and calls saved by sharing"""
+        with self._lock:
+            return {"calls": self.calls, "saved": self.saved, "in_flight": len(self._flights)}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide single-flight group"""
+    return _single_flight
+
+
+def flight_key(api_key: str, request_key: str) -> str:
+    """Scope a request key to one API key, so a shared call is only billed to its own account"""
+    from config.gemini_setup import ModelPool
+    return f"{ModelPool.hash_api_key(api_key)}:{request_key}"
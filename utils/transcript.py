@@ -0,0 +1,132 @@
+import json
+import uuid
+from typing import Dict, List, Optional
+import streamlit as st
+
+# Turns (question + answer) at the end of the chat rendered in full on every rerun
+RECENT_TURNS = 10
+# Older messages are shown one page at a time
+PAGE_SIZE = 20
+HIDDEN_PAGE = -1
+
+TOPIC_SECTIONS = [
+    ("sub_topics", "📚 Sub-topics"),
+    ("real_world_examples", "🌍 Real-world Examples"),
+    ("connection_to_main_topic", "🧩 How It Connects"),
+    ("future_learning_resources", "🔗 Learning Resources"),
+    ("quizz_me_on_it", "❓ Quiz"),
+]
+
+TYPE_ICONS = {"structured": "🔍", "parallel": "👥"}
+
+
+def message_id(message: Dict) -> str:
+    """Stable ID of a message, assigned the first time it is asked for"""
+    if "id" not in message:
+        message["id"] = uuid.uuid4().hex[:12]
+    return message["id"]
+
+
+def topic_markdown(data: Dict) -> str:
+    """Markdown for the sections of a Deep Dive answer"""
+    parts = []
+    if data.get("main_topic"):
+        parts.append(f"#### {data['main_topic']}")
+    for field, title in TOPIC_SECTIONS:
+        value = data.get(field)
+        if not value:
+            continue
+        if isinstance(value, list):
+            parts.append(f"**{title}**\n\n" + "\n".join(f"- {item}" for item in value))
+        else:
+            parts.append(f"**{title}**\n\n{value}")
+    return "\n\n".join(parts)
+
+
+def message_markdown(message: Dict) -> str:
+    """The whole of a message as one markdown string"""
+    content = message["content"]
+    message_type = message.get("type") if message["role"] == "assistant" else None
+    if message_type == "structured":
+        data = content.model_dump() if hasattr(content, "model_dump") else content
+        if isinstance(data, dict):
+            return "### 🔍 Deep Dive Analysis\n\n" + topic_markdown(data)
+        return f"```json\n{json.dumps(data, indent=2, default=str)}\n```"
+    if message_type == "parallel":
+        sections = [f"**{perspective.capitalize()} Perspective**\n\n{text}" for perspective, text in content.items()]
+        return "### 👥 Multiple Viewpoints\n\n" + "\n\n---\n\n".join(sections)
+    return str(content)
+
+
+def cached_markdown(message: Dict, cache: Dict[str, str]) -> str:
+    """message_markdown, cached by message ID; messages don't change once added"""
+    key = message_id(message)
+    text = cache.get(key)
+    if text is None:
+        text = cache[key] = message_markdown(message)
+    return text
+
+
+def prune_cache(cache: Dict[str, str], messages: List[Dict]):
+    """Drop cached markdown for messages no longer in the chat"""
+    if len(cache) > 2 * len(messages):
+        live = {message.get("id") for message in messages}
+        for key in [key for key in cache if key not in live]:
+            del cache[key]
+
+
+def recent_start(count: int, recent_turns: int = RECENT_TURNS) -> int:
+    """Index of the first message rendered in full"""
+    return max(0, count - 2 * recent_turns)
+
+
+def page_of(position: int, page_size: int = PAGE_SIZE) -> int:
+    """Start index of the page holding a message"""
+    return position - position % page_size
+
+
+def build_message_index(messages: List[Dict]) -> List[Dict]:
+    """Jump targets: one entry per question, labelled with the answer's mode"""
+    index = []
+    for position, message in enumerate(messages):
+        if message["role"] != "user":
+            continue
+        answer = messages[position + 1] if position + 1 < len(messages) else {}
+        icon = TYPE_ICONS.get(answer.get("type"), "💬")
+        question = " ".join(str(message["content"]).split())
+        index.append({
+            "id": message_id(message),
+            "position": position,
+            "label": f"#{position + 1} {icon} {question[:60]}{'…' if len(question) > 60 else ''}",
+        })
+    return index
+
+
+def cached_message_index(messages) -> List[Dict]:
+    """build_message_index, kept in session state until the chat changes.
+
+    Keyed by (message count, last message ID) like ExportCache: messages are
+    only ever appended, so an unchanged key means an unchanged index.
+    """
+    key = (len(messages), messages.last_id)
+    entry = st.session_state.get("transcript_index")
+    if entry is None or entry[0] != key:
+        entry = st.session_state.transcript_index = (key, build_message_index(messages))
+    return entry[1]
+
+
+def find_message(messages: List[Dict], target_id: str) -> Optional[int]:
+    """Position of the message with an ID, if it is in the chat"""
+    return next((i for i, message in enumerate(messages) if message.get("id") == target_id), None)
+
+
+def scroll_script(target_id: str) -> str:
+    """An anchor that scrolls itself into view when rendered with st.html"""
+    anchor = f"msg-{target_id}"
+    return (f'<div id="{anchor}"></div>'
+            f'<script>document.getElementById("{anchor}").scrollIntoView({{behavior: "smooth", block: "start"}});</script>')
+
+
+def request_jump(target_id: str):
+    """Open the transcript at a message on its next render"""
+    st.session_state.transcript_scroll_to = target_id